@@ -4,6 +4,7 @@ from .core import parse
 from .core import plot
 from .core import simulate
 from .core import statistics
+from .lib.argparse import BoundedInt
 from cdc import __version__
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
@@ -16,7 +17,7 @@ log = logging.getLogger(__name__)
 def create_arg_parser():
     p = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
     p.add_argument(
-        '--seed', type=int,
+        '--seed', type=BoundedInt(0),
         help='Seed the RNG with this value for reproducible results')
     p.add_argument(
         '--log-level', type=str, default='info',
@@ -4,17 +4,22 @@ import json
 import logging
 import sys
 
-from scipy.stats import scoreatpercentile as percentile
-import matplotlib
-matplotlib.use('Agg')
-import pylab as plt  # noqa
-
-plt.rcParams.update({
-    'axes.grid': True,
-})
 log = logging.getLogger(__name__)
 
 
+def _pyplot():
+    ''' Import pylab and set it up for plotting to files. Importing it
+    takes most of a second, so this is only done once something is plotted,
+    and not by every cdc command '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import pylab as plt
+    plt.rcParams.update({
+        'axes.grid': True,
+    })
+    return plt
+
+
 def data_sets_from_input(fd):
     for line in fd:
         yield json.loads(line, cls=NumericKeyDecoder)
@@ -94,7 +99,9 @@ def plot(
     Where each key is an x value and the key's value is the corresponding y
     value. All data sets must have the same exact set of keys.
     '''
+    from scipy.stats import scoreatpercentile as percentile
     assert file_format in 'png svg svgz'.split(' ')
+    plt = _pyplot()
     plt.figure()
     d = None
     for data_set in data_sets:
@@ -5,20 +5,25 @@ import json
 import logging
 import sys
 
-import matplotlib
-matplotlib.use('Agg')
-import pylab as plt  # noqa
-
-plt.rcParams.update({
-    'axes.grid': True,
-    'savefig.format': 'png',
-})
 log = logging.getLogger(__name__)
 EXPECTED_LABEL = 'Expected'
 BAR_WIDTH_SINGLE = 0.5
 BAR_WIDTH_DOUBLE = 0.4
 
 
+def _pyplot():
+    ''' Import and set up pylab. It is slow to import, so only do it when
+    actually plotting '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import pylab as plt
+    plt.rcParams.update({
+        'axes.grid': True,
+        'savefig.format': 'png',
+    })
+    return plt
+
+
 def roll_events_from_input(fd):
     for line in fd:
         yield RollEvent.from_dict(json.loads(line))
@@ -77,6 +82,7 @@ def plot(out_fd, data_set, add_expected=False):
             12: 1,
         }
     '''
+    plt = _pyplot()
     plt.figure()
     ymax = 0
     data_sets = [data_set]
@@ -1,23 +1,65 @@
-from ..lib.argparse import BoundedInt
+from ..lib.argparse import BoundedFloat, BoundedInt
 from ..util.json import NumericKeyDecoder
-from ..util.rand import roll_die_with_weights
+from ..util.stats import antithetic_effective_sample_size, RunningStats
+from ..util import rand
+from ..util.rand import IndependentDice, JointDice, PAIRS, PAIR_DICE
 from ..lib.strategy import CrapsRoll as R, Strategy
+from ..lib.vector import BuiltinStrategy, BUILTIN_STRATEGIES
+from ..lib import exact
 
 from ..lib import stratlang as lang
 
-from argparse import ArgumentDefaultsHelpFormatter, FileType
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentTypeError,\
+    FileType
 from datetime import datetime
+from functools import partial
+import itertools
 import multiprocessing as mp
 import json
 import logging
+import mmap
+import os
 import sys
+import threading
+
+import numpy as np
 
 log = logging.getLogger(__name__)
+# How many rolls to generate at once when simulating
+ROLL_CHUNK_SIZE = 10000
+# How many rolls to put on each line of rollseries output
+ROLLSERIES_LINE_LEN = 20
+# When simulating until a target confidence is reached, how many repeats must
+# be done before trusting the estimated variance
+MIN_ADAPTIVE_REPEAT = 30
+# How many rolls of rollseries output each worker process generates at once.
+# Must be a multiple of ROLLSERIES_LINE_LEN
+ROLLSERIES_SEGMENT_SIZE = 1000000
+# The most memory the bankrolls of one block of tables may take up when
+# simulating with the vector engine. Each table needs 8 bytes per roll.
+VECTOR_BLOCK_BYTES = 64 * 1024 * 1024
+# The most tables to simulate at once with the vector engine
+VECTOR_MAX_TABLES = 4096
+# Where to read the strategy from if --input-strategy isn't given
+DEFAULT_INPUT_STRATEGY = 'custom.strategy'
+# The two ASCII digits representing each pair index in a roll series
+_ROLLSERIES_TOKENS = PAIR_DICE + ord('0')
 
 
 class UserDefinedStrategy(Strategy):
     def __init__(self, logic, *a, **kw):
-        self._logic = [_ for _ in logic]
+        ''' logic is either a parsed program or a lang.Program. Many
+        strategies can share a Program, which saves parsing and compiling the
+        program for each of them.
+
+        Only as many rolls as the program looks back at are kept, and no
+        time is spent on bets it can't make. See Strategy. '''
+        if not isinstance(logic, lang.Program):
+            logic = lang.Program(logic)
+        self._program = logic
+        self.max_lookback = logic.analysis.max_lookback
+        self.uses_counters = logic.analysis.uses_counters
+        self.bet_types = logic.analysis.bet_types
         super().__init__('User Strat', *a, **kw)
 
     @staticmethod
@@ -34,112 +76,8 @@ class UserDefinedStrategy(Strategy):
         logic = lang.parse_stream(fd)
         return UserDefinedStrategy._from(logic)
 
-    def _varid_to_value(self, var_id):
-        try:
-            return {
-                lang.VarId.Bankroll: self.bankroll,
-                lang.VarId.Point: self.point,
-            }[var_id]
-        except KeyError:
-            raise NotImplementedError('Can\'t get value for %s' % var_id)
-
-    def _listid_to_value(self, list_id):
-        try:
-            return {
-                lang.ListId.Rolls: self.rolls,
-            }[list_id]
-        except KeyError:
-            raise NotImplementedError('Can\'t get list value for %s' % list_id)
-
-    def _reduce_binop(self, bin_op, user_vars):
-        # print('Reducing:', bin_op)
-        ii = isinstance
-        left = self._reduce_binop(bin_op.left, user_vars)\
-            if ii(bin_op.left, lang.BinOp) else bin_op.left
-        right = self._reduce_binop(bin_op.right, user_vars)\
-            if ii(bin_op.right, lang.BinOp) else bin_op.right
-        left = self._varid_to_value(left)\
-            if ii(left, lang.VarId) else left
-        right = self._varid_to_value(right)\
-            if ii(right, lang.VarId) else right
-        left = left.get(self._listid_to_value(left.list_id))\
-            if ii(left, (lang.TailOp, lang.LenOp)) else left
-        right = right.get(self._listid_to_value(right.list_id))\
-            if ii(right, (lang.TailOp, lang.LenOp)) else right
-        left = left.value if ii(left, R) else left
-        right = right.value if ii(right, R) else right
-        left = user_vars[left.id] if ii(left, lang.UserVar) else left
-        right = user_vars[right.id] if ii(right, lang.UserVar) else right
-        # print('l/r', left, right)
-        return {
-            lang.BinOpId.Eq:    lambda l_, r_: l_  == r_,
-            lang.BinOpId.Neq:   lambda l_, r_: l_  != r_,
-            lang.BinOpId.Gt:    lambda l_, r_: l_   > r_,
-            lang.BinOpId.Lt:    lambda l_, r_: l_   < r_,
-            lang.BinOpId.Gteq:  lambda l_, r_: l_  >= r_,
-            lang.BinOpId.Lteq:  lambda l_, r_: l_  <= r_,
-            lang.BinOpId.And:   lambda l_, r_: l_ and r_,
-            lang.BinOpId.Or:    lambda l_, r_: l_  or r_,
-            lang.BinOpId.Plus:  lambda l_, r_: l_   + r_,
-            lang.BinOpId.Minus: lambda l_, r_: l_   - r_,
-            lang.BinOpId.Mult:  lambda l_, r_: l_   * r_,
-            lang.BinOpId.Div:   lambda l_, r_: l_   / r_,
-            lang.BinOpId.Mod:   lambda l_, r_: l_   % r_,
-        }[bin_op.op](left, right)
-
     def make_bets(self):
-        ii = isinstance
-        user_vars = {}
-        # make a copy of logic in reverse. Use this as a call stack of sorts
-        stack = self._logic[::-1]
-        while len(stack):
-            # Get item off top of stack
-            item = stack.pop()
-            # Begin: determine what type it is, and act as necessary
-            if ii(item, lang.MakeBetOp):
-                # print('Making bet', item.bet)
-                self.add_bet(item.bet)
-            elif ii(item, lang.CondOp):
-                if ii(item.cond, lang.BinOp):
-                    res = self._reduce_binop(item.cond, user_vars)
-                else:
-                    res = bool(item.cond)
-                if res:
-                    stack.append(item.true_case)
-                else:
-                    stack.append(item.false_case)
-            elif ii(item, lang.AssignOp):
-                if ii(item.expr, lang.BinOp):
-                    res = self._reduce_binop(item.expr, user_vars)
-                else:
-                    res = item.expr
-                # print('Setting', item.var, 'to', res)
-                user_vars[item.var] = res
-            elif ii(item, tuple):
-                # reverse so first is on top of stack
-                stack.extend(item[::-1])
-            elif ii(item, (int, float)) or item is None:
-                pass
-            elif ii(item, lang.UserVar):
-                print(item.id, 'is', user_vars[item.id])
-            else:
-                print('WARN IGNORING :::', type(item), item)
-                raise NotImplementedError(
-                    'Did not handle item type %s' % type(item).__name__)
-            # End: determine what type it is
-
-
-# Split a list into batches of size n
-# https://stackoverflow.com/q/8290397
-def _batch(iterable, n=1):
-    current_batch = []
-    for item in iterable:
-        current_batch.append(item)
-        if len(current_batch) == n:
-            yield current_batch
-            current_batch = []
-    if current_batch:
-        yield current_batch
+        self._program(self)
 
 
 def _calc_die_weights(stats):
@@ -150,75 +88,682 @@ def _calc_die_weights(stats):
     return [v for v in weights.values()]
 
 
-def roll_weighted_dice_repeatedly(weights, times):
-    for _ in range(times):
-        yield roll_die_with_weights(weights), roll_die_with_weights(weights)
+def _calc_pair_weights(stats):
+    ''' Turn the 2-layer "pairs" dict, which only counts unordered pairs,
+    into weights for all 36 ordered pairs in pair index order. A non-double
+    pair could have been rolled either way around, so give each order the
+    full count and count doubles twice to keep them in proportion. '''
+    pairs = stats['pairs']
+    weights = []
+    for d1, d2 in PAIRS:
+        lo, hi = min(d1, d2), max(d1, d2)
+        assert lo in pairs and hi in pairs[lo]
+        count = pairs[lo][hi]
+        assert isinstance(count, int) or isinstance(count, float)
+        weights.append(count * 2 if d1 == d2 else count)
+    return weights
+
+
+def _make_dice_model(dice_model, stats):
+    if dice_model == 'pairs':
+        return JointDice(_calc_pair_weights(stats))
+    assert dice_model == 'dice'
+    return IndependentDice(_calc_die_weights(stats))
+
+
+def roll_weighted_dice_repeatedly_batched(
+        dice, times, chunk_size=ROLL_CHUNK_SIZE, rng=None):
+    ''' Generate times rolls of a pair of dice, yielding them as arrays of at
+    most chunk_size pair indexes each. dice is a DiceModel '''
+    while times > 0:
+        n = min(times, chunk_size)
+        yield dice.roll_pairs(n, rng=rng)
+        times -= n
+
+
+def roll_weighted_dice_repeatedly(dice, times, rng=None):
+    for chunk in roll_weighted_dice_repeatedly_batched(
+            dice, times, rng=rng):
+        for pair_idx in chunk.tolist():
+            yield PAIRS[pair_idx]
+
+
+def encode_rollseries(pairs, line_len=ROLLSERIES_LINE_LEN):
+    ''' Encode an array of pair indexes as plain-text roll series bytes,
+    line_len rolls per line separated by spaces. The last line ends with a
+    newline even if it isn't full.
+
+    When encoding a long roll series a piece at a time, every piece but the
+    last must have a multiple of line_len rolls. '''
+    if not len(pairs):
+        return b''
+    # Each roll takes 3 bytes: its two digits and a space or newline after it
+    out = np.empty((len(pairs), 3), dtype=np.uint8)
+    out[:, :2] = _ROLLSERIES_TOKENS[pairs]
+    out[:, 2] = ord(' ')
+    out[line_len-1::line_len, 2] = ord('\n')
+    out[-1, 2] = ord('\n')
+    return out.tobytes()
+
+
+def _rollseries_segment(params):
+    ''' Roll and encode one segment of a roll series in a worker process '''
+    dice, entropy, repeat, start_roll, num_rolls = params
+    stream = rand.RollStream(
+        entropy, repeat, dice.uniforms_per_roll, start_roll)
+    return encode_rollseries(dice.roll_pairs(num_rolls, rng=stream))
+
+
+def _rollseries_segments(dice, entropy, repeat, start_roll, num_rolls):
+    for i in range(0, num_rolls, ROLLSERIES_SEGMENT_SIZE):
+        n = min(ROLLSERIES_SEGMENT_SIZE, num_rolls - i)
+        yield dice, entropy, repeat, start_roll + i, n
 
 
 def do_rollseries(args, stats):
-    weights = _calc_die_weights(stats)
+    dice = _make_dice_model(args.dice_model, stats)
+    entropy = rand.seed_entropy()
+    repeat = args.only_repeat if args.only_repeat is not None else 0
     header = '## cdc simluation run at %s\n'\
         '## simulating %d dice rolls\n'\
-        '## weights: %s\n' % (datetime.now(), args.rolls, weights)
+        '## seed: %d repeat: %d start roll: %d\n'\
+        '## dice model: %s\n'\
+        '## weights: %s\n' % (
+            datetime.now(), args.rolls, entropy, repeat, args.start_roll,
+            args.dice_model, dice.weights)
     args.output.write(header)
-    for batch in _batch(
-            roll_weighted_dice_repeatedly(weights, args.rolls), n=20):
-        s = ' '.join(str(pair[0])+str(pair[1]) for pair in batch)
-        args.output.write('%s\n' % s)
-
-
-def f(_):
+    args.output.flush()
+    out = args.output.buffer
+    segments = _rollseries_segments(
+        dice, entropy, repeat, args.start_roll, args.rolls)
+    # Every segment comes from its own place in the stream, so they can be
+    # generated in parallel and the output is the same as generating them one
+    # after another
+    if args.workers == 1 or args.rolls <= ROLLSERIES_SEGMENT_SIZE:
+        for seg in segments:
+            out.write(_rollseries_segment(seg))
+    else:
+        # Only hand out a few segments per worker at a time so finished
+        # segments can't pile up in memory if writing falls behind
+        window = args.workers * 4
+        with mp.Pool(args.workers) as pool:
+            while True:
+                batch = list(itertools.islice(segments, window))
+                if not batch:
+                    break
+                for data in pool.imap(_rollseries_segment, batch):
+                    out.write(data)
+    out.flush()
+
+
+def do_tape(args, stats):
+    ''' Write a roll tape: --repeat runs of --rolls rolls each, one byte per
+    roll holding its pair index. Repeat k takes up bytes [k * rolls,
+    (k + 1) * rolls) and has the same rolls as repeat k of a bankroll
+    simulation with the same --seed, --dice-model, and
+    --variance-reduction. '''
+    dice = repeat_dice(
+        _make_dice_model(args.dice_model, stats), args.variance_reduction)
+    entropy = rand.seed_entropy()
+    log.info(
+        'Writing %d repeats of %d rolls to tape with seed %d', args.repeat,
+        args.rolls, entropy)
+    args.output.flush()
+    out = args.output.buffer
+    for repeat in range(args.repeat):
+        stream = repeat_stream(
+            entropy, repeat, dice.uniforms_per_roll,
+            variance_reduction=args.variance_reduction)
+        for chunk in roll_weighted_dice_repeatedly_batched(
+                dice, args.rolls, rng=stream):
+            out.write(chunk.tobytes())
+    out.flush()
+
+
+def do_snapshot(args, stats):
+    ''' Play --input-strategy (or --builtin-strategy) for --rolls rolls of
+    one repeat (--only-repeat, or else repeat 0) and write a snapshot of the
+    table at the end, for bankroll simulations to start from with --snapshot
+    '''
+    dice = repeat_dice(
+        _make_dice_model(args.dice_model, stats), args.variance_reduction)
+    entropy = rand.seed_entropy()
+    repeat = args.only_repeat if args.only_repeat is not None else 0
+    if args.builtin_strategy is not None:
+        strat = args.builtin_strategy.make_strategy()
+    else:
+        strat_text = _read_input_strategy(args)
+        if strat_text is None:
+            return 1
+        strat = UserDefinedStrategy.from_string(strat_text)
+    stream = repeat_stream(
+        entropy, repeat, dice.uniforms_per_roll, args.start_roll,
+        args.variance_reduction)
+    log.info(
+        'Playing %d rolls of repeat %d with seed %d for a snapshot',
+        args.rolls, repeat, entropy)
+    for chunk in roll_weighted_dice_repeatedly_batched(
+            dice, args.rolls, rng=stream):
+        for pair_idx in chunk.tolist():
+            strat.make_bets()
+            strat.resolve_roll(R.from_index(pair_idx))
+    json.dump(strat.snapshot(), args.output)
+    args.output.write('\n')
+
+
+def _read_input_strategy(args):
+    ''' Return the text of --input-strategy, or None after logging why it
+    couldn't be read. The default file is only opened here, so output that
+    doesn't play a user strategy doesn't need it to exist. '''
+    if args.input_strategy is None:
+        try:
+            args.input_strategy = open(DEFAULT_INPUT_STRATEGY, 'rt')
+        except OSError as e:
+            log.error(
+                'Can\'t read the strategy from %s: %s. Give --input-strategy '
+                'or --builtin-strategy', DEFAULT_INPUT_STRATEGY, e.strerror)
+            return None
+    return args.input_strategy.read()
+
+
+def do_exact(args, stats):
+    ''' Calculate the exact long run expected value and variance of
+    --input-strategy or --builtin-strategy, per roll and per shooter hand, by
+    solving it as a Markov chain. See cdc.lib.exact '''
+    if args.builtin_strategy is not None:
+        make_new_strat = args.builtin_strategy.make_strategy
+    else:
+        strat_text = _read_input_strategy(args)
+        if strat_text is None:
+            return 1
+        program = lang.Program(lang.parse(strat_text))
+        if program.analysis.uses_bankroll or program.analysis.uses_num_rolls:
+            log.error(
+                'The strategy can\'t be evaluated exactly because it looks at '
+                'its bankroll or at the number of rolls so far')
+            return 1
+        make_new_strat = partial(UserDefinedStrategy, program)
+    dice = _make_dice_model(args.dice_model, stats)
+    try:
+        res = exact.evaluate(
+            make_new_strat, dice.pair_probabilities(),
+            max_states=args.max_states)
+    except exact.TooManyStatesError as e:
+        log.error('The strategy can\'t be evaluated exactly: %s', e)
+        return 1
+    log.info('Solved a Markov chain with %d states', res['states'])
+    json.dump(res, args.output)
+    args.output.write('\n')
+
+
+def open_roll_tape(fname):
+    ''' Map the given roll tape into memory read only and return it as a
+    numpy array of pair indexes without copying it '''
+    with open(fname, 'rb') as fd:
+        if not os.fstat(fd.fileno()).st_size:
+            return np.zeros(0, dtype=np.uint8)
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mm, dtype=np.uint8)
+
+
+def _repeat_pair_chunks(repeat):
+    ''' Yield arrays of the pair indexes for the given repeat, read from the
+    roll tape if there is one and rolled otherwise '''
+    if tape is not None:
+        start = repeat * num_rolls
+        for i in range(start, start + num_rolls, ROLL_CHUNK_SIZE):
+            yield tape[i:min(i + ROLL_CHUNK_SIZE, start + num_rolls)]
+        return
+    yield from roll_weighted_dice_repeatedly_batched(
+        dice, num_rolls, rng=repeat_stream(
+            entropy, repeat, dice.uniforms_per_roll, start_roll,
+            variance_reduction))
+
+
+def repeat_stream(
+        entropy, repeat, uniforms_per_roll, start_roll=0,
+        variance_reduction='none'):
+    ''' Return the RollStream for the given repeat. With antithetic variance
+    reduction, repeats 2k and 2k+1 are a pair: the former uses stream k and
+    the latter its antithetic twin. '''
+    if variance_reduction == 'antithetic':
+        return rand.RollStream(
+            entropy, repeat // 2, uniforms_per_roll, start_roll,
+            antithetic=bool(repeat % 2))
+    assert variance_reduction == 'none'
+    return rand.RollStream(entropy, repeat, uniforms_per_roll, start_roll)
+
+
+def repeat_dice(dice, variance_reduction='none'):
+    ''' Return the DiceModel to turn repeat_stream()s into rolls with. With
+    antithetic variance reduction, that is a rand.AntitheticDice, so the two
+    repeats of a pair get opposite rolls and not just opposite dice. '''
+    if variance_reduction == 'antithetic':
+        return rand.AntitheticDice(dice)
+    assert variance_reduction == 'none'
+    return dice
+
+
+class StopRules:
+    ''' When to end a repeat before all its rolls are played: as soon as the
+    bankroll is stop_loss or more below where it started, win_goal or more
+    above it, or max_drawdown or more below the highest it has been. Any of
+    them can be None to not use it, and otherwise must be more than 0.
+
+    The bankroll doesn't include chips on the table, so a bet lowers it as
+    soon as it is made, before the roll it is made for. '''
+    def __init__(self, stop_loss=None, win_goal=None, max_drawdown=None):
+        self.stop_loss = stop_loss
+        self.win_goal = win_goal
+        self.max_drawdown = max_drawdown
+
+    def __bool__(self):
+        return any(x is not None for x in (
+            self.stop_loss, self.win_goal, self.max_drawdown))
+
+    def bounds(self, start):
+        ''' Return the bankrolls at or below and at or above which to stop,
+        not counting max_drawdown, given the starting bankroll '''
+        return (
+            start - self.stop_loss if self.stop_loss is not None
+            else float('-inf'),
+            start + self.win_goal if self.win_goal is not None
+            else float('inf'))
+
+    def hits(self, bankrolls, start, peak):
+        ''' Given an array of shape (runs, rolls) of bankrolls, and arrays of
+        each run's starting bankroll and the highest bankroll before these
+        rolls, return a mask of the rolls after which the runs should stop
+        and the new highest bankrolls '''
+        low, high = self.bounds(start)
+        hit = (bankrolls <= np.asarray(low)[..., None]) | \
+            (bankrolls >= np.asarray(high)[..., None])
+        peaks = np.maximum.accumulate(
+            np.maximum(bankrolls, peak[:, None]), axis=1)
+        if self.max_drawdown is not None:
+            hit |= bankrolls <= peaks - self.max_drawdown
+        return hit, peaks[:, -1]
+
+
+def f(repeat):
     strat = make_new_strat()
     data_set = {}
-    next_jump = 10
-    for i, pair in enumerate(
-            roll_weighted_dice_repeatedly(weights, num_rolls)):
+    pairs = (
+        PAIRS[pair_idx]
+        for chunk in _repeat_pair_chunks(repeat)
+        for pair_idx in chunk.tolist())
+    # Stop as soon as the bankroll is at or below floor or at or above
+    # ceiling. With a max drawdown, the floor rises with the bankroll.
+    low, ceiling = stop_rules.bounds(strat.bankroll)
+    drawdown = stop_rules.max_drawdown
+    peak = strat.bankroll
+    floor = low if drawdown is None else max(low, peak - drawdown)
+    for i, pair in enumerate(pairs, start=start_roll):
         strat.make_bets()
-        strat.after_roll(R(*pair))
-        if True or not i % int(next_jump / 10):
-            data_set[i] = strat.bankroll
-        if i == next_jump:
-            next_jump *= 10
+        strat.resolve_roll(R(*pair))
+        bankroll = strat.bankroll
+        data_set[i] = bankroll
+        if drawdown is not None and bankroll > peak:
+            peak = bankroll
+            floor = max(low, peak - drawdown)
+        if bankroll <= floor or bankroll >= ceiling:
+            break
+    # Carry the last bankroll forward through the rolls that were skipped
+    end = start_roll + num_rolls
+    for j in range(i + 1, end):
+        data_set[j] = bankroll
     semaphore.acquire()
-    return data_set
+    return repeat, data_set, end - 1 - i
 
 
-def _init_bankroll_globals(semaphore_, weights_, num_rolls_, make_new_strat_):
-    global semaphore, weights, num_rolls, make_new_strat
+def _init_bankroll_globals(
+        semaphore_, dice_, num_rolls_, make_new_strat_, entropy_,
+        start_roll_, tape_fname, variance_reduction_, stop_rules_):
+    global semaphore, dice, num_rolls, make_new_strat, entropy, start_roll
+    global tape, variance_reduction, stop_rules
     semaphore = semaphore_
-    weights = weights_
+    variance_reduction = variance_reduction_
+    dice = repeat_dice(dice_, variance_reduction)
+    entropy = entropy_
+    start_roll = start_roll_
+    # Every worker maps the same tape, so the OS shares the pages between them
+    tape = open_roll_tape(tape_fname) if tape_fname is not None else None
     num_rolls = num_rolls_
     make_new_strat = make_new_strat_
+    stop_rules = stop_rules_
+
+
+def _dispatch_until(repeats, window, stop, keep_pairs):
+    ''' Yield from repeats, but wait for a slot in the window before each one
+    and give up as soon as stop is set. If keep_pairs, don't stop between two
+    repeats of an antithetic pair. '''
+    for repeat in repeats:
+        window.acquire()
+        if stop.is_set() and not (keep_pairs and repeat % 2):
+            return
+        yield repeat
+
+
+def _vector_block(repeats):
+    ''' Simulate the given repeats together on a vector strategy and return
+    them with an array of each one's bankroll after every roll, and an array
+    of how many rolls each skipped because of the stop rules '''
+    strat = make_new_strat(len(repeats))
+    out = np.empty((len(repeats), num_rolls), dtype=np.float64)
+    start = strat.bankroll.copy()
+    peak = start.copy()
+    # The roll after which each run stopped, or num_rolls if it hasn't
+    stopped = np.full(len(repeats), num_rolls)
+    i = 0
+    for chunks in zip(*(_repeat_pair_chunks(r) for r in repeats)):
+        pairs = np.stack(chunks)
+        n = pairs.shape[1]
+        out[:, i:i + n] = strat.play(pairs)
+        if stop_rules:
+            hit, peak = stop_rules.hits(out[:, i:i + n], start, peak)
+            new = (stopped == num_rolls) & hit.any(axis=1)
+            stopped[new] = i + hit[new].argmax(axis=1)
+        i += n
+        # Tables play in lockstep, so rolls can only be skipped once all of
+        # them have stopped
+        if (stopped < num_rolls).all():
+            break
+    for row, at in enumerate(stopped.tolist()):
+        out[row, at + 1:] = out[row, min(at, num_rolls - 1)]
+    return repeats, out, np.maximum(num_rolls - 1 - stopped, 0)
+
+
+def vector_bankroll_over_time_repeatedly(
+        dice, make_new_vector, num_rolls, num_repeat,
+        entropy=None, first_repeat=0, workers=None, start_roll=0,
+        tape_fname=None, variance_reduction='none', stop=None,
+        stop_rules=None, skipped=None):
+    ''' The same as bankroll_over_time_repeatedly(), but every worker
+    simulates a block of runs at once with the VectorStrategy that
+    make_new_vector returns given how many tables it needs. Runs get the same
+    rolls as they would from bankroll_over_time_repeatedly(). '''
+    assert tape_fname is None or not start_roll
+    assert tape_fname is None or variance_reduction == 'none'
+    if entropy is None:
+        entropy = rand.seed_entropy()
+    if workers is None:
+        workers = mp.cpu_count()
+    if stop_rules is None:
+        stop_rules = StopRules()
+    block_size = max(1, min(
+        VECTOR_MAX_TABLES, VECTOR_BLOCK_BYTES // (8 * num_rolls),
+        -(-num_repeat // workers)))
+    if stop is not None:
+        # Check whether to stop often enough not to waste much
+        block_size = max(1, min(block_size, MIN_ADAPTIVE_REPEAT))
+    if variance_reduction == 'antithetic' and block_size > 1:
+        block_size -= block_size % 2
+    end = first_repeat + num_repeat
+    blocks = (
+        range(b, min(b + block_size, end))
+        for b in range(first_repeat, end, block_size))
+    # Only have a few blocks handed out at a time so their results can't
+    # pile up in memory if writing them out falls behind
+    window = threading.Semaphore(workers * 2)
+    blocks = _dispatch_until(
+        blocks, window, stop if stop is not None else threading.Event(),
+        False)
+    rolls = range(start_roll, start_roll + num_rolls)
+    with mp.Pool(
+            workers,
+            initializer=_init_bankroll_globals,
+            initargs=(
+                None, dice, num_rolls, make_new_vector,
+                entropy, start_roll, tape_fname,
+                variance_reduction, stop_rules)) as pool:
+        for repeats, out, skipped_ in pool.imap_unordered(
+                _vector_block, blocks):
+            for repeat, bankrolls, n in zip(
+                    repeats, out, skipped_.tolist()):
+                if skipped is not None:
+                    skipped[repeat] = n
+                yield repeat, dict(zip(rolls, bankrolls.tolist()))
+            window.release()
 
 
 def bankroll_over_time_repeatedly(
-        stats, make_new_strat, num_rolls, num_repeat):
-    weights = _calc_die_weights(stats)
+        dice, make_new_strat, num_rolls, num_repeat,
+        entropy=None, first_repeat=0, workers=None, start_roll=0,
+        tape_fname=None, variance_reduction='none', stop=None,
+        stop_rules=None, skipped=None):
+    ''' Simulate num_repeat independent runs of num_rolls rolls each, yielding
+    (index, bankroll over time) of each run as it finishes (so not
+    necessarily in order).
+
+    Each run has an index, starting at first_repeat, and its dice are rolled
+    from a stream derived from entropy and that index alone. Thus the results
+    are reproducible regardless of the number of workers, and a large run can
+    be split into smaller ones with different first_repeat values. If entropy
+    is not given, use rand.seed_entropy().
+
+    If start_roll is given, skip straight to that roll in each run's stream
+    and start the strategy there with a fresh table.
+
+    If tape_fname is given, read the rolls from that roll tape instead of
+    rolling them, with run k using the kth num_rolls rolls on the tape. Every
+    strategy run against the same tape sees the exact same rolls.
+
+    If variance_reduction is 'antithetic', runs are generated in pairs where
+    the second uses the complement of every uniform random number the first
+    used, and a 7 in one is a 6 or an 8 in the other. See repeat_stream()
+    and repeat_dice().
+
+    If stop (a threading.Event) is given, stop handing out runs as soon as it
+    is set. Runs already handed out are still finished and yielded.
+
+    If stop_rules (a StopRules) is given, end each run as soon as it says to.
+    The last bankroll is carried forward through the rest of the rolls. If
+    skipped (a dict) is given, the number of rolls each run skipped is stored
+    in it by index. '''
+    assert tape_fname is None or not start_roll
+    assert tape_fname is None or variance_reduction == 'none'
+    if entropy is None:
+        entropy = rand.seed_entropy()
+    if workers is None:
+        workers = mp.cpu_count()
+    if stop_rules is None:
+        stop_rules = StopRules()
     chunk_size = 32
-    cpu_count = mp.cpu_count()
-    semaphore = mp.Semaphore(chunk_size * cpu_count)
+    repeats = range(first_repeat, first_repeat + num_repeat)
+    window = None
+    if stop is not None:
+        # Hand out few runs at a time so not much is wasted once stopped.
+        # The window must be a multiple of the chunk size, or the pool could
+        # wait forever for a chunk to fill up.
+        chunk_size = 4
+        window = threading.Semaphore(chunk_size * workers * 2)
+        repeats = _dispatch_until(
+            repeats, window, stop, variance_reduction == 'antithetic')
+    semaphore = mp.Semaphore(chunk_size * workers)
     with mp.Pool(
+            workers,
             initializer=_init_bankroll_globals,
-            initargs=(semaphore, weights, num_rolls, make_new_strat)) as pool:
-        for res in pool.imap_unordered(f, range(num_repeat), chunk_size):
-            yield res
+            initargs=(
+                semaphore, dice, num_rolls, make_new_strat,
+                entropy, start_roll, tape_fname,
+                variance_reduction, stop_rules)) as pool:
+        for repeat, data_set, n in pool.imap_unordered(
+                f, repeats, chunk_size):
+            if skipped is not None:
+                skipped[repeat] = n
+            yield repeat, data_set
             semaphore.release()
+            if window is not None:
+                window.release()
 
 
 def do_bankroll(args, stats):
     count = 0
-    strat_text = args.input_strategy.read()
-    for res in bankroll_over_time_repeatedly(
-            stats,
-            lambda: UserDefinedStrategy.from_string(strat_text),
-            args.rolls, args.repeat):
-        json.dump(res, args.output)
+    dice = _make_dice_model(args.dice_model, stats)
+    entropy = rand.seed_entropy()
+    first_repeat, num_repeat = args.first_repeat, args.repeat
+    stop, final_stats = None, None
+    if args.only_repeat is not None:
+        first_repeat, num_repeat = args.only_repeat, 1
+    elif args.target_ci is not None:
+        num_repeat = args.max_repeat
+        stop = threading.Event()
+        final_stats = RunningStats()
+
+    repeatedly = bankroll_over_time_repeatedly
+    if args.builtin_strategy is not None:
+        make_new_strat = args.builtin_strategy.make_strategy
+    else:
+        strat_text = _read_input_strategy(args)
+        if strat_text is None:
+            return 1
+        # Parse and compile the strategy once. The Program is sent to the
+        # workers, and every repeat gets a fresh table that shares it.
+        make_new_strat = partial(
+            UserDefinedStrategy, lang.Program(lang.parse(strat_text)))
+    engine = args.engine
+    if engine == 'auto':
+        # The vector engine is far faster, but can only play the built-in
+        # strategies and can't restore a snapshot
+        engine = 'vector' if args.builtin_strategy is not None and \
+            args.snapshot is None else 'object'
+        log.info('Using the %s engine', engine)
+    if engine == 'vector':
+        if args.builtin_strategy is None:
+            log.error(
+                'The vector engine can only play a --builtin-strategy')
+            return 1
+        if args.snapshot is not None:
+            log.error('Cannot use --snapshot with the vector engine')
+            return 1
+        repeatedly = vector_bankroll_over_time_repeatedly
+        make_new_strat = args.builtin_strategy.make_vector
+    if args.snapshot is not None:
+        # Restore the snapshot once, and start every repeat from a copy
+        template = make_new_strat()
+        try:
+            template.restore(json.load(args.snapshot))
+        except ValueError as e:
+            log.error('Cannot start from %s: %s', args.snapshot.name, e)
+            return 1
+        make_new_strat = template.fork
+        log.info(
+            'Starting every repeat from the table in %s, with a bankroll of '
+            '%s after %d rolls', args.snapshot.name, template.bankroll,
+            len(template.rolls))
+    tape_fname = None
+    if args.roll_tape is not None:
+        tape_fname = args.roll_tape
+        on_tape = open_roll_tape(tape_fname)
+        if len(on_tape) < (first_repeat + num_repeat) * args.rolls:
+            log.error(
+                'Roll tape %s only has %d rolls, but need %d for repeats %d '
+                'through %d of %d rolls each', tape_fname, len(on_tape),
+                (first_repeat + num_repeat) * args.rolls, first_repeat,
+                first_repeat + num_repeat - 1, args.rolls)
+            return 1
+        if len(on_tape) and on_tape.max() >= len(PAIRS):
+            log.error('Roll tape %s is not a valid roll tape', tape_fname)
+            return 1
+        if args.start_roll:
+            log.error('Cannot use --start-roll with --roll-tape')
+            return 1
+        if args.variance_reduction != 'none':
+            log.error(
+                'Cannot use --variance-reduction with --roll-tape. Use it '
+                'when making the tape instead.')
+            return 1
+        del on_tape
+        log.info(
+            'Simulating repeats %d through %d from roll tape %s',
+            first_repeat, first_repeat + num_repeat - 1, tape_fname)
+    else:
+        log.info(
+            'Simulating repeats %d through %d with seed %d', first_repeat,
+            first_repeat + num_repeat - 1, entropy)
+    stop_rules = StopRules(
+        args.stop_loss, args.win_goal, args.max_drawdown)
+    # Final bankroll of each repeat, by index, for antithetic pairs
+    finals = {}
+    # Rolls skipped by each repeat because of stop_rules, by index
+    skipped = {}
+    for repeat, res in repeatedly(
+            dice, make_new_strat, args.rolls, num_repeat,
+            entropy=entropy, first_repeat=first_repeat,
+            workers=args.workers, start_roll=args.start_roll,
+            tape_fname=tape_fname,
+            variance_reduction=args.variance_reduction, stop=stop,
+            stop_rules=stop_rules, skipped=skipped):
+        final = res[max(res)]
+        if args.variance_reduction == 'antithetic':
+            finals[repeat] = final
+        if final_stats is not None:
+            # Antithetic pairs aren't independent, but pair means are
+            if args.variance_reduction != 'antithetic':
+                final_stats.add(final)
+            elif repeat ^ 1 in finals:
+                final_stats.add((final + finals[repeat ^ 1]) / 2)
+            if final_stats.n >= MIN_ADAPTIVE_REPEAT and \
+                    final_stats.ci_width() <= args.target_ci:
+                stop.set()
+        # Write whole bankrolls as ints, whichever engine played them and
+        # whether or not its payouts made them floats
+        json.dump({
+            i: int(b) if isinstance(b, float) and b.is_integer() else b
+            for i, b in res.items()}, args.output)
         args.output.write('\n')
         count += 1
         if not count % 1000:
             log.debug(
-                '%0.2f%% (%d/%d) done', 100*count/args.repeat, count,
-                args.repeat)
+                '%0.2f%% (%d/%d) done', 100*count/num_repeat, count,
+                num_repeat)
+    if stop_rules:
+        num_skipped = sum(skipped.values())
+        log.info(
+            '%d of %d repeats stopped early, skipping %d of %d rolls '
+            '(%0.1f%%)', sum(1 for n in skipped.values() if n), count,
+            num_skipped, count * args.rolls,
+            100 * num_skipped / max(count * args.rolls, 1))
+    if final_stats is not None:
+        log.info(
+            '%s the target after %d repeats (%d not needed). 95%% confidence '
+            'interval of the mean final bankroll is %0.2f +/- %0.2f',
+            'Reached' if stop.is_set() else 'Did not reach', count,
+            num_repeat - count, final_stats.mean,
+            final_stats.ci_width() / 2)
+    if args.variance_reduction == 'antithetic':
+        pairs = [
+            (finals[i], finals[i+1]) for i in finals
+            if not i % 2 and i+1 in finals]
+        ess, rho = antithetic_effective_sample_size(pairs)
+        log.info(
+            'Effective sample size of the final bankroll is %0.1f from %d '
+            'antithetic pairs of repeats (pair correlation %0.3f)', ess,
+            len(pairs), rho)
+
+
+def _builtin_strategy(spec):
+    try:
+        return BuiltinStrategy(spec)
+    except ValueError as e:
+        raise ArgumentTypeError(e)
+
+
+def _positive_float(s):
+    f = BoundedFloat(0, None)(s)
+    if not f:
+        raise ArgumentTypeError('%s must be more than 0' % (f,))
+    return f
+
+
+def do_dump_optimized(args):
+    ''' Write --input-strategy as it will be run, after optimizing it. See
+    cdc.lib.stratlang.optimize '''
+    strat_text = _read_input_strategy(args)
+    if strat_text is None:
+        return 1
+    logic = lang.optimize(lang.parse(strat_text))
+    args.output.write(lang.format_program(logic))
 
 
 def gen_parser(sub):
@@ -235,12 +780,36 @@ def gen_parser(sub):
     p.add_argument(
         '-o', '--output', type=FileType('wt'), default=sys.stdout,
         help='To where to write output')
+    strategy = p.add_mutually_exclusive_group()
+    strategy.add_argument(
+        '--input-strategy', type=FileType('rt'),
+        help='File containing the code for your strategy. If not given, read '
+        'it from %s' % DEFAULT_INPUT_STRATEGY)
+    strategy.add_argument(
+        '--builtin-strategy', type=_builtin_strategy,
+        metavar='NAME:ARGS',
+        help='For bankroll, snapshot and exact output, play a built-in '
+        'strategy instead of --input-strategy. One of %s' % ', '.join(
+            '%s:%s' % (name, args)
+            for name, (_, args) in BUILTIN_STRATEGIES.items()))
     p.add_argument(
-        '--input-strategy', type=FileType('rt'), default='custom.strategy',
-        help='File containing the code for your strategy')
+        '--engine', choices=('auto', 'object', 'vector'), default='auto',
+        help='For bankroll output, how to simulate. "object" plays every '
+        'repeat on its own table. "vector" plays many repeats in lockstep '
+        'on arrays of tables, which is much faster but only works with '
+        '--builtin-strategy and without --snapshot. "auto" uses vector when '
+        'it can and object otherwise. All give the same bankrolls')
     p.add_argument(
         '-f', '--out-format', required=True,
-        choices=('rollseries', 'bankroll',))
+        choices=('rollseries', 'bankroll', 'tape', 'snapshot', 'exact'),
+        help='rollseries: plain-text dice rolls. bankroll: bankroll over '
+        'time of --input-strategy, one line per repeat. tape: binary roll '
+        'tape that bankroll can read with --roll-tape. snapshot: the state '
+        'of the table after --input-strategy (or --builtin-strategy) plays '
+        '--rolls rolls, which bankroll can start from with --snapshot. '
+        'exact: the exact expected value and variance of the strategy\'s '
+        'bankroll per roll and per shooter hand, if it doesn\'t look at its '
+        'bankroll or the number of rolls')
     p.add_argument(
         '--rolls', type=BoundedInt(1, None), default=100000,
         help='How many time to roll the dice using the given probabilities')
@@ -248,17 +817,123 @@ def gen_parser(sub):
         '--repeat', type=BoundedInt(1, None), default=1,
         help='How many times to simulate a bunch of rolls, for the types of '
         'output that allow repeats')
+    p.add_argument(
+        '--first-repeat', type=BoundedInt(0, None), default=0,
+        help='Index of the first repeat to simulate. Each repeat\'s rolls '
+        'depend only on --seed and its index, so a large number of repeats '
+        'can be split into several runs with different --first-repeat '
+        'values')
+    p.add_argument(
+        '--only-repeat', type=BoundedInt(0, None),
+        help='Only simulate the repeat with this index, exactly as it would '
+        'be simulated as part of a larger run with the same --seed. Can be '
+        'used with rollseries output to see the rolls of that repeat')
+    p.add_argument(
+        '--start-roll', type=BoundedInt(0, None), default=0,
+        help='Jump straight to this roll in each repeat without generating '
+        'the rolls before it. Strategies start with a fresh table there')
+    p.add_argument(
+        '--workers', type=BoundedInt(1, None), default=mp.cpu_count(),
+        help='How many processes to simulate repeats (or long roll series) '
+        'with')
+    p.add_argument(
+        '--roll-tape', type=str,
+        help='For bankroll output, read rolls from this roll tape (made with '
+        '-f tape and the same --rolls) instead of rolling them. Repeat k '
+        'uses the kth --rolls rolls on the tape, so different strategies can '
+        'be compared on the exact same rolls')
+    p.add_argument(
+        '--snapshot', type=FileType('rt'),
+        help='For bankroll output, start every repeat from the table saved '
+        'in this file (made with -f snapshot) instead of a fresh table. The '
+        'bankroll, point, bets, and recent rolls are restored. It must '
+        'keep as many recent rolls as the strategy looks back at. The '
+        'snapshot can come from a different strategy, built-in or not, '
+        'than the one played from it')
+    p.add_argument(
+        '--max-states', type=BoundedInt(1, None),
+        default=exact.DEFAULT_MAX_STATES,
+        help='For exact output, give up if the table can be in more than '
+        'this many states. Memory use grows with the square of it')
+    p.add_argument(
+        '--variance-reduction', choices=('none', 'antithetic'),
+        default='none',
+        help='For bankroll and tape output, how to correlate repeats to get '
+        'more precise results from fewer of them. "antithetic" simulates '
+        'repeats in pairs, where the second of each pair is driven by the '
+        'complement of the random numbers driving the first, so that a 7 in '
+        'one is a 6 or an 8 in the other. This helps place bets the most, and '
+        'line bets little. The effective sample size achieved is logged')
+    p.add_argument(
+        '--target-ci', type=BoundedFloat(0, None),
+        help='For bankroll output, ignore --repeat and instead keep '
+        'simulating repeats until the 95%% confidence interval of the mean '
+        'final bankroll is no wider than this (or --max-repeat is reached)')
+    p.add_argument(
+        '--max-repeat', type=BoundedInt(1, None), default=100000,
+        help='The most repeats to simulate with --target-ci')
+    p.add_argument(
+        '--stop-loss', type=_positive_float,
+        help='For bankroll output, stop a repeat as soon as its bankroll is '
+        'this much below where it started. The rest of its rolls are not '
+        'played and its last bankroll is repeated for them. The bankroll '
+        'doesn\'t count chips on the table, so making bets lowers it: keep '
+        'this above what the strategy can have on the table at once')
+    p.add_argument(
+        '--win-goal', type=_positive_float,
+        help='For bankroll output, stop a repeat as soon as its bankroll is '
+        'this much above where it started, like --stop-loss')
+    p.add_argument(
+        '--max-drawdown', type=_positive_float,
+        help='For bankroll output, stop a repeat as soon as its bankroll is '
+        'this much below the highest it has been, like --stop-loss')
+    p.add_argument(
+        '--dump-optimized', action='store_true',
+        help='Instead of simulating anything, write --input-strategy as it '
+        'will be run: with arithmetic on literals done, branches that can '
+        'never be taken removed, and expressions that appear more than once '
+        'only evaluated once each time the strategy makes its bets. The '
+        'statistics aren\'t read')
+    p.add_argument(
+        '--dice-model', choices=('dice', 'pairs'), default='dice',
+        help='How to roll the dice. "dice" rolls each die independently '
+        'using how often each face came up. "pairs" rolls both dice at once '
+        'using how often each pair of faces came up, which keeps any '
+        'correlation between the two dice')
 
 
 def main(args, conf):
+    if args.dump_optimized:
+        return do_dump_optimized(args)
     stats = json.load(args.input, cls=NumericKeyDecoder)
     #
-    assert args.out_format in {'rollseries', 'bankroll'}, 'if this fails, '\
-        'I need to think about if --repeat applies to the new output format'
-    if args.out_format not in {'bankroll'} and args.repeat != 1:
+    assert args.out_format in {
+        'rollseries', 'bankroll', 'tape', 'snapshot', 'exact'}, \
+        'if this fails, I need to think about if --repeat applies to the '\
+        'new output format'
+    if args.out_format not in {'bankroll', 'tape'} and args.repeat != 1:
         log.warn('Ignoring --repeat %d', args.repeat)
+    if args.out_format == 'tape' and (
+            args.first_repeat or args.only_repeat is not None or
+            args.start_roll):
+        log.warn(
+            'Ignoring --first-repeat, --only-repeat and --start-roll. Tapes '
+            'always start at the first roll of repeat 0')
+    if args.out_format != 'bankroll' and args.snapshot is not None:
+        log.warn('Ignoring --snapshot')
+    if args.target_ci is not None and args.repeat != 1:
+        log.warn('Ignoring --repeat %d because of --target-ci', args.repeat)
+    if args.only_repeat is not None and args.repeat != 1:
+        log.warn(
+            'Ignoring --repeat %d because of --only-repeat', args.repeat)
     #
     if args.out_format == 'rollseries':
         return do_rollseries(args, stats)
+    if args.out_format == 'tape':
+        return do_tape(args, stats)
+    if args.out_format == 'snapshot':
+        return do_snapshot(args, stats)
+    if args.out_format == 'exact':
+        return do_exact(args, stats)
     assert args.out_format == 'bankroll'
     return do_bankroll(args, stats)
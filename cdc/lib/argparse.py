@@ -28,6 +28,32 @@ class BoundedInt:
         return i
 
 
+class BoundedFloat:
+    def __init__(self, mini=None, maxi=None, clamp=False):
+        self.mini = mini
+        self.maxi = maxi
+        self.clamp = clamp
+
+    def __call__(self, str_value):
+        try:
+            f = float(str_value)
+        except Exception as e:
+            raise ArgumentTypeError(e)
+        if self.mini is not None and f < self.mini:
+            if self.clamp:
+                f = self.mini
+            else:
+                raise ArgumentTypeError(
+                    '%s cannot be less than %s' % (f, self.mini))
+        if self.maxi is not None and f > self.maxi:
+            if self.clamp:
+                f = self.maxi
+            else:
+                raise ArgumentTypeError(
+                    '%s cannot be more than %s' % (f, self.maxi))
+        return f
+
+
 class TryAppendFileType(FileType):
     ''' As argparse.FileType, but when the open mode contains 'a' (append),
     only *try* to open the file as append. If it doesn't work, consume
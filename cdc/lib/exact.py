@@ -0,0 +1,187 @@
+''' Exact expected value and variance of a strategy, for strategies whose
+bets only depend on a finite amount of state.
+
+The table is treated as a Markov chain. A state is everything a strategy can
+base its bets on except the bankroll: the point, the bets on the table, the
+last max_lookback rolls, and the Strategy counters if it uses them. Starting
+from a fresh table, every state that can be reached is found by making bets
+and then trying all 36 rolls. Each transition is labeled with its
+probability and how much the bankroll changed (bets made, minus what came
+back from winners and pushes).
+
+This only gives the right answer if the strategy never looks at its
+bankroll, at how many rolls there have been, or at anything else not in
+the state.
+'''
+from .strategy import CrapsRoll as R
+
+import numpy as np
+
+DEFAULT_MAX_STATES = 5000
+# A strategy that keeps adding bets without ever stopping has no finite
+# number of states, but would take a long time to hit the limit on states as
+# every state has more bets than the last
+MAX_BETS = 100
+
+
+class TooManyStatesError(Exception):
+    pass
+
+
+def _state_key(strat, lookback):
+    ''' Return a hashable description of the state of the strategy's table
+    that leaves out the bankroll '''
+    snapshot = strat.snapshot()
+    rolls = snapshot['rolls'][len(snapshot['rolls']) - lookback:]\
+        if lookback else []
+    counters = sorted(snapshot['counters'].items())\
+        if strat.uses_counters else []
+    return (
+        snapshot['point'],
+        tuple(sorted(
+            (tuple(sorted(d.items())) for d in snapshot['bets']), key=repr)),
+        tuple(rolls),
+        tuple(counters))
+
+
+def _snapshot(key):
+    point, bets, rolls, counters = key
+    return {
+        'bankroll': 0,
+        'point': point,
+        'bets': [dict(d) for d in bets],
+        'num_rolls': len(rolls),
+        'rolls': list(rolls),
+        'counters': dict(counters),
+    }
+
+
+def _distinct_rolls(pair_probs, lookback):
+    ''' Return a list of (roll, probability) covering every roll that can
+    lead somewhere different. If the history isn't part of the state, only a
+    roll's value and whether it is a double can matter, so there are only 15
+    such rolls. '''
+    rolls = {}
+    for pair, p in enumerate(pair_probs):
+        if not p:
+            continue
+        roll = R.from_index(pair)
+        key = pair if lookback else (roll.value, roll.dice[0] == roll.dice[1])
+        if key in rolls:
+            rolls[key][1] += float(p)
+        else:
+            rolls[key] = [roll, float(p)]
+    return [tuple(v) for v in rolls.values()]
+
+
+def _explore(make_strat, pair_probs, max_states):
+    ''' Return the number of states and, for each state, a list of its
+    transitions as (next state, probability, bankroll change, ends the
+    shooter's hand). State 0 is a fresh table. '''
+    strat = make_strat()
+    lookback = strat.max_lookback
+    if lookback is None:
+        raise TooManyStatesError(
+            '%s remembers every roll, so it has no finite number of '
+            'states' % strat.name)
+    rolls = _distinct_rolls(pair_probs, lookback)
+    keys = [_state_key(strat, lookback)]
+    index = {keys[0]: 0}
+    transitions = []
+    while len(transitions) < len(keys):
+        key = keys[len(transitions)]
+        strat.restore(_snapshot(key))
+        strat.make_bets()
+        if len(strat.bets) > MAX_BETS:
+            raise TooManyStatesError(
+                'Found a state with more than %d bets on the table' %
+                MAX_BETS)
+        outs = []
+        for roll, p in rolls:
+            after = strat.fork()
+            after.resolve_roll(roll)
+            next_key = _state_key(after, lookback)
+            if next_key not in index:
+                if len(keys) >= max_states:
+                    raise TooManyStatesError(
+                        'Found more than %d states' % max_states)
+                index[next_key] = len(keys)
+                keys.append(next_key)
+            seven_out = key[0] is not None and roll.value == 7
+            outs.append((index[next_key], p, after.bankroll, seven_out))
+        transitions.append(outs)
+    return len(keys), transitions
+
+
+def _stationary(P):
+    ''' Return the stationary distribution of the chain with transition
+    matrix P, assuming it has a single recurrent class '''
+    n = len(P)
+    A = P.T - np.eye(n)
+    # One of the balance equations is redundant. Replace it with the
+    # requirement that the probabilities sum to 1.
+    A[-1, :] = 1
+    b = np.zeros(n)
+    b[-1] = 1
+    try:
+        return np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        return np.linalg.lstsq(A, b, rcond=None)[0]
+
+
+def evaluate(make_strat, pair_probs, max_states=DEFAULT_MAX_STATES):
+    ''' Calculate how the bankroll of the strategy returned by make_strat
+    changes in the long run when the dice land on each pair index with the
+    given probabilities. Returns a dict with
+
+    - states: how many states the table can be in
+    - ev_per_roll, variance_per_roll: the mean and variance of the change in
+      bankroll on one roll, with the table in its stationary distribution
+    - rolls_per_hand, ev_per_hand, variance_per_hand: the mean number of
+      rolls in a shooter's hand (ended by a seven out) and the mean and
+      variance of the change in bankroll over a whole hand
+
+    Raises TooManyStatesError if the strategy can be in more than max_states
+    states. '''
+    n, transitions = _explore(make_strat, pair_probs, max_states)
+    P = np.zeros((n, n))
+    # The part of P that continues the shooter's hand
+    cont = np.zeros((n, n))
+    mean = np.zeros(n)
+    second = np.zeros(n)
+    for s, outs in enumerate(transitions):
+        for t, p, change, seven_out in outs:
+            P[s, t] += p
+            if not seven_out:
+                cont[s, t] += p
+            mean[s] += p * change
+            second[s] += p * change * change
+    pi = _stationary(P)
+    del P
+    ev_per_roll = pi @ mean
+    variance_per_roll = pi @ second - ev_per_roll ** 2
+    # Hands start in whatever state a seven out leaves the table in
+    start = np.zeros(n)
+    for s, outs in enumerate(transitions):
+        for t, p, change, seven_out in outs:
+            if seven_out:
+                start[t] += pi[s] * p
+    start /= start.sum()
+    A = np.eye(n) - cont
+    rolls_left = np.linalg.solve(A, np.ones(n))
+    ev_left = np.linalg.solve(A, mean)
+    cross = np.zeros(n)
+    for s, outs in enumerate(transitions):
+        for t, p, change, seven_out in outs:
+            if not seven_out:
+                cross[s] += 2 * p * change * ev_left[t]
+    second_left = np.linalg.solve(A, second + cross)
+    ev_per_hand = start @ ev_left
+    return {
+        'states': n,
+        'ev_per_roll': float(ev_per_roll),
+        'variance_per_roll': float(variance_per_roll),
+        'rolls_per_hand': float(start @ rolls_left),
+        'ev_per_hand': float(ev_per_hand),
+        'variance_per_hand': float(start @ second_left - ev_per_hand ** 2),
+    }
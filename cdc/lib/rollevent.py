@@ -1,4 +1,6 @@
 class RollEvent:
+    __slots__ = ('_type', '_dice', '_args')
+
     def __init__(self, type_, dice, args):
         self._type = type_
         self._dice = dice
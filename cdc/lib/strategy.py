@@ -1,8 +1,18 @@
+from collections import deque
 from copy import copy
+from enum import Enum
 import logging
 
 
 _POINT_VALUES = {4, 5, 6, 8, 9, 10}
+# Every state the table's point can be in. A bet's outcome table has a row of
+# 36 entries (one per pair index, see CrapsRoll.pair_index) for each of them.
+_POINT_STATES = (None, 4, 5, 6, 8, 9, 10)
+_POINT_STATE_INDEX = {p: i for i, p in enumerate(_POINT_STATES)}
+# Outcome tables are shared by all bets with the same outcome key. Stop the
+# cache from growing without bound if bet amounts keep changing.
+_MAX_OUTCOME_TABLES = 10000
+_outcome_tables = {}
 log = logging.getLogger(__name__)
 
 
@@ -14,13 +24,253 @@ class IllegalBet(TypeError):
     pass
 
 
+class RollHistory:
+    ''' The history of rolls a Strategy has seen.
+
+    Only the most recent capacity rolls are kept (all of them if capacity is
+    None), but the total number of rolls ever appended is always known. It
+    acts like a list of every roll so far: len() is the total number of
+    rolls, and indexing and slicing work as long as only the kept rolls are
+    asked for. Asking for a roll that is no longer kept raises IndexError.
+    '''
+    def __init__(self, capacity=None, rolls=(), count=None):
+        ''' Start with the given rolls, oldest first. If count is given, it
+        is the number of rolls that came before, including those given '''
+        self._rolls = deque(rolls, maxlen=capacity)
+        self._count = count if count is not None else len(rolls)
+        assert self._count >= len(self._rolls)
+
+    @property
+    def capacity(self):
+        return self._rolls.maxlen
+
+    def append(self, roll):
+        self._rolls.append(roll)
+        self._count += 1
+
+    def copy(self):
+        return RollHistory(self.capacity, self._rolls, self._count)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def last(self):
+        ''' The most recent roll. Same as [-1], but cheaper '''
+        if not self._rolls:
+            raise IndexError('no rolls in the history')
+        return self._rolls[-1]
+
+    def __iter__(self):
+        ''' Iterate over the kept rolls, oldest first '''
+        return iter(self._rolls)
+
+    def __reversed__(self):
+        ''' Iterate over the kept rolls, newest first '''
+        return reversed(self._rolls)
+
+    def _kept_index(self, i):
+        ''' Turn an index into the list of every roll so far into an index
+        into the kept rolls '''
+        if i < 0:
+            i += self._count
+        forgotten = self._count - len(self._rolls)
+        if i < forgotten or i >= self._count:
+            raise IndexError('roll %d is not in the history' % i)
+        return i - forgotten
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [
+                self._rolls[self._kept_index(i)]
+                for i in range(*key.indices(self._count))]
+        return self._rolls[self._kept_index(key)]
+
+
+def _bet_point(bet):
+    ''' The number a bet is tied to, if any: the point of a (Don't) Come or
+    Odds bet, or the value of a Place or Hard Way bet '''
+    if isinstance(bet, (CBCome, CBDontCome, CBOdds)):
+        return bet.point
+    if isinstance(bet, (CBPlace, CBHardWay)):
+        return bet.value
+    return None
+
+
+class BetOutcome(Enum):
+    Nothing = 'nothing'
+    Win = 'win'
+    Lose = 'lose'
+    Push = 'push'
+
+
+def _compile_outcome_table(bet):
+    ''' Ask the bet what happens to it on every roll in every point state.
+    See CrapsBet.outcomes '''
+    table = []
+    nothing = (BetOutcome.Nothing, 0)
+    for point in _POINT_STATES:
+        for d1 in range(1, 6+1):
+            for d2 in range(1, 6+1):
+                roll = CrapsRoll(d1, d2)
+                if bet.is_push(roll, point):
+                    table.append((BetOutcome.Push, bet.amount))
+                elif not bet.is_working:
+                    table.append(nothing)
+                elif bet.is_loser(roll, point):
+                    table.append((BetOutcome.Lose, 0))
+                elif bet.is_winner(roll, point):
+                    table.append((
+                        BetOutcome.Win, bet.amount + bet.win_amount(roll)))
+                else:
+                    table.append(nothing)
+    return tuple(table)
+
+
+def _outcome_table(bet):
+    key = bet.outcome_key()
+    if key not in _outcome_tables:
+        if len(_outcome_tables) >= _MAX_OUTCOME_TABLES:
+            _outcome_tables.clear()
+        _outcome_tables[key] = _compile_outcome_table(bet)
+    return _outcome_tables[key]
+
+
+def outcome_index(roll, point):
+    ''' Return the index into CrapsBet.outcomes for the given roll happening
+    while the table's point is point '''
+    return _POINT_STATE_INDEX[point] * 36 + roll.pair_index
+
+
+class BetBook:
+    ''' The bets a Strategy has on the table.
+
+    Iterating over it yields the bets in the order they were added. Bets are
+    also indexed by their exact type and the number they are tied to (see
+    of_type()), and by the roll values that can settle, push, or convert them
+    (see affected_by()), so the work done on each roll is proportional to the
+    number of bets that roll actually affects.
+
+    Bets are compared by identity, never with CrapsBet.__eq__, so two equal
+    bets can both be on the table and removing one leaves the other.
+
+    A bet must not be changed in a way that changes its type, point, or roll
+    values while it is in the book. Remove it, change it, and add it again.
+
+    Pickles as just the list of bets, and the indexes are rebuilt when
+    unpickled, as the bets no longer have the same ids.
+    '''
+    def __init__(self):
+        # All of these map id(bet) to bet, as dicts keep insertion order
+        self._bets = {}
+        self._by_type = {}
+        self._by_value = {}
+
+    def __getstate__(self):
+        return list(self._bets.values())
+
+    def __setstate__(self, state):
+        self.__init__()
+        for bet in state:
+            self.add(bet)
+
+    def __len__(self):
+        return len(self._bets)
+
+    def __iter__(self):
+        return iter(list(self._bets.values()))
+
+    def __getitem__(self, i):
+        return list(self._bets.values())[i]
+
+    def __contains__(self, bet):
+        return id(bet) in self._bets
+
+    def _keys(self, bet):
+        return (type(bet), (type(bet), _bet_point(bet)))
+
+    def add(self, bet):
+        assert bet not in self
+        self._bets[id(bet)] = bet
+        for key in self._keys(bet):
+            self._by_type.setdefault(key, {})[id(bet)] = bet
+        for value in bet.roll_values():
+            self._by_value.setdefault(value, {})[id(bet)] = bet
+
+    def remove(self, bet):
+        del self._bets[id(bet)]
+        for key in self._keys(bet):
+            del self._by_type[key][id(bet)]
+        for value in bet.roll_values():
+            del self._by_value[value][id(bet)]
+
+    def of_type(self, class_):
+        ''' Return a list of the bets of exactly the given class '''
+        return list(self._by_type.get(class_, {}).values())
+
+    def tied_to(self, class_, point):
+        ''' Return a list of the bets of exactly the given class that are
+        tied to the given number, which is None for e.g. a Come bet that
+        hasn't moved to a number yet '''
+        return list(self._by_type.get((class_, point), {}).values())
+
+    def affected_by(self, value):
+        ''' Return a list of the bets a roll of the given value could settle,
+        push, or convert, in the order they were added '''
+        return list(self._by_value.get(value, {}).values())
+
+
 class Strategy:
+    ''' Subclasses should set max_lookback to the most rolls they ever look
+    back at when making bets (0 if they never do), or leave it None if there
+    is no limit. Only that many rolls (and at least the last one, which is
+    needed to settle bets) are kept in the history.
+
+    Some things strategies commonly want to know are kept up to date as rolls
+    are resolved, so they don't need the history: field_loss_streak,
+    rolls_since_point, points_made, and seven_outs. Subclasses that base their
+    bets on any of them should set uses_counters, as then the point, bets, and
+    recent rolls are no longer all there is to the state of the table.
+
+    Subclasses that only ever make bets of some types can set bet_types to
+    those classes. Then if none of them can push, or be a Come or Don't Come
+    bet that moves to a number, no time is spent looking for such bets on
+    every roll. Bets of other types can still be made, but then that time is
+    spent again. '''
+    max_lookback = None
+    uses_counters = False
+    bet_types = None
+
     def __init__(self, name, bankroll=0):
         self._name = name
         self._bankroll = bankroll
-        self._bets = []
-        self._rolls = []
+        self._bets = BetBook()
+        # Always keep the last roll, as it is needed to settle bets
+        self._rolls = RollHistory(
+            max(self.max_lookback, 1) if self.max_lookback is not None
+            else None)
         self._point = None
+        self._listeners = []
+        self._field_loss_streak = 0
+        self._rolls_since_point = 0
+        self._points_made = 0
+        self._seven_outs = 0
+        self._set_bet_types(self.bet_types)
+
+    def _set_bet_types(self, bet_types):
+        ''' Only look for pushes and Come bets to move on each roll if a bet
+        of one of the given types (None for any type) can need it '''
+        if bet_types is None:
+            self._bet_types = None
+            self._find_pushes = self._move_comes = True
+            return
+        self._bet_types = frozenset(bet_types)
+        self._find_pushes = any(
+            class_.is_push is not CrapsBet.is_push
+            for class_ in self._bet_types)
+        self._move_comes = any(
+            issubclass(class_, (CBCome, CBDontCome))
+            for class_ in self._bet_types)
 
     @property
     def name(self):
@@ -36,7 +286,7 @@ class Strategy:
 
     @property
     def last_roll(self):
-        return self._rolls[-1]
+        return self._rolls.last
 
     @property
     def rolls(self):
@@ -46,74 +296,68 @@ class Strategy:
     def bets(self):
         return self._bets
 
+    @property
+    def field_loss_streak(self):
+        ''' How many rolls in a row, up to and including the last one, would
+        have lost a field bet '''
+        return self._field_loss_streak
+
+    @property
+    def rolls_since_point(self):
+        ''' How many rolls there have been since the one that established the
+        point, or 0 if there is no point '''
+        return self._rolls_since_point
+
+    @property
+    def points_made(self):
+        ''' How many points the shooter has made since the last seven out '''
+        return self._points_made
+
+    @property
+    def seven_outs(self):
+        ''' How many times a shooter has sevened out '''
+        return self._seven_outs
+
     def _adjust_bankroll(self, amount):
         ''' For use interally whenever a bet wins or a bet is made '''
         self._bankroll += amount
 
-    def _handle_winners_and_losers(self):
-        ''' Payout all winning bets, remove them, remove any losers, and return
-        a list of events '''
-        evs = []
-        remove_bets = []
-        for bet in self.bets:
-            if not bet.is_working:
-                continue
-            if bet.is_loser(self.last_roll, self.point):
-                evs.append(CGEBetLost(bet))
-                remove_bets.append(bet)
-            elif bet.is_winner(self.last_roll, self.point):
-                evs.append(CGEBetWon(bet))
-                self._adjust_bankroll(
-                    bet.amount + bet.win_amount(self.last_roll))
-                remove_bets.append(bet)
-        self._bets = [b for b in self.bets if b not in remove_bets]
-        return evs
-
-    def _handle_pushers(self):
-        ''' Return bets that push. Also refund their value to the bankroll '''
-        evs = []
-        remove_bets = []
+    def _handle_winners_and_losers(self, evs):
+        ''' Payout all winning bets, remove them, and remove any losers. If
+        evs is a list, append events to it '''
+        roll = self.last_roll
+        i = outcome_index(roll, self.point)
+        for bet in self.bets.affected_by(roll.value):
+            outcome, payout = bet.outcomes[i]
+            if outcome is BetOutcome.Lose:
+                self._bets.remove(bet)
+                if evs is not None:
+                    evs.append(CGEBetLost(bet))
+            elif outcome is BetOutcome.Win:
+                self._adjust_bankroll(payout)
+                self._bets.remove(bet)
+                if evs is not None:
+                    evs.append(CGEBetWon(bet))
+
+    def _handle_pushers(self, evs):
+        ''' Remove bets that push and refund their value to the bankroll. If
+        evs is a list, append events to it '''
         refund_amount = 0
-        for bet in self.bets:
-            if self.point is None:
-                # Come out roll.
-                # - Don't Pass is push on 12
-                # - Come odds push if off and 7
-                # - Don't Come odds push if off and roll == bet.point
-                if self.last_roll.value == 12 and isinstance(bet, CBDontPass):
-                    remove_bets.append(bet)
-                    refund_amount += bet.amount
-                    evs.append(CGEBetPush(bet))
-                elif isinstance(bet, CBOdds) and not bet.is_dont \
-                        and not bet.is_working \
-                        and self.last_roll.value == 7:
-                    remove_bets.append(bet)
-                    refund_amount += bet.amount
+        roll = self.last_roll
+        i = outcome_index(roll, self.point)
+        for bet in self.bets.affected_by(roll.value):
+            outcome, refund = bet.outcomes[i]
+            if outcome is BetOutcome.Push:
+                self._bets.remove(bet)
+                refund_amount += refund
+                if evs is not None:
                     evs.append(CGEBetPush(bet))
-                elif isinstance(bet, CBOdds) and bet.is_dont \
-                        and not bet.is_working \
-                        and self.last_roll.value == bet.point:
-                    remove_bets.append(bet)
-                    refund_amount += bet.amount
-                    evs.append(CGEBetPush(bet))
-                continue
-            assert self.point
-            # There is a point.
-            # - Don't Come is push on 12 if it doesn't have a point yet
-            if self.last_roll.value == 12 and isinstance(bet, CBDontCome) \
-                    and bet.point is None:
-                remove_bets.append(bet)
-                refund_amount += bet.amount
-                evs.append(CGEBetPush(bet))
-        self._bets = [b for b in self.bets if b not in remove_bets]
         self._adjust_bankroll(refund_amount)
-        return evs
 
-    def _convert_comes(self):
-        evs = []
+    def _convert_comes(self, evs):
         add_bets = []
         remove_bets = []
-        for bet in self.bets:
+        for bet in self.bets.affected_by(self.last_roll.value):
             if not isinstance(bet, CBCome) and not isinstance(bet, CBDontCome):
                 continue
             # Should be safe to assert that the bet is working. Other code
@@ -133,32 +377,152 @@ class Strategy:
             new_bet.set_point(self.last_roll.value)
             remove_bets.append(bet)
             add_bets.append(new_bet)
-            evs.append(CGEBetConverted(bet, new_bet))
-        self._bets = [b for b in self.bets if b not in remove_bets]
-        self._bets.extend(add_bets)
-        return evs
-
-    def _adjust_point(self):
-        if self.point is None and self.last_roll.value in _POINT_VALUES:
-            self._point = self.last_roll.value
-            return [CGEPointEstablished(self.last_roll.value)]
-        elif self.point is not None and self.last_roll.value == 7:
-            ret = [CGEPointLost(self.point)]
+            if evs is not None:
+                evs.append(CGEBetConverted(bet, new_bet))
+        for bet in remove_bets:
+            self._bets.remove(bet)
+        for bet in add_bets:
+            self._bets.add(bet)
+
+    def _adjust_point(self, evs):
+        value = self.last_roll.value
+        if self.point is None and value in _POINT_VALUES:
+            self._point = value
+            self._rolls_since_point = 0
+            if evs is not None:
+                evs.append(CGEPointEstablished(value))
+        elif self.point is not None and value == 7:
+            if evs is not None:
+                evs.append(CGEPointLost(self.point))
             self._point = None
-            return ret
-        elif self.point is not None and self.last_roll.value == self.point:
+            self._rolls_since_point = 0
+            self._points_made = 0
+            self._seven_outs += 1
+        elif self.point is not None and value == self.point:
             self._point = None
-            return [CGEPointWon(self.last_roll.value)]
-        return []
+            self._rolls_since_point = 0
+            self._points_made += 1
+            if evs is not None:
+                evs.append(CGEPointWon(value))
+        elif self.point is not None:
+            self._rolls_since_point += 1
+
+    def _resolve(self, roll, evs):
+        self._rolls.append(roll)
+        if roll.value in CBField.roll_lose:
+            self._field_loss_streak += 1
+        else:
+            self._field_loss_streak = 0
+        if self._find_pushes:
+            self._handle_pushers(evs)
+        self._handle_winners_and_losers(evs)
+        if self._move_comes:
+            self._convert_comes(evs)
+        self._adjust_point(evs)
+
+    def snapshot(self):
+        ''' Return the state of the table (bankroll, point, bets, and the
+        rolls kept in the history) as a dict that can be written as JSON and
+        given to restore() later '''
+        return {
+            'bankroll': self.bankroll,
+            'point': self.point,
+            'bets': [bet.to_dict() for bet in self.bets],
+            'num_rolls': len(self.rolls),
+            'rolls': [roll.pair_index for roll in self.rolls],
+            'counters': self.counters(),
+        }
+
+    def counters(self):
+        ''' Return the counters kept up to date as rolls are resolved, by
+        name '''
+        return {
+            'field_loss_streak': self._field_loss_streak,
+            'rolls_since_point': self._rolls_since_point,
+            'points_made': self._points_made,
+            'seven_outs': self._seven_outs,
+        }
+
+    def restore(self, snapshot):
+        ''' Replace the state of the table with the one in the given dict,
+        which came from snapshot(). The strategy itself (what bets it makes)
+        is not part of the snapshot and doesn't change.
+
+        Raises ValueError if the snapshot doesn't keep as many rolls as this
+        strategy looks back at, as happens when it came from a strategy that
+        looks back at fewer. '''
+        assert snapshot['point'] is None or snapshot['point'] in _POINT_VALUES
+        needed = snapshot['num_rolls'] if self.max_lookback is None else \
+            min(snapshot['num_rolls'], self.max_lookback)
+        if len(snapshot['rolls']) < needed:
+            raise ValueError(
+                'The snapshot only keeps the last %d of its %d rolls, but the '
+                'strategy looks back at %s' % (
+                    len(snapshot['rolls']), snapshot['num_rolls'],
+                    'all of them' if self.max_lookback is None else
+                    'the last %d' % self.max_lookback))
+        self._bankroll = snapshot['bankroll']
+        self._point = snapshot['point']
+        self._bets = BetBook()
+        for d in snapshot['bets']:
+            self._bets.add(CrapsBet.from_dict(d))
+        if self._bet_types is not None:
+            self._set_bet_types(
+                self._bet_types | {type(bet) for bet in self._bets})
+        self._rolls = RollHistory(
+            self._rolls.capacity,
+            [CrapsRoll.from_index(i) for i in snapshot['rolls']],
+            snapshot['num_rolls'])
+        # Snapshots from before there were counters start them at 0
+        counters = snapshot.get('counters', {})
+        self._field_loss_streak = counters.get('field_loss_streak', 0)
+        self._rolls_since_point = counters.get('rolls_since_point', 0)
+        self._points_made = counters.get('points_made', 0)
+        self._seven_outs = counters.get('seven_outs', 0)
+
+    def fork(self):
+        ''' Return an independent copy of this strategy and the state of its
+        table, for playing different rolls from here. Listeners are not
+        copied. The history holds shared, immutable rolls and is at most
+        max_lookback long, so this is cheap. '''
+        new = copy(self)
+        new._bets = BetBook()
+        for bet in self.bets:
+            new._bets.add(copy(bet))
+        new._rolls = self._rolls.copy()
+        new._listeners = []
+        return new
+
+    def add_listener(self, listener):
+        ''' Call listener with every CrapsGameEvent that happens from now on,
+        in order, whether the roll is given to after_roll or resolve_roll '''
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, evs):
+        for ev in evs:
+            for listener in self._listeners:
+                listener(ev)
+
+    def resolve_roll(self, roll):
+        ''' Settle all bets given the roll and move the point. Returns nothing.
+        Unless a listener has been added, no event objects are created, so
+        this is the cheapest way to play a lot of rolls. '''
+        if not self._listeners:
+            self._resolve(roll, None)
+            return
+        evs = []
+        self._resolve(roll, evs)
+        self._notify(evs)
 
     def after_roll(self, roll):
-        # print(roll.dice)
-        self._rolls.append(roll)
+        ''' Same as resolve_roll, but also return the list of events that
+        happened '''
         evs = []
-        evs.extend(self._handle_pushers())
-        evs.extend(self._handle_winners_and_losers())
-        evs.extend(self._convert_comes())
-        evs.extend(self._adjust_point())
+        self._resolve(roll, evs)
+        self._notify(evs)
         return evs
 
     def _can_make_bet(self, b):
@@ -183,17 +547,12 @@ class Strategy:
         if isinstance(b, CBOdds):
             if b.point == self.point:
                 class_ = CBPass if not b.is_dont else CBDontPass
-                flat_bets = [b for b in self.bets if type(b) == class_]
-                if not len(flat_bets):
+                if not len(self.bets.of_type(class_)):
                     return False, 'Cannot make (Don\'t) Pass Odds bet '\
                         'without a (Don\'t) Pass existing for it'
             else:
                 class_ = CBCome if not b.is_dont else CBDontCome
-                flat_bets = [b for b in self.bets if type(b) == class_]
-                for flat_bet in flat_bets:
-                    if flat_bet.point == b.point:
-                        break
-                else:
+                if not len(self.bets.tied_to(class_, b.point)):
                     return False, 'Cannot make (Don\'t) Come Odds bet '\
                         'without a (Don\'t) Come existing for it'
         return True, ''
@@ -203,8 +562,10 @@ class Strategy:
         allowed, reason = self._can_make_bet(b)
         if not allowed:
             raise IllegalBet(reason)
+        if self._bet_types is not None and type(b) not in self._bet_types:
+            self._set_bet_types(self._bet_types | {type(b)})
         self._adjust_bankroll(-1 * b.amount)
-        self._bets.append(b)
+        self._bets.add(b)
 
     def make_bets(self):
         ''' Subclasses should implement this '''
@@ -212,9 +573,33 @@ class Strategy:
 
 
 class CrapsRoll:
-    def __init__(self, d1, d2):
-        self._dice = (d1, d2)
-        self._value = sum(self.dice)
+    ''' A roll of a pair of dice. Only 36 distinct rolls exist, so there is
+    only ever one CrapsRoll for each ordered pair of dice values: creating a
+    roll returns the shared instance instead of building a new one. Rolls are
+    immutable. '''
+    __slots__ = ('_dice', '_value', '_pair_index')
+    _interned = {}
+
+    def __new__(cls, d1, d2):
+        try:
+            return cls._interned[(d1, d2)]
+        except KeyError:
+            pass
+        # Only reachable for the first roll of each pair, which happens while
+        # this module is imported, or for dice values that don't exist
+        roll = super().__new__(cls)
+        roll._dice = (d1, d2)
+        roll._value = d1 + d2
+        roll._pair_index = (d1 - 1) * 6 + (d2 - 1)
+        return roll
+
+    def __getnewargs__(self):
+        return self._dice
+
+    @staticmethod
+    def from_index(pair_index):
+        ''' Return the roll with the given pair index '''
+        return _ROLLS_BY_INDEX[pair_index]
 
     @property
     def dice(self):
@@ -224,15 +609,52 @@ class CrapsRoll:
     def value(self):
         return self._value
 
+    @property
+    def pair_index(self):
+        ''' Which of the 36 ordered pairs of dice this is, from 0 for (1, 1)
+        to 35 for (6, 6) '''
+        return self._pair_index
+
+
+_ROLLS_BY_INDEX = tuple(
+    CrapsRoll(d1, d2) for d1 in range(1, 6+1) for d2 in range(1, 6+1))
+CrapsRoll._interned.update((roll.dice, roll) for roll in _ROLLS_BY_INDEX)
+# Shared, immutable sets of roll values for bets to use instead of building
+# their own
+_ALL_VALUES = frozenset(range(2, 12+1))
+_SEVEN = frozenset({7})
+_ONLY = {v: frozenset({v}) for v in range(2, 12+1)}
+_OR_SEVEN = {v: frozenset({v, 7}) for v in range(2, 12+1)}
+
+
+# Every slot of each CrapsBet subclass, including inherited ones, by class
+_slot_names = {}
+
 
 class CrapsBet:
+    __slots__ = ('_amount', '_working', '_outcomes')
     name = 'CrapsBet'
-    roll_win = set()
-    roll_lose = set()
+    roll_win = frozenset()
+    roll_lose = frozenset()
 
     def __init__(self, amount, working=True):
         self._amount = amount
         self._working = working
+        self._outcomes = None
+
+    def __copy__(self):
+        # The generic copy of an object with __slots__ goes through
+        # __reduce_ex__, which is several times slower than this
+        cls = type(self)
+        names = _slot_names.get(cls)
+        if names is None:
+            names = _slot_names[cls] = tuple(
+                name for c in cls.__mro__
+                for name in c.__dict__.get('__slots__', ()))
+        new = cls.__new__(cls)
+        for name in names:
+            setattr(new, name, getattr(self, name))
+        return new
 
     def __eq__(self, other):
         return self.amount == other.amount and \
@@ -255,6 +677,48 @@ class CrapsBet:
 
     def set_working(self, working):
         self._working = working
+        self._outcomes = None
+
+    @property
+    def outcomes(self):
+        ''' What happens to this bet on every possible roll, as a tuple of
+        (BetOutcome, amount) pairs indexed by outcome_index(). The amount is
+        what goes back to the bankroll: the bet plus its winnings on a win,
+        the bet on a push, and 0 otherwise.
+
+        It is built by calling is_push, is_loser, is_winner, and win_amount
+        once for every roll and point, and shared with every other bet with
+        the same outcome_key(). '''
+        if self._outcomes is None:
+            self._outcomes = _outcome_table(self)
+        return self._outcomes
+
+    def to_dict(self):
+        ''' Subclasses must extend this with anything else needed to make
+        the bet again with from_dict() '''
+        return {
+            'type': type(self).__name__,
+            'amount': self.amount,
+            'working': self.is_working,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return _BET_TYPES[d['type']]._from_dict(d)
+
+    @classmethod
+    def _from_dict(cls, d):
+        return cls(d['amount'], working=d['working'])
+
+    def outcome_key(self):
+        ''' Bets with equal keys must win, lose, push, and pay the same on
+        every roll. Subclasses must extend this with anything else that
+        changes their outcomes. '''
+        return (type(self), self.name, self.amount, self.is_working)
+
+    def is_push(self, roll, point):
+        ''' Subclass should re-implement this if the bet can push '''
+        return False
 
     def is_winner(self, roll, *a, **kw):
         ''' Subclass should re-implement this if win condition is not simply
@@ -266,6 +730,12 @@ class CrapsBet:
         the dice adding up to some value '''
         return roll.value in self.roll_lose
 
+    def roll_values(self):
+        ''' Return the set of roll values that can settle, push, or convert
+        this bet. Subclass should re-implement this if that is not simply the
+        values it wins or loses on '''
+        return self.roll_win | self.roll_lose
+
     def win_amount(self, *a, **kw):
         ''' Subclass must implement this and calculate the winning amount based
         on self.amount '''
@@ -273,19 +743,22 @@ class CrapsBet:
 
 
 class CBNoOffMixin:
+    __slots__ = ()
+
     def set_working(self, working, *a, **kw):
         if not working:
             raise IllegalBetChange()
 
 
 class CBContractMixin(CBNoOffMixin):
-    pass
+    __slots__ = ()
 
 
 class CBPass(CBContractMixin, CrapsBet):
+    __slots__ = ()
     name = 'Pass'
-    roll_win = {7, 11}
-    roll_lose = {2, 3, 12}
+    roll_win = frozenset({7, 11})
+    roll_lose = frozenset({2, 3, 12})
 
     def win_amount(self, *a, **kw):
         return self.amount
@@ -298,11 +771,15 @@ class CBPass(CBContractMixin, CrapsBet):
         return roll.value in self.roll_lose\
             if point is None else roll.value == 7
 
+    def roll_values(self):
+        return _ALL_VALUES
+
 
 class CBDontPass(CBContractMixin, CrapsBet):
+    __slots__ = ()
     name = 'DontPass'
-    roll_win = {2, 3}
-    roll_lose = {7, 11}
+    roll_win = frozenset({2, 3})
+    roll_lose = frozenset({7, 11})
 
     def win_amount(self, *a, **kw):
         return self.amount
@@ -315,11 +792,18 @@ class CBDontPass(CBContractMixin, CrapsBet):
         return roll.value in self.roll_lose\
             if point is None else roll.value == point
 
+    def is_push(self, roll, point):
+        return point is None and roll.value == 12
+
+    def roll_values(self):
+        return _ALL_VALUES
+
 
 class CBCome(CBContractMixin, CrapsBet):
+    __slots__ = ('_point',)
     name = 'Come'
-    roll_win = {7, 11}
-    roll_lose = {2, 3, 12}
+    _come_out_win = frozenset({7, 11})
+    _come_out_lose = frozenset({2, 3, 12})
 
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
@@ -332,18 +816,45 @@ class CBCome(CBContractMixin, CrapsBet):
         assert point in _POINT_VALUES
         assert self.point is None
         self._point = point
-        self.roll_win = {point}
-        self.roll_lose = {7}
+        self._outcomes = None
 
     @property
     def point(self):
         return self._point
 
+    @property
+    def roll_win(self):
+        return self._come_out_win if self._point is None\
+            else _ONLY[self._point]
+
+    @property
+    def roll_lose(self):
+        return self._come_out_lose if self._point is None else _SEVEN
+
+    def outcome_key(self):
+        return super().outcome_key() + (self.point,)
+
+    def to_dict(self):
+        d = super().to_dict()
+        d['point'] = self.point
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        bet = super()._from_dict(d)
+        if d['point'] is not None:
+            bet.set_point(d['point'])
+        return bet
+
+    def roll_values(self):
+        return _ALL_VALUES if self._point is None else _OR_SEVEN[self._point]
+
 
 class CBDontCome(CBContractMixin, CrapsBet):
+    __slots__ = ('_point',)
     name = 'DontCome'
-    roll_win = {2, 3}
-    roll_lose = {7, 11}
+    _come_out_win = frozenset({2, 3})
+    _come_out_lose = frozenset({7, 11})
 
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
@@ -356,30 +867,53 @@ class CBDontCome(CBContractMixin, CrapsBet):
         assert point in _POINT_VALUES
         assert self.point is None
         self._point = point
-        self.roll_win = {7}
-        self.roll_lose = {point}
+        self._outcomes = None
 
     @property
     def point(self):
         return self._point
 
+    @property
+    def roll_win(self):
+        return self._come_out_win if self._point is None else _SEVEN
+
+    @property
+    def roll_lose(self):
+        return self._come_out_lose if self._point is None\
+            else _ONLY[self._point]
+
+    def outcome_key(self):
+        return super().outcome_key() + (self.point,)
+
+    def to_dict(self):
+        d = super().to_dict()
+        d['point'] = self.point
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        bet = super()._from_dict(d)
+        if d['point'] is not None:
+            bet.set_point(d['point'])
+        return bet
+
+    def is_push(self, roll, point):
+        # Pushes on 12 if it doesn't have a point yet
+        return point is not None and self.point is None and roll.value == 12
+
+    def roll_values(self):
+        return _ALL_VALUES if self._point is None else _OR_SEVEN[self._point]
+
 
 class CBOdds(CrapsBet):
+    __slots__ = ('_point', '_is_dont')
     name = 'Odds'
-    roll_win = set()
-    roll_lose = set()
 
     def __init__(self, point, is_dont, *a, **kw):
         super().__init__(*a, **kw)
         assert point in _POINT_VALUES
         self._point = point
         self._is_dont = is_dont
-        if not is_dont:
-            self.roll_win = {self.point}
-            self.roll_lose = {7}
-        else:
-            self.roll_win = {7}
-            self.roll_lose = {self.point}
 
     @property
     def point(self):
@@ -389,6 +923,37 @@ class CBOdds(CrapsBet):
     def is_dont(self):
         return self._is_dont
 
+    @property
+    def roll_win(self):
+        return _SEVEN if self._is_dont else _ONLY[self._point]
+
+    @property
+    def roll_lose(self):
+        return _ONLY[self._point] if self._is_dont else _SEVEN
+
+    def outcome_key(self):
+        return super().outcome_key() + (self.point, self.is_dont)
+
+    def to_dict(self):
+        d = super().to_dict()
+        d.update({'point': self.point, 'is_dont': self.is_dont})
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        return cls(
+            d['point'], d['is_dont'], d['amount'], working=d['working'])
+
+    def is_push(self, roll, point):
+        # Odds that are off push during the come out roll if they would have
+        # been settled
+        if point is not None or self.is_working:
+            return False
+        return roll.value == (self.point if self.is_dont else 7)
+
+    def roll_values(self):
+        return _OR_SEVEN[self._point]
+
     def win_amount(self, *a, **kw):
         if self.point in {4, 10}:
             ratio = 1 / 2 if self.is_dont else 2 / 1
@@ -401,15 +966,33 @@ class CBOdds(CrapsBet):
 
 
 class CBField(CBNoOffMixin, CrapsBet):
+    __slots__ = ('_mult2', '_mult12')
     name = 'Field'
-    roll_win = {2, 3, 4, 9, 10, 11, 12}
-    roll_lose = {5, 6, 7, 8}
+    roll_win = frozenset({2, 3, 4, 9, 10, 11, 12})
+    roll_lose = frozenset({5, 6, 7, 8})
 
     def __init__(self, *a, mult2=2, mult12=2, **kw):
         super().__init__(*a, **kw)
         self._mult2 = mult2
         self._mult12 = mult12
 
+    def outcome_key(self):
+        return super().outcome_key() + (self._mult2, self._mult12)
+
+    def to_dict(self):
+        d = super().to_dict()
+        d.update({'mult2': self._mult2, 'mult12': self._mult12})
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        return cls(
+            d['amount'], working=d['working'], mult2=d['mult2'],
+            mult12=d['mult12'])
+
+    def roll_values(self):
+        return _ALL_VALUES
+
     def win_amount(self, roll):
         if roll.value == 2:
             return self.amount * self._mult2
@@ -419,33 +1002,48 @@ class CBField(CBNoOffMixin, CrapsBet):
 
 
 class CBPlace(CrapsBet):
-    name = 'Place'
-    roll_win = set()
-    roll_lose = {7}
+    __slots__ = ('_value',)
+    roll_lose = _SEVEN
 
     def __init__(self, value, *a, **kw):
         super().__init__(*a, **kw)
-        self.roll_win = {value}
-        self.name += str(value)
+        self._value = value
+
+    @property
+    def name(self):
+        return 'Place' + str(self._value)
 
     @property
     def value(self):
-        assert len(self.roll_win) == 1
-        return list(self.roll_win)[0]
+        return self._value
+
+    def to_dict(self):
+        d = super().to_dict()
+        d['value'] = self.value
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        return cls(d['value'], d['amount'], working=d['working'])
+
+    @property
+    def roll_win(self):
+        return _ONLY[self._value]
+
+    def roll_values(self):
+        return _OR_SEVEN[self._value]
 
     def win_amount(self, *a, **kw):
-        rw = self.roll_win
-        assert len(rw) == 1
-        assert 4 in rw or 5 in rw or 6 in rw or 8 in rw or 9 in rw or 10 in rw
-        if 4 in rw or 10 in rw:
+        assert self.value in _POINT_VALUES
+        if self.value in {4, 10}:
             return self.amount * 9 / 5
-        elif 5 in rw or 9 in rw:
+        elif self.value in {5, 9}:
             return self.amount * 7 / 5
         return self.amount * 7 / 6
 
 
 class CBHardWay(CrapsBet):
-    name = 'Hard'
+    __slots__ = ('_value',)
     roll_win = None
     roll_lose = None
 
@@ -453,12 +1051,24 @@ class CBHardWay(CrapsBet):
         super().__init__(*a, **kw)
         assert value in {4, 6, 8, 10}
         self._value = value
-        self.name += str(self.value)
+
+    @property
+    def name(self):
+        return 'Hard' + str(self._value)
 
     @property
     def value(self):
         return self._value
 
+    def to_dict(self):
+        d = super().to_dict()
+        d['value'] = self.value
+        return d
+
+    @classmethod
+    def _from_dict(cls, d):
+        return cls(d['value'], d['amount'], working=d['working'])
+
     def is_winner(self, roll, *a):
         return roll.value == self.value and roll.dice[0] == roll.dice[1]
 
@@ -466,17 +1076,29 @@ class CBHardWay(CrapsBet):
         return roll.value == 7 or \
             roll.value == self.value and roll.dice[0] != roll.dice[1]
 
+    def roll_values(self):
+        return _OR_SEVEN[self._value]
+
     def win_amount(self, *a, **kw):
         if self.value in {4, 10}:
             return 7 * self.amount
         return 9 * self.amount
 
 
+_BET_TYPES = {
+    class_.__name__: class_ for class_ in (
+        CBPass, CBDontPass, CBCome, CBDontCome, CBOdds, CBField, CBPlace,
+        CBHardWay)}
+
+
 class CrapsGameEvent:
+    __slots__ = ()
     name = 'CrapsGameEvent'
 
 
 class CGEWithBets(CrapsGameEvent):
+    __slots__ = ('_bets',)
+
     def __init__(self, bets, *a, **kw):
         super().__init__(*a, **kw)
         # If given an iterable of bets, store it directly. Otherwise we were
@@ -490,6 +1112,7 @@ class CGEWithBets(CrapsGameEvent):
 
 
 class CGEBetWon(CGEWithBets):
+    __slots__ = ()
     name = 'BetWon'
 
     def __str__(self):
@@ -501,6 +1124,7 @@ class CGEBetWon(CGEWithBets):
 
 
 class CGEBetLost(CGEWithBets):
+    __slots__ = ()
     name = 'BetLost'
 
     def __str__(self):
@@ -512,6 +1136,7 @@ class CGEBetLost(CGEWithBets):
 
 
 class CGEBetPush(CGEWithBets):
+    __slots__ = ()
     name = 'BetPush'
 
     def __str__(self):
@@ -523,6 +1148,7 @@ class CGEBetPush(CGEWithBets):
 
 
 class CGEBetConverted(CGEWithBets):
+    __slots__ = ()
     name = 'BetConverted'
 
     def __init__(self, from_bet, to_bet, *a, **kw):
@@ -541,6 +1167,8 @@ class CGEBetConverted(CGEWithBets):
 
 
 class CGEPoint(CrapsGameEvent):
+    __slots__ = ('_point',)
+
     def __init__(self, point, *a, **kw):
         super().__init__(*a, **kw)
         self._point = point
@@ -551,37 +1179,46 @@ class CGEPoint(CrapsGameEvent):
 
 
 class CGEPointEstablished(CGEPoint):
+    __slots__ = ()
+
     def __str__(self):
         return 'PointEst<%d>' % self.point
 
 
 class CGEPointWon(CGEPoint):
+    __slots__ = ()
+
     def __str__(self):
         return 'PointWon<%d>' % self.point
 
 
 class CGEPointLost(CGEPoint):
+    __slots__ = ()
+
     def __str__(self):
         return 'PointLost<%d>' % self.point
 
 
 class MartingaleFieldStrategy(Strategy):
+    max_lookback = 0
+    uses_counters = True
+    bet_types = (CBField,)
+
     def __init__(self, base_bet, *a, **kw):
         self._base_bet = base_bet
         super().__init__('MartengaleFieldStrat', *a, **kw)
 
     def make_bets(self):
-        amount = self._base_bet
-        rolls_reverse = reversed(self.rolls)
-        for roll in rolls_reverse:
-            if roll.value in {2, 3, 4, 9, 10, 11, 12}:
-                break
-            amount *= 2
+        # Double the bet after every loss in a row
+        amount = self._base_bet * 2 ** self.field_loss_streak
         assert not len(self.bets)
         self.add_bet(CBField(amount))
 
 
 class BasicPassStrategy(Strategy):
+    max_lookback = 0
+    bet_types = (CBPass,)
+
     def __init__(self, base_bet, *a, **kw):
         self._base_bet = base_bet
         super().__init__('BasicPassStrat', *a, **kw)
@@ -593,6 +1230,9 @@ class BasicPassStrategy(Strategy):
 
 
 class BasicComeStrategy(Strategy):
+    max_lookback = 0
+    bet_types = (CBCome,)
+
     def __init__(self, base_bet, max_comes, *a, **kw):
         ''' Whenever there is a point and less than max_comes Come bets exist
         up, make a come bet. No odds. '''
@@ -611,6 +1251,9 @@ class BasicComeStrategy(Strategy):
 
 
 class BasicPlaceStrategy(Strategy):
+    max_lookback = 0
+    bet_types = (CBPlace,)
+
     def __init__(self, base_bet, which_nums, *a, **kw):
         ''' Whenever there is a point and one of the place values you want to
         bet on is missing, make a bet for it. Never press bets. Never take them
@@ -635,15 +1278,17 @@ class BasicPlaceStrategy(Strategy):
         assert self.point in _POINT_VALUES
         for bet in self.bets:
             bet.set_working(True)
-        already_placed_values = [b.value for b in self.bets]
         for n in self._nums:
-            if n in already_placed_values:
+            if len(self.bets.tied_to(CBPlace, n)):
                 continue
             a = amount if n not in {6, 8} else amount * 1.2
             self.add_bet(CBPlace(n, a))
 
 
 class ThreePointMolly(Strategy):
+    max_lookback = 0
+    bet_types = (CBPass, CBCome, CBOdds)
+
     def __init__(self, base_bet, odds, *a, num_comes=2, **kw):
         ''' Plays the 3-point molly strategy with max odds. Turns come odds off
         during come out rolls.
@@ -674,25 +1319,23 @@ class ThreePointMolly(Strategy):
         amount = self._base_bet
         if self.point is None:
             # Set any come odds off
-            for bet in self.bets:
-                if not isinstance(bet, CBOdds):
-                    continue
+            for bet in self.bets.of_type(CBOdds):
                 bet.set_working(False)
             # Make pass bet if needed
-            if not len([b for b in self.bets if isinstance(b, CBPass)]):
+            if not len(self.bets.of_type(CBPass)):
                 self.add_bet(CBPass(amount))
             return
         assert self.point in _POINT_VALUES
-        come_bets = [b for b in self.bets if isinstance(b, CBCome)]
-        odds_bets = [b for b in self.bets if isinstance(b, CBOdds)]
+        come_bets = self.bets.of_type(CBCome)
+        odds_bets = self.bets.of_type(CBOdds)
+        odds_points = {b.point for b in odds_bets}
         # Make pass odds bet if needed
-        if not len([b for b in odds_bets if b.point == self.point]):
+        if self.point not in odds_points:
             a = self._calc_odds_amount(self.point)
             self.add_bet(CBOdds(self.point, False, a))
         # Make come odds bet if needed
         for come_bet in come_bets:
-            odds = [b for b in odds_bets if b.point == come_bet.point]
-            if not len(odds):
+            if come_bet.point not in odds_points:
                 a = self._calc_odds_amount(self.point)
                 self.add_bet(CBOdds(come_bet.point, False, a))
         # Make come bet if needed
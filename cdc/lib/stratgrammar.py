@@ -0,0 +1,409 @@
+''' The lexer and parser for the strategy language. See cdc.lib.stratlang,
+which only imports this when it parses a program.
+
+Building the LALR tables for _Parser takes longer than everything else
+needed to parse a program, so they are made ahead of time and kept in
+TABLES_FNAME. Run this module to write them again after changing the
+grammar:
+
+    python -m cdc.lib.stratgrammar
+
+If they are missing or were made from a different grammar, they are built
+when this module is imported, as sly would normally do.
+'''
+from .stratlang import InvalidValueError, StrategyTooComplexError, BinOp,\
+    AssignOp, CondOp, UserVar, VarId, MakeBetOp, TailOp, LenOp,\
+    bet_type_from_str
+
+from types import SimpleNamespace
+import json
+import os
+
+import sly
+from sly.yacc import Production
+
+TABLES_FNAME = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'stratgrammar-tables.json')
+
+
+class _Lexer(sly.Lexer):
+    tokens = {
+        INT, FLOAT, BOOL, NONE,
+        IF, THEN, ELSE, DONE,
+        AND, OR,
+        LAST, LEN,
+        SET, TO, USER_VAR_ID,
+        EQ, NEQ, GT, LT, GTEQ, LTEQ,
+        PLUS, MINUS, MULT, DIV, MOD,
+        VAR_ID, LIST_ID,
+        MAKE_BET,
+        BET_TYPE_NO_ARG,
+        BET_TYPE_1_ARG_POINT_VALUE,
+        BET_TYPE_1_ARG_HARD_WAY,
+        BET_TYPE_2_ARG_ODDS,
+    }
+
+    literals = {'{', '}', '(', ')'}
+    ignore = ' \t\n'
+    ignore_comment = r'\#.*'
+
+    IF = r'if'
+    THEN = r'then'
+    ELSE = r'else'
+    DONE = r'done'
+    AND = r'(and|&&)'
+    OR = r'(or|\|\|)'
+    LAST = r'last'
+    LEN = r'(length|number) of'
+    SET = r'set'
+    TO = r'to'
+    GTEQ = r'>='
+    LTEQ = r'<='
+    GT = r'>'
+    LT = r'<'
+    NEQ = r'(is not|!=)'
+    EQ = r'(is|==)'
+    PLUS = r'\+'
+    MINUS = r'-'
+    MULT = r'\*'
+    DIV = r'/'
+    MOD = r'%'
+    VAR_ID = r'('\
+        'current point|'\
+        'bankroll|'\
+        'field loss streak|'\
+        'rolls since point(?! established)|'\
+        'points made|'\
+        'seven outs)'
+    LIST_ID = r'('\
+        'rolls since point established|'\
+        'rolls?|'\
+        'points?)'
+    MAKE_BET = r'make bet'
+    BET_TYPE_NO_ARG = r'('\
+        'dont pass|'\
+        'pass|'\
+        'dont come|'\
+        'come|'\
+        'field)'
+    BET_TYPE_1_ARG_POINT_VALUE = r'place'
+    BET_TYPE_1_ARG_HARD_WAY = r'hard'
+    BET_TYPE_2_ARG_ODDS = r'odds'
+
+    @_(r'\d*\.\d+')
+    def FLOAT(self, t):
+        t.value = float(t.value)
+        return t
+
+    @_(r'\d+')
+    def INT(self, t):
+        t.value = int(t.value)
+        return t
+
+    @_(r'([Tt]rue|[Ff]alse)')
+    def BOOL(self, t):
+        t.value = t.value.lower() == 'true'
+        return t
+
+    @_(r'[Nn]one')
+    def NONE(self, t):
+        return None
+
+    USER_VAR_ID = r'[A-Za-z_][A-Za-z0-9_]*'
+
+
+def _rule_funcs(definitions):
+    ''' Return every function with grammar rules in the given class
+    definitions, including the ones hidden by a later function with the same
+    name, in the order sly finds them '''
+    funcs = []
+    for _, value in definitions:
+        if callable(value) and hasattr(value, 'rules'):
+            func = value
+            while func:
+                funcs.append(func)
+                func = getattr(func, 'next_func', None)
+    return funcs
+
+
+def _signature(cls, funcs):
+    ''' Return everything about the grammar of parser class cls that its
+    tables depend on '''
+    return {
+        'tokens': sorted(cls.tokens),
+        'precedence': [list(level) for level in cls.precedence],
+        'start': getattr(cls, 'start', None),
+        'rules': [[func.__name__, list(func.rules)] for func in funcs],
+    }
+
+
+def _build_with_sly(cls):
+    ''' Return a new parser class with the same grammar as cls, with its
+    tables built by sly '''
+    meta = type(sly.Parser)
+    namespace = meta.__prepare__(cls.__name__, (sly.Parser,))
+    dict.update(namespace, cls._definitions)
+    return meta(cls.__name__, (sly.Parser,), namespace)
+
+
+def _tables(built, funcs):
+    ''' Return the tables of parser class built, as written to TABLES_FNAME.
+    Each production refers to the function it calls by its index in funcs.
+    '''
+    index = {func: i for i, func in enumerate(funcs)}
+    lrtable = built._lrtable
+    states = range(len(lrtable.lr_action))
+    return {
+        'signature': _signature(built, funcs),
+        'productions': [
+            [p.name, list(p.prod), index[p.func] if p.func else None]
+            for p in built._grammar.Productions],
+        'action': [lrtable.lr_action[state] for state in states],
+        'goto': [lrtable.lr_goto.get(state, {}) for state in states],
+        'defaulted': sorted(lrtable.defaulted_states.items()),
+    }
+
+
+def _read_tables():
+    try:
+        with open(TABLES_FNAME, 'rt') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def write_tables(fname=TABLES_FNAME):
+    ''' Build _Parser's tables and write them to fname '''
+    built = _build_with_sly(_Parser)
+    with open(fname, 'wt') as fd:
+        json.dump(_tables(built, _Parser._funcs), fd, sort_keys=True)
+        fd.write('\n')
+
+
+class _Parser(sly.Parser):
+    # debugfile = 'parser.debug.txt'
+    tokens = _Lexer.tokens
+    _complexity = 0
+
+    precedence = (
+        ('left', PLUS, MINUS,),
+        ('left', MULT, DIV,),
+        ('right', UMINUS),
+    )
+
+    def __init__(self, *a, max_complexity=None, **kw):
+        super().__init__(*a, **kw)
+        self._max_complexity = max_complexity
+
+    @property
+    def complexity(self):
+        return self._complexity
+
+    def add_complexity(self, amount=1):
+        self._complexity += amount
+        if self._max_complexity and self.complexity > self._max_complexity:
+            raise StrategyTooComplexError(
+                self.complexity, self._max_complexity)
+
+    def error(self, t):
+        raise SyntaxError(t)
+
+    @classmethod
+    def _build(cls, definitions):
+        ''' Called by sly as the class is made. Use the tables in
+        TABLES_FNAME if they were made from this grammar, and otherwise build
+        them like sly would. '''
+        # Keep the definitions for building the tables with sly. The class
+        # cell is left out so super() still means this class.
+        cls._definitions = [
+            (k, v) for k, v in definitions
+            if k not in {'_build', '__classcell__'}]
+        cls._funcs = _rule_funcs(definitions)
+        tables = _read_tables()
+        if cls.debugfile or tables is None or \
+                tables['signature'] != _signature(cls, cls._funcs):
+            built = _build_with_sly(cls)
+            cls._grammar, cls._lrtable = built._grammar, built._lrtable
+            return
+        # Only what sly.Parser.parse uses of the grammar and tables
+        cls._grammar = SimpleNamespace(Productions=[
+            Production(
+                i, name, prod, func=None if func is None else cls._funcs[func])
+            for i, (name, prod, func) in enumerate(tables['productions'])])
+        cls._lrtable = SimpleNamespace(
+            lr_action=tables['action'], lr_goto=tables['goto'],
+            defaulted_states=dict(tables['defaulted']))
+
+    @_('"{" stmtlist "}"')
+    def block(self, p):
+        return p.stmtlist
+
+    @_('stmt')
+    def block(self, p):
+        return p.stmt
+
+    @_('stmt stmtlist')
+    def stmtlist(self, p):
+        return p.stmt, p.stmtlist
+
+    @_('stmt')
+    def stmtlist(self, p):
+        return p.stmt
+
+    @_('assign DONE')
+    def stmt(self, p):
+        return p.assign
+
+    @_('SET USER_VAR_ID TO expr')
+    def assign(self, p):
+        # expr will add 1 already (unless empty), but add additional complexity
+        # for the memory usage
+        self.add_complexity()
+        return AssignOp(p.USER_VAR_ID, p.expr)
+
+    @_('expr DONE')
+    def stmt(self, p):
+        return p.expr
+
+    @_('literal')
+    def expr(self, p):
+        self.add_complexity()
+        return p.literal
+
+    @_('empty')
+    def expr(self, p):
+        # self.add_complexity()
+        return p.empty
+
+    @_('')
+    def empty(self, p):
+        return None
+
+    @_('BOOL')
+    def literal(self, p):
+        return p.BOOL
+
+    @_('numeric', 'NONE')
+    def literal(self, p):
+        return p[0]
+
+    @_('INT', 'FLOAT')
+    def numeric(self, p):
+        return p[0]
+
+    @_('IF cond THEN block')
+    def stmt(self, p):
+        return CondOp(p.cond, p.block, None)
+
+    @_('IF cond THEN block ELSE block')
+    def stmt(self, p):
+        return CondOp(p.cond, p.block0, p.block1)
+
+    @_('"(" expr ")"')
+    def expr(self, p):
+        return p.expr
+
+    @_('"(" cond ")"')
+    def cond(self, p):
+        return p.cond
+
+    @_('literal')
+    def cond(self, p):
+        self.add_complexity()
+        return p.literal
+
+    @_('cond AND cond', 'cond OR cond')
+    def cond(self, p):
+        return BinOp(p[1], p.cond0, p.cond1)
+
+    @_('MINUS expr %prec UMINUS')
+    def expr(self, p):
+        return -1 * p.expr
+
+    @_(
+        'expr EQ expr',
+        'expr NEQ expr',
+        'expr GT expr',
+        'expr LT expr',
+        'expr GTEQ expr',
+        'expr LTEQ expr',
+    )
+    def cond(self, p):
+        return BinOp(p[1], p.expr0, p.expr1)
+
+    @_(
+        'expr PLUS expr',
+        'expr MINUS expr',
+        'expr MULT expr',
+        'expr DIV expr',
+        'expr MOD expr',
+    )
+    def expr(self, p):
+        return BinOp(p[1], p.expr0, p.expr1)
+
+    @_('USER_VAR_ID')
+    def expr(self, p):
+        return UserVar(p.USER_VAR_ID)
+
+    @_('LAST LIST_ID')
+    def expr(self, p):
+        self.add_complexity()
+        return TailOp(p.LIST_ID, 1)
+
+    @_('LAST INT LIST_ID')
+    def expr(self, p):
+        self.add_complexity()
+        return TailOp(p.LIST_ID, p.INT)
+
+    @_('LEN LIST_ID')
+    def expr(self, p):
+        self.add_complexity()
+        return LenOp(p.LIST_ID)
+
+    @_('VAR_ID')
+    def expr(self, p):
+        self.add_complexity()
+        return VarId.from_string(p.VAR_ID)
+
+    @_('MAKE_BET bet')
+    def expr(self, p):
+        self.add_complexity()
+        return MakeBetOp(p.bet)
+
+    @_('BET_TYPE_NO_ARG amount')
+    def bet(self, p):
+        return bet_type_from_str(p.BET_TYPE_NO_ARG)(p.amount)
+
+    @_('BET_TYPE_1_ARG_POINT_VALUE point_value amount')
+    def bet(self, p):
+        return bet_type_from_str(p[0])(p.point_value, p.amount)
+
+    @_('BET_TYPE_1_ARG_HARD_WAY hard_value amount')
+    def bet(self, p):
+        return bet_type_from_str(p[0])(p.hard_value, p.amount)
+
+    @_('BET_TYPE_2_ARG_ODDS point_value BOOL amount')
+    def bet(self, p):
+        return bet_type_from_str(p[0])(p.point_value, p.BOOL, p.amount)
+
+    @_('INT')
+    def amount(self, p):
+        return p.INT
+
+    @_('INT')
+    def point_value(self, p):
+        valid = {4, 5, 6, 8, 9, 10}
+        if p.INT in valid:
+            return p.INT
+        raise InvalidValueError(p.INT, valid)
+
+    @_('INT')
+    def hard_value(self, p):
+        valid = {4, 6, 8, 10}
+        if p.INT in valid:
+            return p.INT
+        raise InvalidValueError(p.INT, valid)
+
+
+if __name__ == '__main__':
+    write_tables()
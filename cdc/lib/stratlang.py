@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
+from collections import Counter
+from copy import copy
 import io
 import enum
+import operator
 import sys
 
-import sly
-
 from cdc.lib.strategy import CBPass, CBDontPass, CBCome, CBDontCome, CBField,\
-    CBPlace, CBHardWay, CBOdds
+    CBPlace, CBHardWay, CBOdds, CrapsRoll
 
 
 class InvalidValueError(Exception):
@@ -28,86 +29,6 @@ class StrategyTooComplexError(Exception):
             (self.complexity, self.max_complexity)
 
 
-class _Lexer(sly.Lexer):
-    tokens = {
-        INT, FLOAT, BOOL, NONE,
-        IF, THEN, ELSE, DONE,
-        AND, OR,
-        LAST, LEN,
-        SET, TO, USER_VAR_ID,
-        EQ, NEQ, GT, LT, GTEQ, LTEQ,
-        PLUS, MINUS, MULT, DIV, MOD,
-        VAR_ID, LIST_ID,
-        MAKE_BET,
-        BET_TYPE_NO_ARG,
-        BET_TYPE_1_ARG_POINT_VALUE,
-        BET_TYPE_1_ARG_HARD_WAY,
-        BET_TYPE_2_ARG_ODDS,
-    }
-
-    literals = {'{', '}', '(', ')'}
-    ignore = ' \t\n'
-    ignore_comment = r'\#.*'
-
-    IF = r'if'
-    THEN = r'then'
-    ELSE = r'else'
-    DONE = r'done'
-    AND = r'(and|&&)'
-    OR = r'(or|\|\|)'
-    LAST = r'last'
-    LEN = r'(length|number) of'
-    SET = r'set'
-    TO = r'to'
-    GTEQ = r'>='
-    LTEQ = r'<='
-    GT = r'>'
-    LT = r'<'
-    NEQ = r'(is not|!=)'
-    EQ = r'(is|==)'
-    PLUS = r'\+'
-    MINUS = r'-'
-    MULT = r'\*'
-    DIV = r'/'
-    MOD = r'%'
-    VAR_ID = r'(current point|bankroll)'
-    LIST_ID = r'('\
-        'rolls since point established|'\
-        'rolls?|'\
-        'points?)'
-    MAKE_BET = r'make bet'
-    BET_TYPE_NO_ARG = r'('\
-        'dont pass|'\
-        'pass|'\
-        'dont come|'\
-        'come|'\
-        'field)'
-    BET_TYPE_1_ARG_POINT_VALUE = r'place'
-    BET_TYPE_1_ARG_HARD_WAY = r'hard'
-    BET_TYPE_2_ARG_ODDS = r'odds'
-
-    @_(r'\d*\.\d+')
-    def FLOAT(self, t):
-        t.value = float(t.value)
-        return t
-
-    @_(r'\d+')
-    def INT(self, t):
-        t.value = int(t.value)
-        return t
-
-    @_(r'([Tt]rue|[Ff]alse)')
-    def BOOL(self, t):
-        t.value = t.value.lower() == 'true'
-        return t
-
-    @_(r'[Nn]one')
-    def NONE(self, t):
-        return None
-
-    USER_VAR_ID = r'[A-Za-z_][A-Za-z0-9_]*'
-
-
 class Expr:
     pass
 
@@ -249,6 +170,10 @@ class UserVar(Expr):
 class VarId(enum.Enum):
     Point = enum.auto()
     Bankroll = enum.auto()
+    FieldLossStreak = enum.auto()
+    RollsSincePoint = enum.auto()
+    PointsMade = enum.auto()
+    SevenOuts = enum.auto()
 
     @staticmethod
     def from_string(s):
@@ -256,6 +181,10 @@ class VarId(enum.Enum):
             return {
                 'current point': VarId.Point,
                 'bankroll': VarId.Bankroll,
+                'field loss streak': VarId.FieldLossStreak,
+                'rolls since point': VarId.RollsSincePoint,
+                'points made': VarId.PointsMade,
+                'seven outs': VarId.SevenOuts,
             }[s.lower()]
         except KeyError:
             raise NotImplementedError('Can\'t convert "%s" to VarId' % s)
@@ -339,203 +268,23 @@ class LenOp(Expr):
         return len(the_list)
 
 
-class _Parser(sly.Parser):
-    # debugfile = 'parser.debug.txt'
-    tokens = _Lexer.tokens
-    _complexity = 0
+class SharedOp(Expr):
+    ''' An expression that appears more than once in a program and has the
+    same value for the whole of one run of it, so it is only evaluated once
+    per run. Only made by optimize. '''
+    def __init__(self, slot, expr):
+        self.slot = slot
+        self.expr = expr
 
-    precedence = (
-        ('left', PLUS, MINUS,),
-        ('left', MULT, DIV,),
-        ('right', UMINUS),
-    )
-
-    def __init__(self, *a, max_complexity=None, **kw):
-        super().__init__(*a, **kw)
-        self._max_complexity = max_complexity
+    def __str__(self):
+        return 'Shared%d<%s>' % (self.slot, self.expr)
 
-    @property
-    def complexity(self):
-        return self._complexity
-
-    def add_complexity(self, amount=1):
-        self._complexity += amount
-        if self._max_complexity and self.complexity > self._max_complexity:
-            raise StrategyTooComplexError(
-                self.complexity, self._max_complexity)
-
-    def error(self, t):
-        raise SyntaxError(t)
-
-    @_('"{" stmtlist "}"')
-    def block(self, p):
-        return p.stmtlist
-
-    @_('stmt')
-    def block(self, p):
-        return p.stmt
-
-    @_('stmt stmtlist')
-    def stmtlist(self, p):
-        return p.stmt, p.stmtlist
-
-    @_('stmt')
-    def stmtlist(self, p):
-        return p.stmt
-
-    @_('assign DONE')
-    def stmt(self, p):
-        return p.assign
-
-    @_('SET USER_VAR_ID TO expr')
-    def assign(self, p):
-        # expr will add 1 already (unless empty), but add additional complexity
-        # for the memory usage
-        self.add_complexity()
-        return AssignOp(p.USER_VAR_ID, p.expr)
-
-    @_('expr DONE')
-    def stmt(self, p):
-        return p.expr
-
-    @_('literal')
-    def expr(self, p):
-        self.add_complexity()
-        return p.literal
-
-    @_('empty')
-    def expr(self, p):
-        # self.add_complexity()
-        return p.empty
-
-    @_('')
-    def empty(self, p):
-        return None
+    def __eq__(self, rhs):
+        return self.slot == rhs.slot and \
+            self.expr == rhs.expr
 
-    @_('BOOL')
-    def literal(self, p):
-        return p.BOOL
-
-    @_('numeric', 'NONE')
-    def literal(self, p):
-        return p[0]
-
-    @_('INT', 'FLOAT')
-    def numeric(self, p):
-        return p[0]
-
-    @_('IF cond THEN block')
-    def stmt(self, p):
-        return CondOp(p.cond, p.block, None)
-
-    @_('IF cond THEN block ELSE block')
-    def stmt(self, p):
-        return CondOp(p.cond, p.block0, p.block1)
-
-    @_('"(" expr ")"')
-    def expr(self, p):
-        return p.expr
-
-    @_('"(" cond ")"')
-    def cond(self, p):
-        return p.cond
-
-    @_('literal')
-    def cond(self, p):
-        self.add_complexity()
-        return p.literal
-
-    @_('cond AND cond', 'cond OR cond')
-    def cond(self, p):
-        return BinOp(p[1], p.cond0, p.cond1)
-
-    @_('MINUS expr %prec UMINUS')
-    def expr(self, p):
-        return -1 * p.expr
-
-    @_(
-        'expr EQ expr',
-        'expr NEQ expr',
-        'expr GT expr',
-        'expr LT expr',
-        'expr GTEQ expr',
-        'expr LTEQ expr',
-    )
-    def cond(self, p):
-        return BinOp(p[1], p.expr0, p.expr1)
-
-    @_(
-        'expr PLUS expr',
-        'expr MINUS expr',
-        'expr MULT expr',
-        'expr DIV expr',
-        'expr MOD expr',
-    )
-    def expr(self, p):
-        return BinOp(p[1], p.expr0, p.expr1)
-
-    @_('USER_VAR_ID')
-    def expr(self, p):
-        return UserVar(p.USER_VAR_ID)
-
-    @_('LAST LIST_ID')
-    def expr(self, p):
-        self.add_complexity()
-        return TailOp(p.LIST_ID, 1)
-
-    @_('LAST INT LIST_ID')
-    def expr(self, p):
-        self.add_complexity()
-        return TailOp(p.LIST_ID, p.INT)
-
-    @_('LEN LIST_ID')
-    def expr(self, p):
-        self.add_complexity()
-        return LenOp(p.LIST_ID)
-
-    @_('VAR_ID')
-    def expr(self, p):
-        self.add_complexity()
-        return VarId.from_string(p.VAR_ID)
-
-    @_('MAKE_BET bet')
-    def expr(self, p):
-        self.add_complexity()
-        return MakeBetOp(p.bet)
-
-    @_('BET_TYPE_NO_ARG amount')
-    def bet(self, p):
-        return bet_type_from_str(p.BET_TYPE_NO_ARG)(p.amount)
-
-    @_('BET_TYPE_1_ARG_POINT_VALUE point_value amount')
-    def bet(self, p):
-        return bet_type_from_str(p[0])(p.point_value, p.amount)
-
-    @_('BET_TYPE_1_ARG_HARD_WAY hard_value amount')
-    def bet(self, p):
-        return bet_type_from_str(p[0])(p.hard_value, p.amount)
-
-    @_('BET_TYPE_2_ARG_ODDS point_value BOOL amount')
-    def bet(self, p):
-        return bet_type_from_str(p[0])(p.point_value, p.BOOL, p.amount)
-
-    @_('INT')
-    def amount(self, p):
-        return p.INT
-
-    @_('INT')
-    def point_value(self, p):
-        valid = {4, 5, 6, 8, 9, 10}
-        if p.INT in valid:
-            return p.INT
-        raise InvalidValueError(p.INT, valid)
-
-    @_('INT')
-    def hard_value(self, p):
-        valid = {4, 6, 8, 10}
-        if p.INT in valid:
-            return p.INT
-        raise InvalidValueError(p.INT, valid)
+    def __ne__(self, rhs):
+        return not self == rhs
 
 
 def _flatten(result):
@@ -548,7 +297,508 @@ def _flatten(result):
             yield item
 
 
+def _walk(item):
+    ''' Yield every node in the given (piece of a) parsed program, parents
+    before their children '''
+    yield item
+    if isinstance(item, (list, tuple)):
+        children = item
+    elif isinstance(item, CondOp):
+        children = (item.cond, item.true_case, item.false_case)
+    elif isinstance(item, (AssignOp, SharedOp)):
+        children = (item.expr,)
+    elif isinstance(item, BinOp):
+        children = (item.left, item.right)
+    else:
+        children = ()
+    for child in children:
+        yield from _walk(child)
+
+
+def walk(logic):
+    ''' Yield every node in the given parsed program '''
+    for item in logic:
+        yield from _walk(item)
+
+
+# The VarIds whose values are Strategy counters (see cdc.lib.strategy)
+COUNTER_VAR_IDS = frozenset({
+    VarId.FieldLossStreak, VarId.RollsSincePoint, VarId.PointsMade,
+    VarId.SevenOuts})
+
+
+class Analysis:
+    ''' What a parsed program can read and do, from analyze():
+
+    - var_ids: the VarIds it reads
+    - list_ids: the ListIds it reads, with "last" or "length of"
+    - length_ids: the ListIds it reads the length of
+    - max_lookback: the most rolls it ever looks back at with "last"
+    - uses_user_vars: whether it sets or reads any user variables
+    - bet_types: the CrapsBet classes of the bets it can make
+
+    It can read and do these things in branches that are never taken, so
+    analyze optimized programs (see optimize) to leave those out. '''
+    def __init__(self, var_ids, list_ids, length_ids, max_lookback,
+                 uses_user_vars, bet_types):
+        self.var_ids = frozenset(var_ids)
+        self.list_ids = frozenset(list_ids)
+        self.length_ids = frozenset(length_ids)
+        self.max_lookback = max_lookback
+        self.uses_user_vars = uses_user_vars
+        self.bet_types = frozenset(bet_types)
+
+    @property
+    def uses_bankroll(self):
+        return VarId.Bankroll in self.var_ids
+
+    @property
+    def uses_counters(self):
+        ''' Whether it reads any of the counters a Strategy keeps '''
+        return not self.var_ids.isdisjoint(COUNTER_VAR_IDS)
+
+    @property
+    def uses_num_rolls(self):
+        ''' Whether it reads how many rolls there have been '''
+        return ListId.Rolls in self.length_ids
+
+
+def analyze(logic):
+    ''' Return an Analysis of the given parsed program '''
+    var_ids, list_ids, length_ids, bet_types = set(), set(), set(), set()
+    lookback = 0
+    uses_user_vars = False
+    for item in walk(logic):
+        if isinstance(item, VarId):
+            var_ids.add(item)
+        elif isinstance(item, (TailOp, LenOp)):
+            list_ids.add(item.list_id)
+            if isinstance(item, LenOp):
+                length_ids.add(item.list_id)
+            elif item.list_id == ListId.Rolls:
+                lookback = max(lookback, item.num)
+        elif isinstance(item, (UserVar, AssignOp)):
+            uses_user_vars = True
+        elif isinstance(item, MakeBetOp):
+            bet_types.add(type(item.bet))
+    return Analysis(
+        var_ids, list_ids, length_ids, lookback, uses_user_vars, bet_types)
+
+
+def max_lookback(logic):
+    ''' Return the most rolls the given parsed program ever looks back at '''
+    return analyze(logic).max_lookback
+
+
+def uses_counters(logic):
+    ''' Return whether the given parsed program reads any of the counters a
+    Strategy keeps '''
+    return analyze(logic).uses_counters
+
+
+# How to get the value of each VarId from a Strategy
+_VAR_GETTERS = {
+    VarId.Bankroll: operator.attrgetter('bankroll'),
+    VarId.Point: operator.attrgetter('point'),
+    VarId.FieldLossStreak: operator.attrgetter('field_loss_streak'),
+    VarId.RollsSincePoint: operator.attrgetter('rolls_since_point'),
+    VarId.PointsMade: operator.attrgetter('points_made'),
+    VarId.SevenOuts: operator.attrgetter('seven_outs'),
+}
+_BINOPS = {
+    BinOpId.Eq: operator.eq,
+    BinOpId.Neq: operator.ne,
+    BinOpId.Gt: operator.gt,
+    BinOpId.Lt: operator.lt,
+    BinOpId.Gteq: operator.ge,
+    BinOpId.Lteq: operator.le,
+    BinOpId.And: lambda l_, r_: l_ and r_,
+    BinOpId.Or: lambda l_, r_: l_ or r_,
+    BinOpId.Plus: operator.add,
+    BinOpId.Minus: operator.sub,
+    BinOpId.Mult: operator.mul,
+    BinOpId.Div: operator.truediv,
+    BinOpId.Mod: operator.mod,
+}
+
+
+def _raiser(exc):
+    ''' Return a function that raises exc when called, for things that are
+    only an error if the program ever gets to them '''
+    def f(strat, user_vars):
+        raise exc
+    return f
+
+
+def _compile_operand(item):
+    ''' Return a function of (strat, user_vars) that evaluates one side of a
+    BinOp, and whether it is a constant (in which case the function returns
+    it no matter what) '''
+    if isinstance(item, BinOp):
+        return _compile_binop(item), False
+    if isinstance(item, VarId):
+        getter = _VAR_GETTERS.get(item)
+        if getter is None:
+            return _raiser(NotImplementedError(
+                'Can\'t get value for %s' % item)), False
+        return lambda strat, user_vars: getter(strat), False
+    if isinstance(item, (TailOp, LenOp)):
+        if item.list_id != ListId.Rolls:
+            return _raiser(NotImplementedError(
+                'Can\'t get list value for %s' % item.list_id)), False
+        if isinstance(item, LenOp):
+            return lambda strat, user_vars: len(strat.rolls), False
+        if item.num == 1:
+            def last_roll(strat, user_vars):
+                rolls = strat.rolls
+                return rolls.last.value if len(rolls) else None
+            return last_roll, False
+
+        def tail(strat, user_vars):
+            res = item.get(strat.rolls)
+            return res.value if isinstance(res, CrapsRoll) else res
+        return tail, False
+    if isinstance(item, UserVar):
+        id_ = item.id
+        return lambda strat, user_vars: user_vars[id_], False
+    if isinstance(item, SharedOp):
+        # Kept for the rest of the run with the user variables, under a key
+        # no user variable can have
+        slot = item.slot
+        expr, _ = _compile_operand(item.expr)
+
+        def shared(strat, user_vars):
+            if slot in user_vars:
+                return user_vars[slot]
+            value = user_vars[slot] = expr(strat, user_vars)
+            return value
+        return shared, False
+    return (lambda strat, user_vars: item), True
+
+
+def _compile_binop(bin_op):
+    ''' Return a function of (strat, user_vars) that evaluates bin_op. Both
+    sides are always evaluated, even for "and" and "or". '''
+    op = _BINOPS[bin_op.op]
+    left, left_const = _compile_operand(bin_op.left)
+    right, right_const = _compile_operand(bin_op.right)
+    if left_const and right_const:
+        lc, rc = left(None, None), right(None, None)
+        return lambda strat, user_vars: op(lc, rc)
+    if left_const:
+        lc = left(None, None)
+        return lambda strat, user_vars: op(lc, right(strat, user_vars))
+    if right_const:
+        rc = right(None, None)
+        return lambda strat, user_vars: op(left(strat, user_vars), rc)
+    return lambda strat, user_vars: op(
+        left(strat, user_vars), right(strat, user_vars))
+
+
+def _compile_block(items):
+    ''' Return a function of (strat, user_vars) that runs the given
+    statements in order, or None if they do nothing '''
+    fns = [fn for fn in map(_compile_stmt, items) if fn is not None]
+    if not fns:
+        return None
+    if len(fns) == 1:
+        return fns[0]
+
+    def block(strat, user_vars):
+        for fn in fns:
+            fn(strat, user_vars)
+    return block
+
+
+def _compile_stmt(item):
+    ''' Return a function of (strat, user_vars) that runs one statement, or
+    None if it does nothing '''
+    if isinstance(item, MakeBetOp):
+        bet = item.bet
+
+        # The program holds one bet object per statement. Put a copy on the
+        # table, as the same statement can make a bet again while the last
+        # one is still up.
+        def make_bet(strat, user_vars):
+            strat.add_bet(copy(bet))
+        return make_bet
+    if isinstance(item, CondOp):
+        true_case = _compile_block((item.true_case,))
+        false_case = _compile_block((item.false_case,))
+        if _is_literal(item.cond):
+            return true_case if item.cond else false_case
+        cond, _ = _compile_operand(item.cond)
+        if false_case is None and true_case is None:
+            return cond
+        if false_case is None:
+            def if_(strat, user_vars):
+                if cond(strat, user_vars):
+                    true_case(strat, user_vars)
+            return if_
+        if true_case is None:
+            def if_not(strat, user_vars):
+                if not cond(strat, user_vars):
+                    false_case(strat, user_vars)
+            return if_not
+
+        def if_else(strat, user_vars):
+            if cond(strat, user_vars):
+                true_case(strat, user_vars)
+            else:
+                false_case(strat, user_vars)
+        return if_else
+    if isinstance(item, AssignOp):
+        var = item.var
+        if not isinstance(item.expr, (BinOp, SharedOp)):
+            # Anything else is stored as is, without evaluating it
+            value = item.expr
+
+            def assign_const(strat, user_vars):
+                user_vars[var] = value
+            return assign_const
+        expr, _ = _compile_operand(item.expr)
+
+        def assign(strat, user_vars):
+            user_vars[var] = expr(strat, user_vars)
+        return assign
+    if isinstance(item, tuple):
+        return _compile_block(item)
+    if isinstance(item, (int, float)) or item is None:
+        return None
+    if isinstance(item, UserVar):
+        id_ = item.id
+
+        def show(strat, user_vars):
+            print(id_, 'is', user_vars[id_])
+        return show
+
+    def unhandled(strat, user_vars):
+        print('WARN IGNORING :::', type(item), item)
+        raise NotImplementedError(
+            'Did not handle item type %s' % type(item).__name__)
+    return unhandled
+
+
+def compile_program(logic):
+    ''' Turn the given parsed program into a function that takes a Strategy
+    and makes its bets. The tree is walked once, here, and turned into
+    nested closures, so running the program is just a series of calls.
+    Statements that do nothing are left out and conditions on literals are
+    decided now. Every run starts with no user variables. '''
+    body = _compile_block(list(logic))
+
+    def program(strat):
+        if body is not None:
+            body(strat, {})
+    return program
+
+
+def _is_literal(item):
+    return item is None or isinstance(item, (int, float))
+
+
+def _block_items(block):
+    ''' Return the statements in the block of a CondOp as a list '''
+    return [] if block is None else list(_flatten(block))
+
+
+def _as_block(items):
+    ''' The opposite of _block_items '''
+    if not items:
+        return None
+    block = items[-1]
+    for item in reversed(items[:-1]):
+        block = (item, block)
+    return block
+
+
+def _fold(expr):
+    ''' Return expr with every BinOp that only has literals on both sides
+    replaced by its value '''
+    if not isinstance(expr, BinOp):
+        return expr
+    left, right = _fold(expr.left), _fold(expr.right)
+    if _is_literal(left) and _is_literal(right):
+        try:
+            return _BINOPS[expr.op](left, right)
+        except Exception:
+            # Such as dividing by 0. Leave it to fail if the program ever
+            # gets to it, as it would have.
+            pass
+    return BinOp(str(expr.op), left, right)
+
+
+def _fold_stmts(items):
+    ''' Return the given statements with constants folded, the branches of
+    conditions on literals that can't be taken removed, and statements that
+    do nothing left out '''
+    out = []
+    for item in items:
+        if isinstance(item, CondOp):
+            cond = _fold(item.cond)
+            true_case = _fold_stmts(_block_items(item.true_case))
+            false_case = _fold_stmts(_block_items(item.false_case))
+            if _is_literal(cond):
+                out.extend(true_case if cond else false_case)
+            else:
+                out.append(CondOp(
+                    cond, _as_block(true_case), _as_block(false_case)))
+        elif isinstance(item, AssignOp):
+            out.append(AssignOp(item.var, _fold(item.expr)))
+        elif not _is_literal(item):
+            out.append(item)
+    return out
+
+
+def _invariant(expr):
+    ''' Return whether expr has the same value for the whole of one run of a
+    program. Making bets changes the bankroll and assignments change user
+    variables, but nothing else a program can read changes while it runs. '''
+    if isinstance(expr, BinOp):
+        return _invariant(expr.left) and _invariant(expr.right)
+    if isinstance(expr, VarId):
+        return expr in _VAR_GETTERS and expr != VarId.Bankroll
+    if isinstance(expr, (TailOp, LenOp)):
+        return expr.list_id == ListId.Rolls
+    return _is_literal(expr)
+
+
+def _shareable(expr):
+    ''' Return whether expr is worth evaluating only once per run if it
+    appears more than once. Getting a variable or the last roll costs about
+    as much as looking up a shared value. '''
+    return (
+        isinstance(expr, BinOp) or
+        isinstance(expr, TailOp) and expr.num > 1) and _invariant(expr)
+
+
+def _evaluated_exprs(items):
+    ''' Yield the expressions the given statements evaluate with
+    _compile_operand '''
+    for item in walk(items):
+        if isinstance(item, CondOp) and not _is_literal(item.cond):
+            yield item.cond
+        elif isinstance(item, AssignOp) and isinstance(item.expr, BinOp):
+            yield item.expr
+
+
+def _share(expr, counts, shared):
+    ''' Return expr with every subexpression that appears more than once
+    according to counts replaced by a SharedOp. shared maps each such
+    subexpression to its SharedOp, so it is the same one everywhere. '''
+    key = str(expr)
+    if counts[key] > 1:
+        if key not in shared:
+            # Share its own subexpressions first, so they get the lower
+            # slots
+            expr = _share_children(expr, counts, shared)
+            shared[key] = SharedOp(len(shared), expr)
+        return shared[key]
+    return _share_children(expr, counts, shared)
+
+
+def _share_children(expr, counts, shared):
+    if isinstance(expr, BinOp):
+        return BinOp(
+            str(expr.op), _share(expr.left, counts, shared),
+            _share(expr.right, counts, shared))
+    return expr
+
+
+def _share_stmts(items, counts, shared):
+    ''' Return the given statements with their repeated subexpressions
+    shared, see _share '''
+    out = []
+    for item in items:
+        if isinstance(item, CondOp):
+            item = CondOp(
+                _share(item.cond, counts, shared),
+                _as_block(_share_stmts(
+                    _block_items(item.true_case), counts, shared)),
+                _as_block(_share_stmts(
+                    _block_items(item.false_case), counts, shared)))
+        elif isinstance(item, AssignOp) and isinstance(item.expr, BinOp):
+            item = AssignOp(item.var, _share(item.expr, counts, shared))
+        out.append(item)
+    return out
+
+
+def optimize(logic):
+    ''' Return a parsed program that does the same as the given one with
+    less work on each run:
+
+    - Arithmetic and comparisons on literals are done now, and conditions
+      that turn out to be literals are replaced by the branch they take
+    - Statements that do nothing, like a literal on its own, are left out
+    - An expression that appears more than once and can't change while the
+      program runs, like "last 3 rolls" or "current point == 6", becomes a
+      SharedOp and is only evaluated the first time a run needs it
+
+    Anything that would fail when the program runs still fails, and only if
+    the program gets to it. Both sides of a BinOp are always evaluated, so
+    "and" and "or" aren't cut short. '''
+    items = _fold_stmts(list(logic))
+    counts = Counter()
+    for expr in _evaluated_exprs(items):
+        for sub in _walk(expr):
+            if _shareable(sub):
+                counts[str(sub)] += 1
+    return _share_stmts(items, counts, {})
+
+
+def _format_stmts(items, depth, lines):
+    pad = '    ' * depth
+    if not items:
+        lines.append(pad + 'nothing')
+    for item in items:
+        if isinstance(item, CondOp):
+            lines.append('%sif %s then' % (pad, item.cond))
+            _format_stmts(_block_items(item.true_case), depth + 1, lines)
+            if item.false_case is not None:
+                lines.append(pad + 'else')
+                _format_stmts(
+                    _block_items(item.false_case), depth + 1, lines)
+        else:
+            lines.append(pad + str(item))
+
+
+def format_program(logic):
+    ''' Return the given parsed program as text, one statement per line
+    with the statements in a branch indented under its condition '''
+    lines = []
+    _format_stmts(list(logic), 0, lines)
+    return '\n'.join(lines) + '\n'
+
+
+class Program:
+    ''' A parsed program, optimized (see optimize) and compiled, ready to
+    make a Strategy's bets when called with it. analysis is an Analysis of
+    the optimized program.
+
+    Pickles as just the parse tree and is compiled again when unpickled, so
+    it can be parsed once and sent to other processes. '''
+    def __init__(self, logic):
+        self.logic = optimize(logic)
+        self.analysis = analyze(self.logic)
+        self._run = compile_program(self.logic)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_run']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._run = compile_program(self.logic)
+
+    def __call__(self, strat):
+        self._run(strat)
+
+
 def parse_stream(stream_fd, max_complexity=None):
+    # The lexer and parser are only made the first time a program is parsed,
+    # so commands that never parse one don't pay for them
+    from .stratgrammar import _Lexer, _Parser
     p = _Parser(max_complexity=max_complexity)
     yield from _flatten(p.parse(_Lexer().tokenize(stream_fd.read())))
     # print('The complexity is', p.complexity)
@@ -559,6 +809,7 @@ def parse(s, max_complexity=None):
 
 
 def _test_parse_complexity(s, max_complexity=None):
+    from .stratgrammar import _Lexer, _Parser
     p = _Parser(max_complexity=max_complexity)
     for _ in _flatten(p.parse(_Lexer().tokenize(io.StringIO(s).read()))):
         pass
@@ -0,0 +1,323 @@
+''' The built-in strategies from cdc.lib.strategy, played on many independent
+tables at once.
+
+Each VectorStrategy keeps the state of all its tables in numpy arrays and
+advances every table by one roll per step, so the per-roll cost of Python is
+shared by all the tables. Given the same rolls, every table ends up with the
+same bankroll as the corresponding Strategy would (up to floating point
+rounding, as sums may be added up in a different order).
+
+Only the state the built-in strategies actually use is tracked: which bets
+are up and how much is on them, the point, and the bankroll. No events are
+made and no roll history is kept.
+'''
+from .strategy import BasicPassStrategy, BasicComeStrategy,\
+    BasicPlaceStrategy, MartingaleFieldStrategy, ThreePointMolly,\
+    CBPlace, CBOdds, CBField
+from ..util.rand import PAIRS
+
+import numpy as np
+
+# The point numbers, in the order of the columns of per-number arrays
+NUMBERS = (4, 5, 6, 8, 9, 10)
+_VALUE = np.array([d1 + d2 for d1, d2 in PAIRS], dtype=np.int8)
+# For each roll value, a row with True in the column of that number, if it is
+# one. Indexing it with an array of values gives a (tables, numbers) mask of
+# the bets a roll hits.
+_HITS = np.zeros((13, len(NUMBERS)), dtype=bool)
+_HITS[list(NUMBERS), range(len(NUMBERS))] = True
+_IS_NUMBER = _HITS.any(axis=1)
+_FIELD_WIN = np.zeros(13, dtype=bool)
+_FIELD_WIN[list(CBField.roll_win)] = True
+_COME_OUT_WIN = np.zeros(13, dtype=bool)
+_COME_OUT_WIN[[7, 11]] = True
+_COME_OUT_LOSE = np.zeros(13, dtype=bool)
+_COME_OUT_LOSE[[2, 3, 12]] = True
+
+
+def _payout(bet):
+    ''' What comes back to the bankroll when the given bet wins on its
+    number, calculated by the bet itself so it is exactly the same '''
+    return bet.amount + bet.win_amount()
+
+
+def _place_amount(n, base_bet):
+    ''' How much BasicPlaceStrategy bets on n '''
+    return base_bet if n not in {6, 8} else base_bet * 1.2
+
+
+class VectorStrategy:
+    ''' Subclasses implement make_bets() and _settle(values, hits), which
+    pays winners and removes losers given the value of each table's roll and
+    its row of _HITS. The point is moved afterwards. '''
+    def __init__(self, num_tables, bankroll=0):
+        self._n = num_tables
+        self.bankroll = np.full(num_tables, bankroll, dtype=np.float64)
+        # 0 means there is no point
+        self.point = np.zeros(num_tables, dtype=np.int8)
+
+    def __len__(self):
+        return self._n
+
+    def make_bets(self):
+        raise NotImplementedError
+
+    def _settle(self, values, hits):
+        raise NotImplementedError
+
+    def resolve_roll(self, pairs):
+        ''' Settle the bets on every table, given an array of the pair index
+        each table rolled, and move the points '''
+        values = _VALUE[pairs]
+        self._settle(values, _HITS[values])
+        on = self.point != 0
+        made_or_out = on & ((values == 7) | (values == self.point))
+        established = ~on & _IS_NUMBER[values]
+        self.point[made_or_out] = 0
+        self.point[established] = values[established]
+
+    def play(self, pairs):
+        ''' Play an array of shape (tables, rolls) of pair indexes, with row i
+        going to table i. Returns an array of the same shape with the
+        bankroll of every table after every roll. '''
+        assert pairs.shape[0] == self._n
+        out = np.empty(pairs.shape, dtype=np.float64)
+        for i in range(pairs.shape[1]):
+            self.make_bets()
+            self.resolve_roll(pairs[:, i])
+            out[:, i] = self.bankroll
+        return out
+
+
+class VectorPass(VectorStrategy):
+    object_class = BasicPassStrategy
+
+    def __init__(self, num_tables, base_bet, *a, **kw):
+        super().__init__(num_tables, *a, **kw)
+        self._base_bet = base_bet
+        self._pass = np.zeros(num_tables, dtype=bool)
+
+    def make_bets(self):
+        m = (self.point == 0) & ~self._pass
+        self.bankroll -= m * self._base_bet
+        self._pass |= m
+
+    def _settle_pass(self, values):
+        come_out = self.point == 0
+        win = self._pass & np.where(
+            come_out, _COME_OUT_WIN[values], values == self.point)
+        lose = self._pass & np.where(
+            come_out, _COME_OUT_LOSE[values], values == 7)
+        self.bankroll += win * (self._base_bet + self._base_bet)
+        self._pass &= ~(win | lose)
+
+    def _settle(self, values, hits):
+        self._settle_pass(values)
+
+
+class _ComeMixin:
+    ''' Come bets that all have the same amount. At most one come bet can be
+    on each number, as an old one always wins on the roll that moves a new
+    one there. '''
+    def _init_comes(self):
+        self._come = np.zeros(self._n, dtype=bool)
+        self._come_on = np.zeros((self._n, len(NUMBERS)), dtype=bool)
+
+    def _settle_comes(self, values, hits):
+        payout = self._base_bet + self._base_bet
+        self.bankroll += (self._come_on & hits).any(axis=1) * payout
+        self._come_on &= ~(hits | (values == 7)[:, None])
+        self.bankroll += (self._come & _COME_OUT_WIN[values]) * payout
+        self._come_on |= self._come[:, None] & hits
+        self._come[:] = False
+
+
+class VectorCome(_ComeMixin, VectorStrategy):
+    object_class = BasicComeStrategy
+
+    def __init__(self, num_tables, base_bet, max_comes, *a, **kw):
+        super().__init__(num_tables, *a, **kw)
+        assert max_comes >= 1 and max_comes <= 6
+        self._base_bet = base_bet
+        self._max = max_comes
+        self._init_comes()
+
+    def make_bets(self):
+        num_bets = self._come + self._come_on.sum(axis=1)
+        m = (self.point != 0) & (num_bets <= self._max)
+        self.bankroll -= m * self._base_bet
+        self._come |= m
+
+    def _settle(self, values, hits):
+        self._settle_comes(values, hits)
+
+
+class VectorPlace(VectorStrategy):
+    object_class = BasicPlaceStrategy
+
+    def __init__(self, num_tables, base_bet, which_nums, *a, **kw):
+        super().__init__(num_tables, *a, **kw)
+        self._nums = [
+            (NUMBERS.index(n), _place_amount(n, base_bet))
+            for n in which_nums]
+        self._payout = np.array([
+            _payout(CBPlace(n, _place_amount(n, base_bet)))
+            for n in NUMBERS])
+        self._placed = np.zeros((num_tables, len(NUMBERS)), dtype=bool)
+
+    def make_bets(self):
+        # Bets are off without a point, which is the same as only settling
+        # them when there is one
+        on = self.point != 0
+        for col, amount in self._nums:
+            m = on & ~self._placed[:, col]
+            self.bankroll -= m * amount
+            self._placed[:, col] |= m
+
+    def _settle(self, values, hits):
+        on = self.point != 0
+        won = on[:, None] & self._placed & hits
+        self.bankroll += (won * self._payout).sum(axis=1)
+        self._placed &= ~(won | (on & (values == 7))[:, None])
+
+
+class VectorMartingaleField(VectorStrategy):
+    object_class = MartingaleFieldStrategy
+
+    def __init__(self, num_tables, base_bet, *a, **kw):
+        super().__init__(num_tables, *a, **kw)
+        self._base_bet = base_bet
+        self._amount = np.zeros(num_tables, dtype=np.float64)
+
+    def make_bets(self):
+        # After every loss, the amount doubles. After every win, it goes back
+        # to the base bet. Either way the previous bet is gone by now.
+        self._amount = np.where(
+            self._amount == 0, self._base_bet, self._amount)
+        self.bankroll -= self._amount
+
+    def _settle(self, values, hits):
+        win = _FIELD_WIN[values]
+        double = (values == 2) | (values == 12)
+        a = self._amount
+        # The same sums as CBField, which pays 2x on 2 and 12
+        self.bankroll += np.where(win, a + np.where(double, a * 2, a), 0)
+        self._amount = np.where(win, 0, a * 2)
+
+
+class VectorThreePointMolly(_ComeMixin, VectorPass):
+    object_class = ThreePointMolly
+
+    def __init__(self, num_tables, base_bet, odds, *a, num_comes=2, **kw):
+        super().__init__(num_tables, base_bet, *a, **kw)
+        self._num_comes = num_comes
+        self._init_comes()
+        # How much odds to take for each point, and the ratio each number's
+        # odds pay
+        mult = {4: odds[0], 10: odds[0], 5: odds[1], 9: odds[1]}
+        self._odds_amount = np.zeros(13, dtype=np.float64)
+        for n in NUMBERS:
+            self._odds_amount[n] = base_bet * mult.get(n, odds[2])
+        self._ratio = np.array(
+            [CBOdds(n, False, 1).win_amount() for n in NUMBERS])
+        # Odds can pile up on a number (e.g. the pass odds and odds left
+        # over from a come bet that won on the come out roll). They always
+        # win, lose, or push together, so only their totals are kept.
+        shape = (num_tables, len(NUMBERS))
+        self._odds = np.zeros(shape, dtype=np.int64)
+        self._odds_total = np.zeros(shape)
+        self._odds_payout = np.zeros(shape)
+
+    def make_bets(self):
+        come_out = self.point == 0
+        m = come_out & ~self._pass
+        self.bankroll -= m * self._base_bet
+        self._pass |= m
+        # The rest is only done while there is a point. Odds are off without
+        # one, which is the same as only settling them when there is one.
+        on = (~come_out)[:, None]
+        had_odds = self._odds > 0
+        # Pass odds, then come odds, which are sized for the table's point
+        # like in ThreePointMolly
+        new = (on & _HITS[self.point] & ~had_odds).astype(np.int64)
+        new += on & self._come_on & ~had_odds
+        amount = new * self._odds_amount[self.point][:, None]
+        self.bankroll -= amount.sum(axis=1)
+        self._odds += new
+        self._odds_total += amount
+        self._odds_payout += amount + amount * self._ratio
+        m = ~come_out & (self._come_on.sum(axis=1) < self._num_comes)
+        self.bankroll -= m * self._base_bet
+        self._come |= m
+
+    def _settle(self, values, hits):
+        on = self.point != 0
+        seven = values == 7
+        # Odds are off on the come out roll and push on a 7
+        self.bankroll += (~on & seven) * self._odds_total.sum(axis=1)
+        self._settle_pass(values)
+        self._settle_comes(values, hits)
+        won = on[:, None] & hits
+        self.bankroll += (won * self._odds_payout).sum(axis=1)
+        keep = ~(won | seven[:, None])
+        self._odds *= keep
+        self._odds_total *= keep
+        self._odds_payout *= keep
+
+
+# name: (vector class, help for its arguments)
+BUILTIN_STRATEGIES = {
+    'pass': (VectorPass, 'BASE_BET'),
+    'come': (VectorCome, 'BASE_BET,MAX_COMES'),
+    'place': (VectorPlace, 'BASE_BET,NUMBER[,NUMBER...]'),
+    'martingale-field': (VectorMartingaleField, 'BASE_BET'),
+    'molly': (VectorThreePointMolly, 'BASE_BET,ODDS_4_10,ODDS_5_9,ODDS_6_8'
+              '[,NUM_COMES]'),
+}
+
+
+class BuiltinStrategy:
+    ''' One of the built-in strategies with its arguments, parsed from a
+    string like "molly:5,3,4,5" (see BUILTIN_STRATEGIES). Can make both the
+    Strategy and the VectorStrategy version of it. '''
+    def __init__(self, spec):
+        name, _, args = spec.partition(':')
+        if name not in BUILTIN_STRATEGIES:
+            raise ValueError('Unknown strategy %s. Must be one of %s' % (
+                name, ', '.join(sorted(BUILTIN_STRATEGIES))))
+        nums = []
+        for arg in args.split(',') if args else []:
+            nums.append(float(arg) if '.' in arg else int(arg))
+        self.name = name
+        try:
+            self._args, self._kw = self._parse_args(name, nums)
+        except TypeError:
+            raise ValueError('%s takes %s' % (
+                name, BUILTIN_STRATEGIES[name][1]))
+        if name == 'place' and not set(self._args[1]) <= set(NUMBERS):
+            raise ValueError('Can only place %s' % (NUMBERS,))
+
+    @staticmethod
+    def _parse_args(name, nums):
+        ''' Return the args and kwargs for the strategy classes '''
+        return {
+            'pass': lambda base: ((base,), {}),
+            'come': lambda base, max_comes: ((base, max_comes), {}),
+            'place': lambda base, *nums: ((base, nums), {}),
+            'martingale-field': lambda base: ((base,), {}),
+            'molly': lambda base, o1, o2, o3, num_comes=2: (
+                (base, (o1, o2, o3)), {'num_comes': num_comes}),
+        }[name](*nums)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def vector_class(self):
+        return BUILTIN_STRATEGIES[self.name][0]
+
+    def make_strategy(self):
+        return self.vector_class.object_class(*self._args, **self._kw)
+
+    def make_vector(self, num_tables):
+        return self.vector_class(num_tables, *self._args, **self._kw)
@@ -1,27 +1,169 @@
-import bisect
-import itertools
+from functools import lru_cache
 import logging
 import random
 
+import numpy as np
+
 log = logging.getLogger(__name__)
+_np_rng = np.random.default_rng()
+_entropy = np.random.SeedSequence().entropy
+# The number of rolls in each independently addressable block of a RollStream
+ROLL_BLOCK_SIZE = 4096
 
 
 def init(seed):
+    global _np_rng, _entropy
     random.seed(seed)
+    _np_rng = np.random.default_rng(seed)
+    # When not given a seed, SeedSequence pulls fresh entropy from the OS.
+    # Either way, remember it so independent streams can be derived from it.
+    _entropy = np.random.SeedSequence(seed).entropy
+
+
+def seed_entropy():
+    ''' Return the entropy everything was seeded with. If init() was given a
+    seed, this is that seed. Otherwise it can be given to init() later to
+    reproduce the same streams. '''
+    return _entropy
+
+
+class RollStream:
+    ''' A stream of uniform random numbers in [0, 1) for one repeat of a
+    simulation, from which any roll can be regenerated without generating the
+    rolls before it.
+
+    It uses the counter-based Philox generator. The key is derived from the
+    seed entropy and the repeat index, and the rolls are split into blocks of
+    ROLL_BLOCK_SIZE rolls, each of which starts at its own counter value. To
+    jump to a roll, only the start of its block needs to be generated.
+
+    The stream for a repeat depends only on entropy, the repeat index, and
+    uniforms_per_roll, so the same repeat produces the same rolls no matter
+    which process generates it or in which order. Streams for different
+    repeats are independent.
+
+    If antithetic is True, every number u in the stream is replaced with
+    1 - u, which is in (0, 1]. Samplers in this module accept 1.0. A stream
+    and its antithetic twin drive a pair of runs for variance reduction. Roll
+    them with AntitheticDice to make the runs negatively correlated.
+
+    Has the same random() method as a numpy Generator, so it can be used in
+    place of one. '''
+    def __init__(
+            self, entropy, repeat, uniforms_per_roll=1, start_roll=0,
+            antithetic=False):
+        assert repeat >= 0
+        assert start_roll >= 0
+        self._key = np.random.SeedSequence(
+            entropy, spawn_key=(repeat,)).generate_state(2, dtype=np.uint64)
+        self._block_len = ROLL_BLOCK_SIZE * uniforms_per_roll
+        self._antithetic = antithetic
+        block, offset = divmod(start_roll, ROLL_BLOCK_SIZE)
+        self._next_block = block + 1
+        self._buf = self._block(block)[offset * uniforms_per_roll:]
+
+    def _block(self, block):
+        bit_gen = np.random.Philox(key=self._key, counter=[0, block, 0, 0])
+        u = np.random.Generator(bit_gen).random(self._block_len)
+        if self._antithetic:
+            np.subtract(1.0, u, out=u)
+        return u
+
+    def random(self, size):
+        ''' Return the next size uniform numbers in the stream '''
+        out = []
+        while size > len(self._buf):
+            out.append(self._buf)
+            size -= len(self._buf)
+            self._buf = self._block(self._next_block)
+            self._next_block += 1
+        out.append(self._buf[:size])
+        self._buf = self._buf[size:]
+        return np.concatenate(out) if len(out) > 1 else out[0]
+
+
+class AliasSampler:
+    ''' Draw indexes into a list of weights in O(1) time per draw using
+    Vose's alias method.
+
+    The tables are built once. Each draw costs a single uniform random number
+    in [0, 1), which picks a column and then whether to take the column or its
+    alias. Only plain lists and numpy arrays are stored, so samplers pickle
+    cheaply and can be handed to worker processes.
 
+    http://www.keithschwarz.com/darts-dice-coins/
+    '''
+    def __init__(self, weights):
+        n = len(weights)
+        assert n > 0
+        total = sum(weights)
+        assert total > 0
+        assert min(weights) >= 0
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l_ = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l_
+            scaled[l_] = scaled[l_] + scaled[s] - 1
+            if scaled[l_] < 1:
+                small.append(l_)
+            else:
+                large.append(l_)
+        # Whatever is left is 1 give or take some floating point error. Make
+        # sure that error can never select something with no weight.
+        for i in small:
+            if not weights[i]:
+                prob[i] = 0.0
+                alias[i] = max(range(n), key=lambda j: weights[j])
+        # A uniform number times n can round up to (or, in an antithetic
+        # stream, be) exactly n. Add a sentinel column that behaves like the
+        # very top of the last column.
+        prob.append(0.0)
+        alias.append(n - 1 if prob[n - 1] >= 1 else alias[n - 1])
+        self._n = n
+        self._prob = prob
+        self._alias = alias
+        self._prob_arr = np.array(prob, dtype=np.float64)
+        self._alias_arr = np.array(alias, dtype=np.intp)
 
-def _weighted_select(outcomes, weights):
-    # https://docs.python.org/3.5/library/random.html#examples-and-recipes
-    assert len(weights) == len(outcomes)
-    cumdist = list(itertools.accumulate(weights))
-    idx = random.random() * cumdist[-1]
-    return outcomes[bisect.bisect(cumdist, idx)]
+    def __len__(self):
+        return self._n
+
+    def draw(self, uniform=random.random):
+        ''' Return a single index, drawn using the given source of uniform
+        numbers in [0, 1]. (1.0 is allowed so antithetic streams work) '''
+        x = uniform() * self._n
+        i = int(x)
+        return i if x - i < self._prob[i] else self._alias[i]
+
+    def from_uniforms(self, u):
+        ''' Map a numpy array of uniform numbers in [0, 1] to an array of
+        indexes of the same shape '''
+        x = u * self._n
+        i = x.astype(np.intp)
+        x -= i
+        return np.where(x < self._prob_arr[i], i, self._alias_arr[i])
+
+    def draw_many(self, n, rng=None):
+        ''' Return an array of n indexes. rng is a numpy Generator to draw
+        from. If not given, use the module's generator (seeded by init()) '''
+        if rng is None:
+            rng = _np_rng
+        return self.from_uniforms(rng.random(n))
+
+
+@lru_cache(maxsize=32)
+def _cached_sampler(weights):
+    return AliasSampler(weights)
 
 
 def roll_die_with_weights(weights):
     assert len(weights) == 6
-    sides = [1, 2, 3, 4, 5, 6]
-    return _weighted_select(sides, weights)
+    return _cached_sampler(tuple(weights)).draw() + 1
 
 
 def roll_fair_die():
@@ -30,9 +172,149 @@ def roll_fair_die():
 
 def roll_dice_with_weights(weights):
     assert len(weights) == 11
-    outcomes = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-    return _weighted_select(outcomes, weights)
+    return _cached_sampler(tuple(weights)).draw() + 2
 
 
 def roll_fair_dice():
     return roll_dice_with_weights([1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1])
+
+
+def multinomial(n, weights, rng=None):
+    ''' Return how many times each outcome came up in n independent draws
+    from the given weights, as a list of ints. Costs the same regardless of n.
+
+    rng is a numpy Generator to draw from. If not given, use the module's
+    generator (seeded by init()). '''
+    if rng is None:
+        rng = _np_rng
+    p = np.asarray(weights, dtype=np.float64)
+    assert len(p) and p.min() >= 0 and p.sum() > 0
+    return rng.multinomial(n, p / p.sum()).tolist()
+
+
+def roll_dice_batch(die, n, rng=None):
+    ''' Roll a pair of dice n times, where each die independently lands on
+    each side according to die. die is either an AliasSampler over the 6
+    sides or a list of 6 weights. Returns an array of shape (n, 2) and dtype
+    uint8 with the die values in [1, 6].
+
+    rng is a numpy Generator to draw from. If not given, use the module's
+    generator (seeded by init()). '''
+    if not isinstance(die, AliasSampler):
+        die = _cached_sampler(tuple(die))
+    assert len(die) == 6
+    dice = die.draw_many(2 * n, rng=rng).astype(np.uint8)
+    dice += 1
+    return dice.reshape(n, 2)
+
+
+# Every ordered pair of die values, indexed by "pair index". Rolling (d1, d2)
+# has pair index (d1 - 1) * 6 + (d2 - 1)
+PAIRS = [(d1, d2) for d1 in range(1, 6+1) for d2 in range(1, 6+1)]
+PAIR_DICE = np.array(PAIRS, dtype=np.uint8)
+
+
+def pair_index(d1, d2):
+    return (d1 - 1) * 6 + (d2 - 1)
+
+
+class DiceModel:
+    ''' Turns uniform random numbers into rolls of a pair of dice. Subclasses
+    say how many uniforms they need per roll and implement pairs_from_uniforms
+    '''
+    uniforms_per_roll = None
+
+    def pairs_from_uniforms(self, u):
+        ''' Map a numpy array of len(u) / uniforms_per_roll rolls worth of
+        uniform numbers to an array of pair indexes '''
+        raise NotImplementedError
+
+    def roll_pairs(self, n, rng=None):
+        ''' Roll the dice n times and return an array of n pair indexes '''
+        if rng is None:
+            rng = _np_rng
+        return self.pairs_from_uniforms(rng.random(n * self.uniforms_per_roll))
+
+    def roll(self, n, rng=None):
+        ''' Roll the dice n times and return an (n, 2) array of die values '''
+        return PAIR_DICE[self.roll_pairs(n, rng=rng)]
+
+    def pair_probabilities(self):
+        ''' Return an array of the probability of rolling each pair index '''
+        raise NotImplementedError
+
+
+class IndependentDice(DiceModel):
+    ''' Each die lands independently of the other, according to the same six
+    weights '''
+    uniforms_per_roll = 2
+
+    def __init__(self, die_weights):
+        assert len(die_weights) == 6
+        self.weights = list(die_weights)
+        self._die = AliasSampler(die_weights)
+
+    def pairs_from_uniforms(self, u):
+        sides = self._die.from_uniforms(u).reshape(-1, 2)
+        return (sides[:, 0] * 6 + sides[:, 1]).astype(np.uint8)
+
+    def pair_probabilities(self):
+        p = np.asarray(self.weights, dtype=np.float64)
+        p /= p.sum()
+        return np.outer(p, p).ravel()
+
+
+class JointDice(DiceModel):
+    ''' The pair of dice lands on each of the 36 ordered pairs according to
+    its own weight, so any correlation between the two dice is kept '''
+    uniforms_per_roll = 1
+
+    def __init__(self, pair_weights):
+        assert len(pair_weights) == 36
+        self.weights = list(pair_weights)
+        self._pair = AliasSampler(pair_weights)
+
+    def pairs_from_uniforms(self, u):
+        return self._pair.from_uniforms(u).astype(np.uint8)
+
+    def pair_probabilities(self):
+        p = np.asarray(self.weights, dtype=np.float64)
+        return p / p.sum()
+
+
+# Pair indexes from the roll that loses the most bets to the rolls that win
+# the most: 7, then the craps and other one-roll numbers, then the points
+# with 6 and 8 last
+ANTITHETIC_ORDER = [
+    pair_index(d1, d2)
+    for s in (7, 2, 3, 12, 11, 4, 10, 5, 9, 6, 8)
+    for d1, d2 in PAIRS if d1 + d2 == s]
+
+
+class AntitheticDice(DiceModel):
+    ''' Rolls the same as the given DiceModel, but by looking up one uniform
+    number per roll in the cumulative probabilities of the pairs in
+    ANTITHETIC_ORDER.
+
+    Complementing u in an antithetic stream then gives a roll from the other
+    end of that order, so a 7 in one run of a pair is a 6 or an 8 in the
+    other. Complementing the uniforms of the wrapped model instead would only
+    turn each die d into 7 - d, which keeps every 7 a 7. '''
+    uniforms_per_roll = 1
+
+    def __init__(self, dice):
+        self.dice = dice
+        self._order = np.array(ANTITHETIC_ORDER, dtype=np.uint8)
+        p = dice.pair_probabilities()[self._order]
+        self._cdf = np.cumsum(p)
+        self._cdf /= self._cdf[-1]
+        # u is in [0, 1], and 1.0 must land on the last pair that can happen
+        self._last = np.flatnonzero(p)[-1]
+
+    def pairs_from_uniforms(self, u):
+        i = np.searchsorted(self._cdf, u, side='right')
+        np.minimum(i, self._last, out=i)
+        return self._order[i]
+
+    def pair_probabilities(self):
+        return self.dice.pair_probabilities()
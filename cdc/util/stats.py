@@ -1,12 +1,26 @@
 from . import rand
 from .. import globals as G
 
+import math
 
-def simulate_roll_distribution(num_rolls, dist=None):
+
+def simulate_roll_distribution(num_rolls, dist=None, method='multinomial'):
+    ''' Roll the dice num_rolls times using the given distribution of 2
+    through 12 and return how many times each value came up.
+
+    The default method draws all the counts at once from a multinomial
+    distribution, so it takes the same amount of time no matter how many
+    rolls. The 'loop' method actually rolls the dice num_rolls times and is
+    kept as a reference. '''
     if dist is None:
         dist = G.FAIR_DIST
     assert len(dist) == 11
+    assert method in {'multinomial', 'loop'}
     counts = {}
+    if method == 'multinomial':
+        for i, c in enumerate(rand.multinomial(num_rolls, dist)):
+            counts[i+2] = c
+        return counts
     for i in range(2, 12+1):
         counts[i] = 0
     for _ in range(num_rolls):
@@ -21,3 +35,65 @@ def theoretical_fair_distribution(num_rolls):
     for i, c in enumerate(G.FAIR_DIST):
         counts[i+2] = c*num_rolls/s
     return counts
+
+
+def antithetic_effective_sample_size(pairs):
+    ''' Given a list of (a, b) tuples of results from antithetic pairs of
+    runs, return the number of independent runs that would estimate the mean
+    as precisely, along with the correlation between the members of a pair.
+
+    The mean of n pairs has variance var * (1 + rho) / (2 * n), so the
+    effective sample size is 2 * n / (1 + rho). '''
+    n = len(pairs)
+    if n < 2:
+        return 2 * n, 0.0
+    mean_a = sum(a for a, _ in pairs) / n
+    mean_b = sum(b for _, b in pairs) / n
+    cov = sum((a - mean_a) * (b - mean_b) for a, b in pairs)
+    var_a = sum((a - mean_a) ** 2 for a, _ in pairs)
+    var_b = sum((b - mean_b) ** 2 for _, b in pairs)
+    if not var_a or not var_b:
+        return 2 * n, 0.0
+    rho = cov / math.sqrt(var_a * var_b)
+    # A perfect negative correlation would mean infinite precision. Don't
+    # claim more than the results can support.
+    rho = max(rho, -1 + 1 / n)
+    return 2 * n / (1 + rho), rho
+
+
+class RunningStats:
+    ''' Keep track of the mean and variance of a stream of numbers without
+    storing them, using Welford's algorithm '''
+    def __init__(self):
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self._n += 1
+        delta = x - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * (x - self._mean)
+
+    @property
+    def n(self):
+        return self._n
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        ''' The sample variance, or 0 if there aren't at least 2 numbers '''
+        if self._n < 2:
+            return 0.0
+        return self._m2 / (self._n - 1)
+
+    def ci_width(self, z=1.96):
+        ''' The width of the confidence interval of the mean, using the normal
+        approximation. The default z gives a 95% confidence interval. Infinite
+        if there aren't at least 2 numbers. '''
+        if self._n < 2:
+            return math.inf
+        return 2 * z * math.sqrt(self.variance / self._n)
@@ -21,7 +21,7 @@ def get_cdc_package_data():
     #     for f in fs:
     #         other_files.append(os.path.join(r, f))
     # return other_files
-    return ['*.ini']
+    return ['*.ini', 'lib/stratgrammar-tables.json']
 
 
 def get_data_files():
@@ -80,8 +80,11 @@ setup(
     },
     install_requires=[
         'matplotlib',
+        'numpy',
         'scipy',
-        'sly',
+        # The parser tables in cdc/lib/stratgrammar-tables.json are loaded
+        # into sly's internal classes, which can change between versions
+        'sly==0.5',
     ],
     extras_require={
         'test': ['tox', 'pytest', 'coverage'],
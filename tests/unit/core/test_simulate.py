@@ -0,0 +1,434 @@
+from cdc.core import simulate
+from cdc.util.rand import PAIRS
+
+
+def fair_stats():
+    return {
+        'dice': {i: 10 for i in range(1, 6+1)},
+        'pairs': {
+            i: {j: 1 if i == j else 2 for j in range(i, 6+1)}
+            for i in range(1, 6+1)},
+    }
+
+
+def test_calc_pair_weights_fair():
+    weights = simulate._calc_pair_weights(fair_stats())
+    assert len(weights) == 36
+    assert len(set(weights)) == 1
+
+
+def test_calc_pair_weights_order():
+    stats = fair_stats()
+    stats['pairs'][2][5] = 100
+    weights = simulate._calc_pair_weights(stats)
+    for i, (d1, d2) in enumerate(PAIRS):
+        if {d1, d2} == {2, 5}:
+            assert weights[i] == 100
+        else:
+            assert weights[i] == 2
+
+
+def test_make_dice_model():
+    stats = fair_stats()
+    dice = simulate._make_dice_model('dice', stats)
+    assert dice.uniforms_per_roll == 2
+    dice = simulate._make_dice_model('pairs', stats)
+    assert dice.uniforms_per_roll == 1
+
+
+def _final_bankrolls(results):
+    return sorted((i, res[max(res)]) for i, res in results)
+
+
+def test_bankroll_repeats_reproducible():
+    from functools import partial
+    from cdc.lib.strategy import BasicPassStrategy
+    dice = simulate._make_dice_model('dice', fair_stats())
+    make_strat = partial(BasicPassStrategy, 5)
+    one = list(simulate.bankroll_over_time_repeatedly(
+        dice, make_strat, 200, 8, entropy=7, workers=1))
+    two = list(simulate.bankroll_over_time_repeatedly(
+        dice, make_strat, 200, 8, entropy=7, workers=3))
+    assert _final_bankrolls(one) == _final_bankrolls(two)
+    # Shards of the same run produce the same results as the whole run
+    shards = list(simulate.bankroll_over_time_repeatedly(
+        dice, make_strat, 200, 3, entropy=7, workers=2)) + \
+        list(simulate.bankroll_over_time_repeatedly(
+            dice, make_strat, 200, 5, entropy=7, first_repeat=3, workers=2))
+    assert _final_bankrolls(one) == _final_bankrolls(shards)
+
+
+def test_bankroll_start_roll():
+    from functools import partial
+    from cdc.lib.strategy import BasicPassStrategy
+    dice = simulate._make_dice_model('dice', fair_stats())
+    (i, res), = simulate.bankroll_over_time_repeatedly(
+        dice, partial(BasicPassStrategy, 5), 20, 1, entropy=7,
+        first_repeat=3, workers=1, start_roll=100)
+    assert i == 3
+    assert sorted(res) == list(range(100, 120))
+
+
+def test_bankroll_roll_tape(tmp_path):
+    from argparse import Namespace
+    from functools import partial
+    from cdc.lib.strategy import BasicPassStrategy
+    stats = fair_stats()
+    fname = str(tmp_path / 'tape')
+    with open(fname, 'wt') as fd:
+        simulate.do_tape(Namespace(
+            dice_model='pairs', rolls=200, repeat=5, output=fd,
+            variance_reduction='none'), stats)
+    tape = simulate.open_roll_tape(fname)
+    assert len(tape) == 1000
+    assert tape.max() < 36
+    dice = simulate._make_dice_model('pairs', stats)
+    make_strat = partial(BasicPassStrategy, 5)
+    from_tape = list(simulate.bankroll_over_time_repeatedly(
+        dice, make_strat, 200, 3, first_repeat=2, workers=2,
+        tape_fname=fname))
+    rolled = list(simulate.bankroll_over_time_repeatedly(
+        dice, make_strat, 200, 3, first_repeat=2, workers=2))
+    assert _final_bankrolls(from_tape) == _final_bankrolls(rolled)
+
+
+def test_encode_rollseries():
+    import io
+    import numpy as np
+    from cdc.core.parse.rollseries import roll_series_stream_to_dice_pairs
+    assert simulate.encode_rollseries(np.array([], dtype=np.uint8)) == b''
+    pairs = np.arange(45, dtype=np.uint8) % 36
+    data = simulate.encode_rollseries(pairs)
+    lines = data.decode().split('\n')
+    assert lines[-1] == ''
+    assert [len(line.split()) for line in lines[:-1]] == [20, 20, 5]
+    assert lines[0].startswith('11 12 13 14 15 16 21 ')
+    parsed = roll_series_stream_to_dice_pairs(io.StringIO(data.decode()))
+    assert list(parsed) == [PAIRS[p] for p in pairs]
+
+
+def test_rollseries_segments_match_whole(monkeypatch):
+    from cdc.util import rand
+    monkeypatch.setattr(
+        simulate, 'ROLLSERIES_SEGMENT_SIZE', simulate.ROLLSERIES_LINE_LEN * 2)
+    dice = simulate._make_dice_model('dice', fair_stats())
+    n = simulate.ROLLSERIES_LINE_LEN * 7 + 3
+    whole = simulate.encode_rollseries(
+        dice.roll_pairs(n, rng=rand.RollStream(3, 1, 2, 10)))
+    segments = list(simulate._rollseries_segments(dice, 3, 1, 10, n))
+    assert len(segments) == 4
+    assert b''.join(map(simulate._rollseries_segment, segments)) == whole
+
+
+def test_antithetic_repeat_stream():
+    a = simulate.repeat_stream(1, 4, 2, variance_reduction='antithetic')
+    b = simulate.repeat_stream(1, 5, 2, variance_reduction='antithetic')
+    c = simulate.repeat_stream(1, 6, 2, variance_reduction='antithetic')
+    u_a, u_b, u_c = a.random(100), b.random(100), c.random(100)
+    assert (u_a + u_b == 1.0).all()
+    assert (u_a + u_c != 1.0).all()
+
+
+def test_bankroll_antithetic():
+    from cdc.lib.vector import BuiltinStrategy
+    from cdc.util.stats import antithetic_effective_sample_size
+    dice = simulate._make_dice_model('dice', fair_stats())
+    n = 200
+    res = dict(simulate.bankroll_over_time_repeatedly(
+        dice, BuiltinStrategy('place:6,6,8').make_strategy, 50, 2 * n,
+        entropy=7, workers=1, variance_reduction='antithetic'))
+    assert sorted(res) == list(range(2 * n))
+    finals = [res[i][49] for i in range(2 * n)]
+    ess, rho = antithetic_effective_sample_size(
+        list(zip(finals[::2], finals[1::2])))
+    assert rho < 0
+    assert ess > 2 * n
+
+
+def test_bankroll_stop():
+    import threading
+    from functools import partial
+    from cdc.lib.strategy import BasicPassStrategy
+    dice = simulate._make_dice_model('dice', fair_stats())
+    stop = threading.Event()
+    seen = []
+    for repeat, _ in simulate.bankroll_over_time_repeatedly(
+            dice, partial(BasicPassStrategy, 5), 10, 10000, workers=2,
+            stop=stop, variance_reduction='antithetic'):
+        seen.append(repeat)
+        stop.set()
+    assert len(seen) < 100
+    assert len(set(seen)) == len(seen)
+    # Antithetic pairs are never split up
+    assert all(i ^ 1 in seen for i in seen)
+
+
+def test_user_strat_roll_history_capacity():
+    strat = simulate.UserDefinedStrategy.from_string(
+        'make bet pass 5 done')
+    assert strat.rolls.capacity == 1
+    strat = simulate.UserDefinedStrategy.from_string(
+        'if last 4 rolls == 7 then make bet pass 5 done')
+    assert strat.rolls.capacity == 4
+
+
+def test_snapshot(tmp_path):
+    from argparse import Namespace
+    import io
+    import json
+    stats = fair_stats()
+    strat_text = 'make bet field 5 done'
+    out = io.StringIO()
+    simulate.do_snapshot(Namespace(
+        dice_model='dice', rolls=30, only_repeat=None, start_roll=0,
+        variance_reduction='none', output=out, builtin_strategy=None,
+        input_strategy=io.StringIO(strat_text)), stats)
+    snapshot = json.loads(out.getvalue())
+    assert snapshot['num_rolls'] == 30
+    # Playing on from the snapshot is the same as playing the rolls after it
+    dice = simulate._make_dice_model('dice', stats)
+    template = simulate.UserDefinedStrategy.from_string(strat_text)
+    template.restore(snapshot)
+    [(_, resumed)] = simulate.bankroll_over_time_repeatedly(
+        dice, template.fork, 20, 1, workers=1, start_roll=30)
+    [(_, full)] = simulate.bankroll_over_time_repeatedly(
+        dice, lambda: simulate.UserDefinedStrategy.from_string(strat_text),
+        50, 1, workers=1)
+    assert resumed == {i: full[i] for i in range(30, 50)}
+
+
+def test_snapshot_builtin_strategy_cli(tmp_path, monkeypatch):
+    import json
+    from cdc.__main__ import create_arg_parser
+    from cdc.util import rand
+    monkeypatch.chdir(tmp_path)
+    with open('stats.json', 'wt') as fd:
+        json.dump(fair_stats(), fd)
+    with open('pass.strategy', 'wt') as fd:
+        fd.write('if current point is None then make bet pass 5 done')
+    snapshots = []
+    # There is no custom.strategy, and it isn't needed
+    for strategy in (
+            ['--builtin-strategy', 'pass:5'],
+            ['--input-strategy', 'pass.strategy']):
+        rand.init(3)
+        args = create_arg_parser().parse_args([
+            'simulate', '-i', 'stats.json', '-o', 'out.json', '-f',
+            'snapshot', '--rolls', '50'] + strategy)
+        assert simulate.main(args, None) is None
+        args.output.close()
+        with open('out.json', 'rt') as fd:
+            snapshots.append(json.load(fd))
+    assert snapshots[0]['num_rolls'] == 50
+    assert snapshots[0]['bankroll'] == snapshots[1]['bankroll']
+    assert snapshots[0]['bets'] == snapshots[1]['bets']
+    rand.init(None)
+
+
+def test_snapshot_too_short(tmp_path, monkeypatch):
+    import json
+    import pytest
+    from cdc.__main__ import create_arg_parser
+    from cdc.lib.strategy import CrapsRoll as R
+    strat = simulate.UserDefinedStrategy.from_string('make bet field 5 done')
+    for roll in [R(1, 1), R(2, 3), R(4, 6)]:
+        strat.make_bets()
+        strat.resolve_roll(roll)
+    snapshot = strat.snapshot()
+    assert snapshot['num_rolls'] == 3
+    assert len(snapshot['rolls']) == 1
+    # A strategy that looks back further can't start from it
+    longer_text = 'if last 3 rolls == 7 then make bet pass 5 done'
+    with pytest.raises(ValueError):
+        simulate.UserDefinedStrategy.from_string(longer_text).restore(
+            snapshot)
+    # But one that looks back no further than the rolls kept can
+    simulate.UserDefinedStrategy.from_string(
+        'if last roll == 7 then make bet pass 5 done').restore(snapshot)
+    monkeypatch.chdir(tmp_path)
+    with open('stats.json', 'wt') as fd:
+        json.dump(fair_stats(), fd)
+    with open('snapshot.json', 'wt') as fd:
+        json.dump(snapshot, fd)
+    with open('longer.strategy', 'wt') as fd:
+        fd.write(longer_text)
+    args = create_arg_parser().parse_args([
+        'simulate', '-i', 'stats.json', '-f', 'bankroll', '--rolls', '10',
+        '--snapshot', 'snapshot.json', '--input-strategy', 'longer.strategy'])
+    assert simulate.main(args, None) == 1
+
+
+def test_dump_optimized():
+    from argparse import Namespace
+    import io
+    out = io.StringIO()
+    simulate.main(Namespace(
+        dump_optimized=True, output=out, input_strategy=io.StringIO(
+            'if 1 + 1 == 2 then make bet pass 5 done')), None)
+    assert out.getvalue() == 'MakeBet(Bet<Pass $5 on>)\n'
+
+
+def test_vector_bankroll_same_as_object():
+    from cdc.lib.vector import BuiltinStrategy
+    dice = simulate._make_dice_model('dice', fair_stats())
+    strat = BuiltinStrategy('molly:5,3,4,5')
+    objects = dict(simulate.bankroll_over_time_repeatedly(
+        dice, strat.make_strategy, 300, 5, entropy=7, first_repeat=2,
+        workers=2, start_roll=10, variance_reduction='antithetic'))
+    vectors = dict(simulate.vector_bankroll_over_time_repeatedly(
+        dice, strat.make_vector, 300, 5, entropy=7, first_repeat=2,
+        workers=2, start_roll=10, variance_reduction='antithetic'))
+    assert objects == vectors
+
+
+def test_builtin_strategy_cli(tmp_path, monkeypatch):
+    import json
+    from cdc.__main__ import create_arg_parser
+    monkeypatch.chdir(tmp_path)
+    with open('stats.json', 'wt') as fd:
+        json.dump(fair_stats(), fd)
+    # There is no custom.strategy, and it isn't needed
+    args = create_arg_parser().parse_args([
+        'simulate', '-i', 'stats.json', '-o', 'out.txt', '-f', 'bankroll',
+        '--builtin-strategy', 'pass:5', '--rolls', '10', '--repeat', '2'])
+    assert simulate.main(args, None) is None
+    args.output.close()
+    with open('out.txt', 'rt') as fd:
+        assert len(fd.readlines()) == 2
+    args = create_arg_parser().parse_args([
+        'simulate', '-i', 'stats.json', '-f', 'bankroll'])
+    assert simulate.main(args, None) == 1
+
+
+def test_exact_builtin_strategy_cli(tmp_path, monkeypatch):
+    import json
+    import pytest
+    from cdc.__main__ import create_arg_parser
+    monkeypatch.chdir(tmp_path)
+    with open('stats.json', 'wt') as fd:
+        json.dump(fair_stats(), fd)
+    args = create_arg_parser().parse_args([
+        'simulate', '-i', 'stats.json', '-o', 'out.json', '-f', 'exact',
+        '--builtin-strategy', 'pass:5'])
+    assert simulate.main(args, None) is None
+    args.output.close()
+    with open('out.json', 'rt') as fd:
+        res = json.load(fd)
+    # A pass bet loses 7/495 of itself and takes 557/165 rolls on average
+    assert res['ev_per_roll'] == pytest.approx(-5 * 7 / 495 / (557 / 165))
+
+
+def test_bankroll_same_bytes_for_both_engines(tmp_path, monkeypatch):
+    import json
+    from cdc.__main__ import create_arg_parser
+    from cdc.util import rand
+    monkeypatch.chdir(tmp_path)
+    with open('stats.json', 'wt') as fd:
+        json.dump(fair_stats(), fd)
+    # Place payouts make the object engine's bankrolls floats, even when
+    # they are whole
+    for strategy in ('pass:5', 'place:5,6,8', 'molly:5,3,4,5'):
+        outputs = []
+        for engine in ('object', 'vector'):
+            rand.init(7)
+            args = create_arg_parser().parse_args([
+                'simulate', '-i', 'stats.json', '-o', 'out.txt', '-f',
+                'bankroll', '--builtin-strategy', strategy, '--engine',
+                engine, '--rolls', '100', '--repeat', '3', '--workers', '1'])
+            assert simulate.main(args, None) is None
+            args.output.close()
+            with open('out.txt', 'rb') as fd:
+                outputs.append(fd.read())
+        assert outputs[0] == outputs[1]
+        assert b'.0,' not in outputs[0]
+    rand.init(None)
+
+
+def test_user_strat_counters():
+    strat = simulate.UserDefinedStrategy.from_string(
+        'if field loss streak >= 2 then make bet field 5 done')
+    assert strat.uses_counters
+    assert strat.rolls.capacity == 1
+    made = []
+    for roll in [(3, 3), (3, 4), (1, 1), (4, 4), (2, 3)]:
+        strat.make_bets()
+        made.append(len(strat.bets))
+        strat.resolve_roll(simulate.R(*roll))
+    assert made == [0, 0, 1, 0, 0]
+
+
+def test_user_strat_shared_program():
+    import pickle
+    from functools import partial
+    from cdc.lib import stratlang as lang
+    s = 'if current point is None then make bet pass 5 done '\
+        'else make bet place 6 6 done'
+    program = lang.Program(lang.parse(s))
+    make_new_strat = pickle.loads(pickle.dumps(
+        partial(simulate.UserDefinedStrategy, program)))
+    dice = simulate._make_dice_model('dice', fair_stats())
+    shared = dict(simulate.bankroll_over_time_repeatedly(
+        dice, make_new_strat, 200, 4, entropy=7, workers=2))
+    parsed = dict(simulate.bankroll_over_time_repeatedly(
+        dice, lambda: simulate.UserDefinedStrategy.from_string(s), 200, 4,
+        entropy=7, workers=1))
+    assert shared == parsed
+
+
+def test_stop_rules_hits():
+    import numpy as np
+    rules = simulate.StopRules(stop_loss=10, win_goal=20, max_drawdown=15)
+    assert rules
+    assert not simulate.StopRules()
+    assert simulate.StopRules().bounds(5) == (float('-inf'), float('inf'))
+    bankrolls = np.array([
+        [5., 10., -5., -10.],
+        [0., 20., 5., 6.],
+        [-10., 0., 0., 0.]])
+    start = np.zeros(3)
+    hit, peak = rules.hits(bankrolls, start, start)
+    assert hit.tolist() == [
+        [False, False, True, True],
+        [False, True, True, False],
+        [True, False, False, False]]
+    assert peak.tolist() == [10, 20, 0]
+
+
+def test_stop_rules_cli():
+    import pytest
+    from cdc.__main__ import create_arg_parser
+    for rule in ('--stop-loss', '--win-goal', '--max-drawdown'):
+        for value in ('0', '-5'):
+            with pytest.raises(SystemExit):
+                create_arg_parser().parse_args([
+                    'simulate', '-f', 'bankroll', rule, value])
+        args = create_arg_parser().parse_args([
+            'simulate', '-f', 'bankroll', rule, '0.5'])
+        assert getattr(args, rule[2:].replace('-', '_')) == 0.5
+
+
+def test_bankroll_stop_rules():
+    from cdc.lib.vector import BuiltinStrategy
+    dice = simulate._make_dice_model('dice', fair_stats())
+    strat = BuiltinStrategy('molly:5,3,4,5')
+    rules = simulate.StopRules(stop_loss=60, win_goal=80, max_drawdown=70)
+    skipped = {}
+    objects = dict(simulate.bankroll_over_time_repeatedly(
+        dice, strat.make_strategy, 500, 6, entropy=7, workers=2,
+        start_roll=10, stop_rules=rules, skipped=skipped))
+    vector_skipped = {}
+    vectors = dict(simulate.vector_bankroll_over_time_repeatedly(
+        dice, strat.make_vector, 500, 6, entropy=7, workers=2,
+        start_roll=10, stop_rules=rules, skipped=vector_skipped))
+    assert objects == vectors
+    assert skipped == vector_skipped
+    assert sorted(skipped) == list(range(6))
+    assert any(skipped.values())
+    for repeat, res in objects.items():
+        # Every roll is still in the output, with the last bankroll carried
+        # forward once the repeat stopped
+        assert sorted(res) == list(range(10, 510))
+        at = 509 - skipped[repeat]
+        assert all(res[i] == res[at] for i in range(at, 510))
+        assert res[at] <= -60 or res[at] >= 80 or \
+            res[at] <= max(0, *(res[i] for i in range(10, at))) - 70
@@ -0,0 +1,36 @@
+from cdc.lib.exact import evaluate, TooManyStatesError
+from cdc.lib.strategy import BasicPassStrategy, BasicComeStrategy,\
+    MartingaleFieldStrategy
+from cdc.util.rand import IndependentDice
+
+from functools import partial
+import pytest
+
+
+FAIR = IndependentDice([1] * 6).pair_probabilities()
+
+
+def test_exact_pass():
+    res = evaluate(partial(BasicPassStrategy, 5), FAIR)
+    # A pass bet loses 7/495 of itself and takes 557/165 rolls on average
+    assert res['ev_per_roll'] == pytest.approx(-5 * 7 / 495 / (557 / 165))
+    # A shooter's hand lasts 1671/196 rolls on average
+    assert res['rolls_per_hand'] == pytest.approx(1671 / 196)
+    assert res['ev_per_hand'] == pytest.approx(
+        res['ev_per_roll'] * res['rolls_per_hand'])
+    assert res['variance_per_roll'] > 0
+    assert res['variance_per_hand'] > 0
+
+
+def test_exact_come():
+    res = evaluate(partial(BasicComeStrategy, 5, 2), FAIR)
+    assert res['ev_per_hand'] == pytest.approx(
+        res['ev_per_roll'] * res['rolls_per_hand'])
+    assert res['ev_per_roll'] < 0
+
+
+def test_exact_unbounded():
+    with pytest.raises(TooManyStatesError):
+        evaluate(partial(MartingaleFieldStrategy, 1), FAIR)
+    with pytest.raises(TooManyStatesError):
+        evaluate(partial(BasicComeStrategy, 5, 2), FAIR, max_states=10)
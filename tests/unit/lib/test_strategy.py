@@ -4,7 +4,8 @@ from cdc.lib.strategy import Strategy, CrapsRoll as R,\
     CGEWithBets, CGEBetWon, CGEBetLost, CGEBetPush, CGEBetConverted,\
     CGEPoint, CGEPointEstablished, CGEPointWon, CGEPointLost,\
     MartingaleFieldStrategy, BasicPassStrategy, BasicComeStrategy,\
-    BasicPlaceStrategy,\
+    ThreePointMolly, CrapsBet,\
+    BasicPlaceStrategy, RollHistory, BetBook, BetOutcome, outcome_index,\
     IllegalBet, IllegalBetChange
 
 import pytest
@@ -1255,3 +1256,357 @@ def test_basic_place_strat():
         strat.make_bets()
         strat.after_roll(roll)
     assert strat.bankroll == 77
+
+
+def test_roll_history_unbounded():
+    h = RollHistory()
+    assert h.capacity is None
+    for i in range(100):
+        h.append(i)
+    assert len(h) == 100
+    assert h[0] == 0
+    assert h[-1] == 99
+    assert h[-3:] == [97, 98, 99]
+    assert list(h) == list(range(100))
+
+
+def test_roll_history_bounded():
+    h = RollHistory(3)
+    assert h.capacity == 3
+    assert len(h) == 0
+    with pytest.raises(IndexError):
+        h[-1]
+    for i in range(10):
+        h.append(i)
+    assert len(h) == 10
+    assert h[-1] == 9
+    assert h[7] == 7
+    assert h[-3:] == [7, 8, 9]
+    assert list(h) == [7, 8, 9]
+    assert list(reversed(h)) == [9, 8, 7]
+    with pytest.raises(IndexError):
+        h[-4]
+    with pytest.raises(IndexError):
+        h[6]
+    with pytest.raises(IndexError):
+        h[-5:]
+
+
+def test_builtin_strats_keep_one_roll():
+    strat = BasicPassStrategy(5)
+    for roll in all_dice_combos():
+        strat.make_bets()
+        strat.after_roll(roll)
+    assert len(strat.rolls) == 36
+    assert list(strat.rolls) == [strat.last_roll]
+
+
+def test_bet_book_identity():
+    book = BetBook()
+    b1, b2 = CBField(5), CBField(5)
+    assert b1 == b2
+    book.add(b1)
+    book.add(b2)
+    assert len(book) == 2
+    book.remove(b2)
+    assert len(book) == 1
+    assert book[0] is b1
+    assert b1 in book
+    assert b2 not in book
+
+
+def test_bet_book_indexes():
+    book = BetBook()
+    pass_bet = CBPass(5)
+    place6, place8 = CBPlace(6, 6), CBPlace(8, 6)
+    come = CBCome(5)
+    come.set_point(4)
+    odds = CBOdds(4, False, 10)
+    for b in [pass_bet, place6, place8, come, odds]:
+        book.add(b)
+    assert list(book) == [pass_bet, place6, place8, come, odds]
+    assert book.of_type(CBPlace) == [place6, place8]
+    assert book.tied_to(CBPlace, 8) == [place8]
+    assert book.tied_to(CBPlace, 4) == []
+    assert book.tied_to(CBCome, 4) == [come]
+    assert book.tied_to(CBCome, None) == []
+    assert book.of_type(CBDontPass) == []
+    assert book.affected_by(4) == [pass_bet, come, odds]
+    assert book.affected_by(6) == [pass_bet, place6]
+    assert book.affected_by(7) == [pass_bet, place6, place8, come, odds]
+    assert book.affected_by(11) == [pass_bet]
+    book.remove(place6)
+    assert book.affected_by(6) == [pass_bet]
+    assert book.of_type(CBPlace) == [place8]
+
+
+def test_outcome_table_place():
+    bet = CBPlace(6, 6)
+    assert bet.outcomes[outcome_index(R(3, 3), 4)] == (BetOutcome.Win, 13)
+    assert bet.outcomes[outcome_index(R(1, 5), 6)] == (BetOutcome.Win, 13)
+    assert bet.outcomes[outcome_index(R(3, 4), 8)] == (BetOutcome.Lose, 0)
+    assert bet.outcomes[outcome_index(R(4, 4), 8)] == (BetOutcome.Nothing, 0)
+    bet.set_working(False)
+    assert bet.outcomes[outcome_index(R(3, 3), 4)] == (BetOutcome.Nothing, 0)
+    assert bet.outcomes[outcome_index(R(3, 4), 8)] == (BetOutcome.Nothing, 0)
+
+
+def test_outcome_table_hard_way():
+    bet = CBHardWay(8, 1)
+    assert bet.outcomes[outcome_index(R(4, 4), None)] == (BetOutcome.Win, 10)
+    assert bet.outcomes[outcome_index(R(2, 6), None)] == (BetOutcome.Lose, 0)
+    assert bet.outcomes[outcome_index(R(6, 1), 5)] == (BetOutcome.Lose, 0)
+
+
+def test_outcome_table_push():
+    dp = CBDontPass(5)
+    assert dp.outcomes[outcome_index(R(6, 6), None)] == (BetOutcome.Push, 5)
+    odds = CBOdds(4, True, 10)
+    assert odds.outcomes[outcome_index(R(2, 2), 4)] == (BetOutcome.Lose, 0)
+    odds.set_working(False)
+    assert odds.outcomes[outcome_index(R(2, 2), None)] == \
+        (BetOutcome.Push, 10)
+    assert odds.outcomes[outcome_index(R(3, 4), None)] == \
+        (BetOutcome.Nothing, 0)
+
+
+def test_outcome_table_shared():
+    assert CBField(5).outcomes is CBField(5).outcomes
+    assert CBField(5).outcomes is not CBField(10).outcomes
+    assert CBField(5).outcomes is not CBField(5, mult12=3).outcomes
+    come1, come2 = CBCome(5), CBCome(5)
+    assert come1.outcomes is come2.outcomes
+    come2.set_point(6)
+    assert come1.outcomes is not come2.outcomes
+
+
+def test_resolve_roll_same_as_after_roll():
+    strat1, strat2 = BasicComeStrategy(5, 3), BasicComeStrategy(5, 3)
+    for roll in sorted(all_dice_combos(), key=lambda r: r.value):
+        strat1.make_bets()
+        strat2.make_bets()
+        assert strat1.resolve_roll(roll) is None
+        strat2.after_roll(roll)
+        assert strat1.bankroll == strat2.bankroll
+        assert strat1.point == strat2.point
+        assert [str(b) for b in strat1.bets] == [str(b) for b in strat2.bets]
+
+
+def test_listener():
+    strat = get_strat()
+    heard = []
+    strat.add_listener(heard.append)
+    strat.add_bet(CBPass(5))
+    strat.resolve_roll(R(2, 2))
+    assert [str(ev) for ev in heard] == ['PointEst<4>']
+    evs = strat.after_roll(R(3, 1))
+    assert len(evs) == 2
+    assert heard[1:] == evs
+    strat.remove_listener(heard.append)
+    strat.add_bet(CBPass(5))
+    strat.resolve_roll(R(3, 4))
+    assert len(heard) == 3
+
+
+def test_rolls_interned():
+    import pickle
+    assert R(3, 4) is R(3, 4)
+    assert R(3, 4) is not R(4, 3)
+    assert R(2, 5) is R.from_index(R(2, 5).pair_index)
+    assert pickle.loads(pickle.dumps(R(6, 1))) is R(6, 1)
+    assert [R.from_index(i).dice for i in range(36)] == \
+        [(d1, d2) for d1 in range(1, 6+1) for d2 in range(1, 6+1)]
+
+
+def test_bets_have_no_dict():
+    bets = [
+        CBPass(5), CBDontPass(5), CBCome(5), CBDontCome(5), CBField(5),
+        CBPlace(6, 6), CBOdds(4, False, 5), CBHardWay(8, 1)]
+    for bet in bets:
+        assert not hasattr(bet, '__dict__')
+    come = CBCome(5)
+    come.set_point(8)
+    assert come.roll_win == {8}
+    assert come.roll_lose == {7}
+    assert CBPlace(5, 5).name == 'Place5'
+
+
+def test_bet_dict_round_trip():
+    come = CBCome(5)
+    come.set_point(9)
+    bets = [
+        CBPass(5), CBDontPass(5), CBCome(5), come, CBDontCome(5),
+        CBField(5, mult12=3), CBPlace(6, 6, working=False),
+        CBOdds(4, True, 10), CBHardWay(8, 1)]
+    for bet in bets:
+        again = CrapsBet.from_dict(bet.to_dict())
+        assert type(again) is type(bet)
+        assert again == bet
+        assert again.outcome_key() == bet.outcome_key()
+
+
+def test_snapshot_restore():
+    strat = ThreePointMolly(5, (3, 4, 5))
+    rolls = [R(2, 2), R(3, 3), R(4, 4), R(1, 2), R(5, 4)]
+    for roll in rolls:
+        strat.make_bets()
+        strat.resolve_roll(roll)
+    snapshot = strat.snapshot()
+    assert snapshot['num_rolls'] == 5
+    assert snapshot['point'] == 4
+    other = ThreePointMolly(5, (3, 4, 5))
+    other.restore(snapshot)
+    assert other.snapshot() == snapshot
+    assert len(other.rolls) == 5
+    assert other.last_roll is R(5, 4)
+    for roll in [R(3, 4), R(2, 2), R(6, 6)]:
+        for s in (strat, other):
+            s.make_bets()
+            s.resolve_roll(roll)
+        assert other.snapshot() == strat.snapshot()
+
+
+def test_fork():
+    strat = BasicComeStrategy(5, 3)
+    strat.make_bets()
+    strat.resolve_roll(R(2, 3))
+    strat.make_bets()
+    before = strat.snapshot()
+    fork = strat.fork()
+    assert fork.snapshot() == before
+    fork.resolve_roll(R(3, 4))
+    fork.make_bets()
+    assert strat.snapshot() == before
+    assert fork.snapshot() != before
+    assert len(fork.rolls) == 2
+    assert len(strat.rolls) == 1
+
+
+def test_pickle():
+    import pickle
+    strat = ThreePointMolly(5, (3, 4, 5))
+    for roll in [R(2, 2), R(3, 3), R(4, 4), R(1, 2), R(5, 4)]:
+        strat.make_bets()
+        strat.resolve_roll(roll)
+    other = pickle.loads(pickle.dumps(strat))
+    assert other.snapshot() == strat.snapshot()
+    for roll in [R(3, 3), R(2, 2), R(3, 4), R(6, 6)]:
+        for s in (strat, other):
+            s.make_bets()
+            s.resolve_roll(roll)
+        assert other.snapshot() == strat.snapshot()
+
+
+def test_counters():
+    strat = get_strat()
+    expected = [
+        # roll, field_loss_streak, rolls_since_point, points_made, seven_outs
+        (R(3, 3), 1, 0, 0, 0),
+        (R(2, 3), 2, 1, 0, 0),
+        (R(1, 1), 0, 2, 0, 0),
+        (R(2, 4), 1, 0, 1, 0),
+        (R(2, 2), 0, 0, 1, 0),
+        (R(4, 4), 1, 1, 1, 0),
+        (R(3, 4), 2, 0, 0, 1),
+        (R(3, 4), 3, 0, 0, 1),
+        (R(5, 5), 0, 0, 0, 1),
+        (R(3, 4), 1, 0, 0, 2),
+    ]
+    for roll, streak, since_point, made, sevens in expected:
+        strat.resolve_roll(roll)
+        assert strat.field_loss_streak == streak
+        assert strat.rolls_since_point == since_point
+        assert strat.points_made == made
+        assert strat.seven_outs == sevens
+    # after_roll keeps them up to date too
+    strat.after_roll(R(3, 3))
+    assert strat.field_loss_streak == 2
+    assert strat.counters() == {
+        'field_loss_streak': 2, 'rolls_since_point': 0, 'points_made': 0,
+        'seven_outs': 2}
+
+
+def test_counters_snapshot():
+    strat = get_strat()
+    for roll in [R(3, 3), R(2, 3), R(3, 3), R(4, 5)]:
+        strat.resolve_roll(roll)
+    snapshot = strat.snapshot()
+    assert snapshot['counters'] == strat.counters()
+    other = get_strat()
+    other.restore(snapshot)
+    assert other.counters() == strat.counters()
+    assert strat.fork().counters() == strat.counters()
+    # Snapshots from before counters existed start them at 0
+    del snapshot['counters']
+    other.restore(snapshot)
+    assert set(other.counters().values()) == {0}
+
+
+def test_martingale_field_uses_counters():
+    strat = MartingaleFieldStrategy(1)
+    assert strat.uses_counters
+    assert strat.rolls.capacity == 1
+    amounts = []
+    for roll in [R(3, 3), R(3, 4), R(1, 1), R(2, 3), R(6, 6)]:
+        strat.make_bets()
+        amounts.append(strat.bets[0].amount)
+        strat.resolve_roll(roll)
+    assert amounts == [1, 2, 4, 1, 2]
+
+
+def test_bet_copy():
+    from copy import copy
+    bets = [
+        CBPass(5), CBDontPass(5), CBCome(5), CBDontCome(5, working=False),
+        CBField(5, mult12=3), CBPlace(6, 6), CBOdds(4, True, 10),
+        CBHardWay(8, 1)]
+    come = CBCome(5)
+    come.set_point(9)
+    bets.append(come)
+    for bet in bets:
+        bet.outcomes
+        again = copy(bet)
+        assert again is not bet
+        assert type(again) is type(bet)
+        assert again.to_dict() == bet.to_dict()
+        assert again.outcomes is bet.outcomes
+
+
+class _PassOnly(Strategy):
+    bet_types = (CBPass,)
+
+    def make_bets(self):
+        if self.point is None and not len(self.bets):
+            self.add_bet(CBPass(5))
+
+
+def test_bet_types():
+    strat = _PassOnly('')
+    assert not strat._find_pushes and not strat._move_comes
+    assert not MartingaleFieldStrategy(1)._find_pushes
+    molly = ThreePointMolly(5, (3, 4, 5))
+    assert molly._find_pushes and molly._move_comes
+    # Plays the same as a strategy that looks for everything on every roll
+    other = _PassOnly('')
+    other._set_bet_types(None)
+    rolls = [R(3, 3), R(6, 6), R(2, 4), R(1, 1), R(4, 4), R(3, 4)] * 3
+    for roll in rolls:
+        strat.make_bets()
+        other.make_bets()
+        strat.resolve_roll(roll)
+        other.resolve_roll(roll)
+        assert strat.bankroll == other.bankroll
+    # Other types of bets still work
+    strat.add_bet(CBDontPass(5))
+    assert strat._find_pushes and not strat._move_comes
+    strat.resolve_roll(R(6, 6))
+    assert strat.bankroll == other.bankroll
+    # As do other types of bets on a restored table
+    snapshot = ThreePointMolly(5, (3, 4, 5)).snapshot()
+    snapshot['point'] = 6
+    snapshot['bets'] = [CBCome(5).to_dict()]
+    strat = _PassOnly('')
+    strat.restore(snapshot)
+    assert strat._move_comes
+    strat.resolve_roll(R(4, 4))
+    assert strat.bets[0].point == 8
@@ -0,0 +1,37 @@
+from cdc.lib import stratgrammar
+
+import json
+import subprocess
+import sys
+
+
+def test_tables_up_to_date():
+    # If this fails, run python -m cdc.lib.stratgrammar
+    with open(stratgrammar.TABLES_FNAME, 'rt') as fd:
+        tables = json.load(fd)
+    built = stratgrammar._build_with_sly(stratgrammar._Parser)
+    assert tables == json.loads(json.dumps(
+        stratgrammar._tables(built, stratgrammar._Parser._funcs)))
+
+
+def test_tables_loaded():
+    # The tables were read instead of built
+    assert not hasattr(stratgrammar._Parser._lrtable, 'sr_conflicts')
+
+
+def test_write_tables(tmp_path):
+    fname = str(tmp_path / 'tables.json')
+    stratgrammar.write_tables(fname)
+    with open(fname, 'rt') as fd, \
+            open(stratgrammar.TABLES_FNAME, 'rt') as expected:
+        assert json.load(fd) == json.load(expected)
+
+
+def test_not_imported_until_parsing():
+    code = 'import sys; import cdc.__main__; '\
+        'assert "sly" not in sys.modules; '\
+        'assert "cdc.lib.stratgrammar" not in sys.modules; '\
+        'from cdc.lib import stratlang; '\
+        'list(stratlang.parse("make bet pass 5 done")); '\
+        'assert "cdc.lib.stratgrammar" in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True)
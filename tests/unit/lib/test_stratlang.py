@@ -1,8 +1,11 @@
 from cdc.lib.stratlang import parse, InvalidValueError, ListId, VarId,\
-    _test_parse_complexity, StrategyTooComplexError, AssignOp, UserVar, BinOp
+    _test_parse_complexity, StrategyTooComplexError, AssignOp, UserVar, BinOp,\
+    max_lookback, uses_counters, walk, compile_program, Program, optimize,\
+    format_program, SharedOp, analyze
 from cdc.lib.strategy import CBPass, CBDontPass, CBCome, CBDontCome, CBField,\
-    CBPlace, CBHardWay, CBOdds
+    CBPlace, CBHardWay, CBOdds, CrapsRoll as R, Strategy
 
+import pickle
 import pytest
 
 
@@ -194,11 +197,27 @@ def test_list_id_invalid():
 def test_var_id_valid():
     for var_id, var_strs in (
             (VarId.Point, ('current point', 'cUrReNt pOiNt')),
-            (VarId.Bankroll, ('bankroll', 'BaNkRoLl'))):
+            (VarId.Bankroll, ('bankroll', 'BaNkRoLl')),
+            (VarId.FieldLossStreak, ('field loss streak',)),
+            (VarId.RollsSincePoint, ('rolls since point',)),
+            (VarId.PointsMade, ('points made',)),
+            (VarId.SevenOuts, ('seven outs', 'Seven Outs'))):
         for var_str in var_strs:
             assert VarId.from_string(var_str) == var_id
 
 
+def test_counter_var_ids():
+    s = 'if rolls since point > 2 and points made == 0 then '\
+        'make bet field 5 done'
+    assert uses_counters(parse(s))
+    assert not uses_counters(parse('make bet field 5 done'))
+    # The list of rolls since the point was established is still a list
+    [item] = parse('set a to length of rolls since point established done')
+    assert item.expr.list_id == ListId.RollsSincePoint
+    [item] = parse('set a to seven outs done')
+    assert item.expr == VarId.SevenOuts
+
+
 def test_var_id_invalid():
     for s in {'aaaaaa', '', '1986'}:
         with pytest.raises(NotImplementedError):
@@ -449,3 +468,195 @@ def test_uservar_assign_rhs_expr_3():
     ret = ret[0]
     assert ret.var == 'foo'
     assert ret.expr == BinOp('*', UserVar('bar'), 2)
+
+
+def test_max_lookback():
+    assert max_lookback(parse('make bet pass 5 done')) == 0
+    assert max_lookback(parse('set a to last rolls done')) == 1
+    s = 'if last 3 rolls == 7 then set a to last 5 rolls done '\
+        'else make bet pass 5 done'
+    assert max_lookback(parse(s)) == 5
+
+
+class _Strat(Strategy):
+    ''' Makes the bets of a compiled program '''
+    def __init__(self, s, *a, **kw):
+        self._program = compile_program(parse(s))
+        super().__init__('Test', *a, **kw)
+
+    def make_bets(self):
+        self._program(self)
+
+
+def _bets_made(s, rolls=(), **kw):
+    strat = _Strat(s, **kw)
+    for roll in rolls:
+        strat.resolve_roll(R(*roll))
+    strat.make_bets()
+    return [(bet.name, bet.amount) for bet in strat.bets]
+
+
+def test_compile_program_conds():
+    s = 'if current point is None then make bet pass 5 done '\
+        'else make bet place 6 6 done'
+    assert _bets_made(s) == [('Pass', 5)]
+    assert _bets_made(s, [(3, 3)]) == [('Place6', 6)]
+    assert _bets_made('if True then make bet field 1 done') == [('Field', 1)]
+    assert _bets_made('if 0 then make bet field 1 done') == []
+    s = 'if last roll == 7 || bankroll > 10 then make bet field 2 done'
+    assert _bets_made(s) == []
+    assert _bets_made(s, [(3, 4)]) == [('Field', 2)]
+    assert _bets_made(s, bankroll=11) == [('Field', 2)]
+
+
+def test_compile_program_user_vars():
+    s = '{ set a to 3 done set b to a + 2 * 4 done '\
+        'if b == 11 then make bet field 1 done }'
+    assert _bets_made(s) == [('Field', 1)]
+    s = '{ set a to length of rolls % 3 done '\
+        'if a == 2 then make bet field 1 done else make bet field 2 done }'
+    assert _bets_made(s, [(1, 1)] * 2) == [('Field', 1)]
+    assert _bets_made(s, [(1, 1)] * 3) == [('Field', 2)]
+    # Every run starts without user variables
+    strat = _Strat('{ if length of rolls == 0 then set a to 1 done '
+                   'if a == 1 then make bet field 1 done }')
+    strat.make_bets()
+    strat.resolve_roll(R(1, 1))
+    with pytest.raises(KeyError):
+        strat.make_bets()
+
+
+def test_compile_program_makes_copies():
+    strat = _Strat('make bet field 1 done')
+    strat.make_bets()
+    strat.make_bets()
+    assert len(strat.bets) == 2
+    assert strat.bets[0] is not strat.bets[1]
+
+
+def test_compile_program_unsupported():
+    # Lists other than rolls can't be evaluated, but that is only an error
+    # if the program gets to them
+    s = 'if current point is not None then '\
+        'set a to length of points + 1 done'
+    assert _bets_made(s) == []
+    with pytest.raises(NotImplementedError):
+        _bets_made(s, [(3, 3)])
+
+
+def test_program_pickles():
+    s = 'if last 2 rolls == 7 then make bet field 5 done '\
+        'else if seven outs == 0 then make bet pass 5 done'
+    program = Program(parse(s))
+    assert program.analysis.max_lookback == 2
+    assert program.analysis.uses_counters
+    data = pickle.dumps(program)
+    # Only the parse tree is pickled, not the compiled closures
+    assert b'compile_program' not in data
+    copy = pickle.loads(data)
+    assert len(copy.logic) == len(program.logic)
+    assert copy.analysis.max_lookback == 2
+    assert copy.analysis.uses_counters
+    strat = _Strat('0 done')
+    strat._program = copy
+    strat.make_bets()
+    assert [(bet.name, bet.amount) for bet in strat.bets] == [('Pass', 5)]
+
+
+def _optimized(s):
+    return format_program(optimize(parse(s)))
+
+
+def test_optimize_folds_constants():
+    assert _optimized('set a to 2 + 3 * 2 done') == 'a = 8\n'
+    s = 'if bankroll > 10 * 2 then make bet field 5 done'
+    assert _optimized(s) == \
+        'if (VarId.Bankroll > 20) then\n    MakeBet(Bet<Field $5 on>)\n'
+    # Left to fail when the program runs, as it would have
+    assert _optimized('set a to 1 / 0 done') == 'a = (1 / 0)\n'
+
+
+def test_optimize_dead_branches():
+    s = '{ 5 done if True then make bet pass 5 done '\
+        'if 1 == 2 then make bet field 5 done else make bet field 1 done '\
+        'if 1 > 2 then make bet field 2 done }'
+    assert _optimized(s) == \
+        'MakeBet(Bet<Pass $5 on>)\nMakeBet(Bet<Field $1 on>)\n'
+    s = 'if current point is None then { if False then make bet pass 5 '\
+        'done } else make bet place 6 6 done'
+    assert _optimized(s) == \
+        'if (VarId.Point == None) then\n    nothing\nelse\n'\
+        '    MakeBet(Bet<Place6 $6 on>)\n'
+    # Dead branches don't count toward the lookback
+    s = 'if False then set a to last 5 rolls done'
+    assert max_lookback(parse(s)) == 5
+    assert Program(parse(s)).analysis.max_lookback == 0
+
+
+def test_optimize_shares():
+    s = '{ if last 3 rolls == 7 then make bet field 5 done '\
+        'if last 3 rolls == 7 then make bet field 2 done '\
+        'if current point == 6 and bankroll > 0 then set a to last 3 rolls '\
+        'done if bankroll > 0 then make bet field 1 done }'
+    logic = optimize(parse(s))
+    shared = [item for item in walk(logic) if isinstance(item, SharedOp)]
+    # The bankroll changes as bets are made, and a lone "current point" or
+    # "last roll" is as cheap as looking up a shared value
+    assert sorted({str(item) for item in shared}) == [
+        'Shared0<Rolls[-3:]>', 'Shared1<(Shared0<Rolls[-3:]> == 7)>']
+    # Makes the same bets
+    for rolls in [(), [(1, 2), (3, 4), (3, 3)], [(1, 1), (3, 4), (4, 4)]]:
+        strat = _Strat('0 done')
+        strat._program = Program(parse(s))
+        for roll in rolls:
+            strat.resolve_roll(R(*roll))
+        strat.make_bets()
+        assert [(bet.name, bet.amount) for bet in strat.bets] == \
+            _bets_made(s, rolls)
+
+
+def test_optimize_keeps_errors():
+    # Comparing None to a number fails, even on the side of an "and" that
+    # doesn't matter, and still only if the program gets to it
+    s = 'if current point is not None then { if 1 == 2 and last 3 rolls > 2 '\
+        'then make bet field 5 done }'
+    strat = _Strat('0 done')
+    strat._program = Program(parse(s))
+    strat.make_bets()
+    strat.resolve_roll(R(3, 3))
+    with pytest.raises(TypeError):
+        strat.make_bets()
+
+
+def test_analyze():
+    s = '{ if current point is None and last 3 rolls == 7 then make bet pass '\
+        '5 done else { set a to length of rolls done make bet place 6 6 '\
+        'done } if bankroll > 0 and field loss streak > 1 then make bet '\
+        'field 5 done }'
+    res = analyze(parse(s))
+    assert res.var_ids == {VarId.Point, VarId.Bankroll, VarId.FieldLossStreak}
+    assert res.list_ids == {ListId.Rolls}
+    assert res.length_ids == {ListId.Rolls}
+    assert res.max_lookback == 3
+    assert res.uses_bankroll
+    assert res.uses_num_rolls
+    assert res.uses_counters
+    assert res.uses_user_vars
+    assert res.bet_types == {CBPass, CBPlace, CBField}
+    res = analyze(parse('if current point is None then make bet pass 5 done'))
+    assert res.var_ids == {VarId.Point}
+    assert not res.list_ids
+    assert res.max_lookback == 0
+    assert not res.uses_bankroll
+    assert not res.uses_num_rolls
+    assert not res.uses_counters
+    assert not res.uses_user_vars
+    assert res.bet_types == {CBPass}
+    # Leave out what is only in branches that are never taken
+    res = analyze(parse('if last roll == 7 then make bet pass 5 done'))
+    assert res.list_ids == {ListId.Rolls}
+    assert not res.length_ids and not res.uses_num_rolls
+    s = 'if 1 > 2 then { set a to bankroll done make bet come 5 done }'
+    assert analyze(parse(s)).bet_types == {CBCome}
+    res = Program(parse(s)).analysis
+    assert not res.var_ids and not res.uses_user_vars and not res.bet_types
@@ -0,0 +1,63 @@
+from cdc.lib.strategy import CrapsRoll as R
+from cdc.lib.vector import BuiltinStrategy
+
+import numpy as np
+import pytest
+
+
+def _play_objects(strat, pairs):
+    ''' Play each row of pairs on its own Strategy, and return the bankroll
+    of each after every roll '''
+    out = np.empty(pairs.shape)
+    for i, row in enumerate(pairs.tolist()):
+        s = strat.make_strategy()
+        for j, pair in enumerate(row):
+            s.make_bets()
+            s.resolve_roll(R.from_index(pair))
+            out[i, j] = s.bankroll
+    return out
+
+
+@pytest.mark.parametrize('spec', [
+    'pass:5',
+    'come:5,1',
+    'come:5,6',
+    'place:5,4,5,6,8,9,10',
+    'place:10,8,6,6',
+    'martingale-field:1',
+    'molly:5,3,4,5',
+    'molly:10,1,2,3,6',
+    'molly:2.5,3,4,5,0',
+])
+def test_same_as_strategy(spec):
+    strat = BuiltinStrategy(spec)
+    pairs = np.random.default_rng(1).integers(0, 36, size=(10, 1000))
+    vector = strat.make_vector(len(pairs))
+    assert len(vector) == 10
+    assert (vector.play(pairs) == _play_objects(strat, pairs)).all()
+
+
+def test_play_in_pieces():
+    strat = BuiltinStrategy('molly:5,3,4,5')
+    pairs = np.random.default_rng(2).integers(0, 36, size=(4, 500))
+    whole = strat.make_vector(4).play(pairs)
+    vector = strat.make_vector(4)
+    pieces = np.hstack([vector.play(pairs[:, :123]), vector.play(
+        pairs[:, 123:])])
+    assert (whole == pieces).all()
+
+
+def test_builtin_strategy():
+    strat = BuiltinStrategy('molly:5,3,4,5')
+    assert str(strat) == 'molly'
+    assert strat.make_strategy()._num_comes == 2
+    assert BuiltinStrategy('molly:5,3,4,5,4').make_strategy()._num_comes == 4
+    assert BuiltinStrategy('pass:2.5').make_strategy()._base_bet == 2.5
+    assert BuiltinStrategy('place:5,6,8').make_strategy()._nums == (6, 8)
+
+
+@pytest.mark.parametrize('spec', [
+    'foo:5', 'pass', 'pass:5,6', 'molly:5,3', 'place:5,7', 'pass:x'])
+def test_builtin_strategy_invalid(spec):
+    with pytest.raises(ValueError):
+        BuiltinStrategy(spec)
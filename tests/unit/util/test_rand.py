@@ -0,0 +1,180 @@
+from cdc.util import rand
+
+import numpy as np
+import pytest
+
+
+def test_roll_dice_batch_shape():
+    dice = rand.roll_dice_batch([1, 1, 1, 1, 1, 1], 1000)
+    assert dice.shape == (1000, 2)
+    assert dice.dtype == np.uint8
+    assert dice.min() >= 1
+    assert dice.max() <= 6
+
+
+def test_roll_dice_batch_zero_weight():
+    # Never roll a side that has no weight
+    for side in range(6):
+        weights = [1] * 6
+        weights[side] = 0
+        dice = rand.roll_dice_batch(weights, 1000)
+        assert side + 1 not in dice
+
+
+def test_roll_dice_batch_single_side():
+    for side in range(6):
+        weights = [0] * 6
+        weights[side] = 1
+        dice = rand.roll_dice_batch(weights, 100)
+        assert (dice == side + 1).all()
+
+
+def test_roll_dice_batch_seeded():
+    rng1 = np.random.default_rng(1)
+    rng2 = np.random.default_rng(1)
+    weights = [1, 2, 3, 4, 5, 6]
+    assert (rand.roll_dice_batch(weights, 100, rng=rng1) ==
+            rand.roll_dice_batch(weights, 100, rng=rng2)).all()
+
+
+def test_alias_sampler_distribution():
+    weights = [1, 2, 3, 4, 5, 6]
+    sampler = rand.AliasSampler(weights)
+    n = 210000
+    counts = np.bincount(sampler.draw_many(n), minlength=6)
+    for i, w in enumerate(weights):
+        expected = n * w / sum(weights)
+        assert abs(counts[i] - expected) < expected * 0.05
+
+
+def test_alias_sampler_zero_weight():
+    sampler = rand.AliasSampler([0, 1, 0, 3, 0, 0])
+    assert set(sampler.draw_many(10000).tolist()) == {1, 3}
+    for _ in range(1000):
+        assert sampler.draw() in {1, 3}
+
+
+def test_alias_sampler_extreme_uniforms():
+    # The smallest and largest possible uniforms still produce valid indexes
+    for weights in ([1] * 36, [1, 2, 3, 4, 5, 6], [0, 0, 0, 0, 0, 1]):
+        sampler = rand.AliasSampler(weights)
+        for u in (0.0, np.nextafter(1.0, 0)):
+            i = sampler.draw(uniform=lambda: u)
+            assert 0 <= i < len(weights)
+            assert weights[i]
+            i = sampler.from_uniforms(np.array([u]))[0]
+            assert 0 <= i < len(weights)
+            assert weights[i]
+
+
+def test_alias_sampler_pickle():
+    import pickle
+    sampler = rand.AliasSampler([1, 2, 3, 4, 5, 6])
+    u = np.random.default_rng(1).random(100)
+    clone = pickle.loads(pickle.dumps(sampler))
+    assert (sampler.from_uniforms(u) == clone.from_uniforms(u)).all()
+
+
+def test_roll_die_with_weights():
+    for _ in range(1000):
+        assert rand.roll_die_with_weights([0, 0, 1, 0, 1, 0]) in {3, 5}
+
+
+def test_pair_index():
+    for i, (d1, d2) in enumerate(rand.PAIRS):
+        assert rand.pair_index(d1, d2) == i
+        assert tuple(rand.PAIR_DICE[i]) == (d1, d2)
+
+
+def test_independent_dice():
+    dice = rand.IndependentDice([0, 1, 0, 0, 0, 1])
+    pairs = dice.roll_pairs(1000)
+    assert set(pairs.tolist()) <= {
+        rand.pair_index(d1, d2) for d1 in (2, 6) for d2 in (2, 6)}
+    rolled = dice.roll(1000)
+    assert rolled.shape == (1000, 2)
+    assert set(rolled.flatten().tolist()) == {2, 6}
+
+
+def test_joint_dice_keeps_correlation():
+    # Only ever roll doubles, which independent dice can't express
+    weights = [0] * 36
+    for d in range(1, 6+1):
+        weights[rand.pair_index(d, d)] = 1
+    rolled = rand.JointDice(weights).roll(1000)
+    assert (rolled[:, 0] == rolled[:, 1]).all()
+    assert len(set(rolled[:, 0].tolist())) == 6
+
+
+def test_roll_stream_deterministic():
+    a = rand.RollStream(1234, 5).random(10)
+    b = rand.RollStream(1234, 5).random(10)
+    assert (a == b).all()
+
+
+def test_roll_stream_independent():
+    a = rand.RollStream(1234, 5).random(10)
+    assert (a != rand.RollStream(1234, 6).random(10)).all()
+    assert (a != rand.RollStream(1235, 5).random(10)).all()
+
+
+def test_roll_stream_chunking():
+    # How the stream is consumed doesn't change its contents
+    n = rand.ROLL_BLOCK_SIZE * 3 + 17
+    whole = rand.RollStream(1, 2, uniforms_per_roll=2).random(n)
+    stream = rand.RollStream(1, 2, uniforms_per_roll=2)
+    parts = [stream.random(k) for k in (0, 1, 1000, rand.ROLL_BLOCK_SIZE * 2)]
+    parts.append(stream.random(n - sum(len(p) for p in parts)))
+    assert (np.concatenate(parts) == whole).all()
+
+
+def test_roll_stream_start_roll():
+    for upr in (1, 2):
+        n = rand.ROLL_BLOCK_SIZE * 3
+        whole = rand.RollStream(9, 0, uniforms_per_roll=upr).random(n * upr)
+        for start in (0, 1, rand.ROLL_BLOCK_SIZE - 1, rand.ROLL_BLOCK_SIZE,
+                      rand.ROLL_BLOCK_SIZE * 2 + 5):
+            stream = rand.RollStream(
+                9, 0, uniforms_per_roll=upr, start_roll=start)
+            part = stream.random((n - start) * upr)
+            assert (part == whole[start * upr:]).all()
+
+
+def test_seed_entropy():
+    rand.init(42)
+    assert rand.seed_entropy() == 42
+    rand.init(None)
+    entropy = rand.seed_entropy()
+    rand.init(None)
+    assert rand.seed_entropy() != entropy
+
+
+def test_pair_probabilities():
+    from cdc.util.rand import IndependentDice, JointDice
+    p = IndependentDice([1, 1, 1, 1, 1, 3]).pair_probabilities()
+    assert p.sum() == pytest.approx(1)
+    assert p[35] == pytest.approx(9 / 64)
+    assert p[0] == pytest.approx(1 / 64)
+    w = np.arange(36) + 1
+    assert JointDice(w).pair_probabilities() == pytest.approx(w / w.sum())
+
+
+def test_antithetic_dice():
+    from cdc.util.rand import AntitheticDice, IndependentDice, JointDice
+    for dice in (IndependentDice([1, 2, 1, 1, 1, 3]),
+                 JointDice([0] * 35 + [1]), JointDice([1] + [0] * 35)):
+        anti = AntitheticDice(dice)
+        assert anti.pair_probabilities() == pytest.approx(
+            dice.pair_probabilities())
+        counts = np.bincount(
+            anti.roll_pairs(100000, rng=rand.RollStream(1, 0)), minlength=36)
+        assert counts / 100000 == pytest.approx(
+            dice.pair_probabilities(), abs=0.005)
+        # Both ends of [0, 1] land on pairs that can happen
+        ends = anti.pairs_from_uniforms(np.array([0.0, 1.0]))
+        assert dice.pair_probabilities()[ends].all()
+    anti = AntitheticDice(IndependentDice([1] * 6))
+    u = rand.RollStream(2, 0).random(10000)
+    sums = rand.PAIR_DICE[anti.pairs_from_uniforms(u)].sum(axis=1)
+    twins = rand.PAIR_DICE[anti.pairs_from_uniforms(1 - u)].sum(axis=1)
+    assert set(twins[sums == 7]) == {6, 8}
@@ -0,0 +1,62 @@
+from cdc.util import stats
+from cdc import globals as G
+
+import pytest
+
+
+@pytest.mark.parametrize('method', ['multinomial', 'loop'])
+def test_simulate_roll_distribution(method):
+    n = 36000
+    counts = stats.simulate_roll_distribution(n, method=method)
+    assert sorted(counts) == list(range(2, 12+1))
+    assert sum(counts.values()) == n
+    expected = stats.theoretical_fair_distribution(n)
+    for i in counts:
+        assert abs(counts[i] - expected[i]) < 0.1 * expected[i]
+
+
+@pytest.mark.parametrize('method', ['multinomial', 'loop'])
+def test_simulate_roll_distribution_zero_weights(method):
+    dist = [0] * 11
+    dist[5] = 1
+    counts = stats.simulate_roll_distribution(100, dist, method=method)
+    assert counts[7] == 100
+    assert sum(counts.values()) == 100
+
+
+def test_simulate_roll_distribution_huge():
+    n = 10**12
+    counts = stats.simulate_roll_distribution(n, G.FAIR_DIST)
+    assert sum(counts.values()) == n
+
+
+def test_antithetic_effective_sample_size():
+    # Uncorrelated pairs are worth exactly as much as independent runs
+    pairs = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    ess, rho = stats.antithetic_effective_sample_size(pairs)
+    assert rho == 0
+    assert ess == 8
+    # Negatively correlated pairs are worth more
+    pairs = [(1, -0.5), (2, -2), (3, -3.5), (4, -3)]
+    ess, rho = stats.antithetic_effective_sample_size(pairs)
+    assert rho < 0
+    assert ess > 8
+    # Perfect correlation is capped instead of giving infinity
+    pairs = [(1, -1), (2, -2), (3, -3)]
+    ess, rho = stats.antithetic_effective_sample_size(pairs)
+    assert ess == pytest.approx(18)
+    assert stats.antithetic_effective_sample_size([]) == (0, 0.0)
+
+
+def test_running_stats():
+    import statistics
+    data = [3, 1, 4, 1, 5, 9, 2, 6]
+    rs = stats.RunningStats()
+    assert rs.ci_width() == float('inf')
+    for x in data:
+        rs.add(x)
+    assert rs.n == len(data)
+    assert rs.mean == pytest.approx(statistics.mean(data))
+    assert rs.variance == pytest.approx(statistics.variance(data))
+    assert rs.ci_width() == pytest.approx(
+        2 * 1.96 * statistics.stdev(data) / len(data) ** 0.5)